@@ -4,94 +4,356 @@ Database initialization
 
 import os
 import json
-import time
-import random
+import asyncio
+import zlib
+import base64
+import bisect
+import hashlib
+import logging
+from functools import lru_cache
 from typing import Dict, List, Any, Optional, Union
+from bot.storage import JSONDatabase, SharedJSONDatabase
+from bot.memstats import memory_tracker
 
-# Simple JSON database implementation
-class JSONDatabase:
-    def __init__(self, db_name: str):
-        self.db_name = db_name
-        self.db_path = f"bot/database/data/{db_name}.json"
-        self.data = self._load_db()
-    
-    def _load_db(self) -> Dict:
-        """Load database from file"""
-        # Create directory if it doesn't exist
-        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+logger = logging.getLogger(__name__)
+
+# Append-only change log of a database
+class Journal:
+    """Changes to a database, appended as JSON lines until they are compacted
+    
+    Appending a line is one small write, so every change can be persisted as
+    it happens instead of rewriting the whole database. The owner replays
+    `entries()` over the last snapshot on load, and now and then saves a new
+    snapshot with `compact()`, which writes it in a thread.
+    """
+    
+    def __init__(self, db: JSONDatabase):
+        self.db = db
+        self.path = f"{db.db_path}.journal"
+        self.rotated_path = f"{self.path}.old"
+        self._file = None
+        self._saving: Optional[asyncio.Future] = None
+    
+    def append(self, *entries: List[Any]) -> None:
+        """Persist changes"""
+        if not entries:
+            return
+        if self._file is None:
+            self._file = open(self.path, "a")
+        self._file.write("".join(json.dumps(entry) + "\n" for entry in entries))
+        self._file.flush()
+    
+    def entries(self) -> List[List[Any]]:
+        """Changes not yet compacted, oldest first"""
+        entries = []
+        for path in (self.rotated_path, self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # The last line of a journal may be cut off by a crash
+                        logger.warning(f"Skipped a damaged entry in {path}")
+        return entries
+    
+    async def compact(self, key: str, value: Any) -> None:
+        """Save a snapshot of everything journaled so far under `key`
         
-        # Create file if it doesn't exist
-        if not os.path.exists(self.db_path):
-            with open(self.db_path, "w") as f:
-                json.dump({}, f)
-            return {}
+        The journal is rotated first, so changes appended while the snapshot
+        is written go to a new one. The rotated journal is dropped once the
+        snapshot is saved, and kept if saving failed.
+        """
+        # One snapshot at a time, also when the caller was cancelled during the last one
+        if self._saving and not self._saving.done():
+            await self._saving
+        self._rotate()
+        self._saving = asyncio.get_event_loop().run_in_executor(None, self._save, key, value)
+        await asyncio.shield(self._saving)
+    
+    def _rotate(self) -> None:
+        """Start a new journal, keeping the current one until its snapshot is saved"""
+        if self._file:
+            self._file.close()
+            self._file = None
+        if not os.path.exists(self.path):
+            return
+        if os.path.exists(self.rotated_path):
+            # The last snapshot wasn't saved, keep its changes as well
+            with open(self.path) as current, open(self.rotated_path, "a") as rotated:
+                rotated.write(current.read())
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self.rotated_path)
+    
+    def _save(self, key: str, value: Any) -> None:
+        """Write the snapshot and drop the rotated journal, runs in a thread"""
+        self.db.data[key] = value
+        if self.db._save_db() and os.path.exists(self.rotated_path):
+            os.remove(self.rotated_path)
+
+# Decompress a blob
+@lru_cache(maxsize=256)
+def _inflate(data: str) -> str:
+    """Decode a compressed blob, recently used blobs are cached"""
+    return zlib.decompress(base64.b64decode(data)).decode("utf-8")
+
+# Content-addressed blob store
+class BlobStore:
+    """Stores every distinct text once under its hash
+
+    Each blob counts the database values referencing it and is deleted when
+    the last one goes away. Large texts are compressed. The file is only
+    written when a blob is added or deleted, so the counts saved in it can
+    lag behind and are recounted by `collect` on startup.
+    """
+    
+    def __init__(self, db: JSONDatabase, compress_threshold: int = 512):
+        self.db = db
+        self.compress_threshold = compress_threshold
+    
+    def put(self, text: str) -> str:
+        """Store a text (or add a reference to it) and return its hash"""
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+        blob = self.db.get(digest)
+        if blob:
+            # Only the count changes, it is written with the next new blob
+            blob["refs"] += 1
+            return digest
+        if len(text) >= self.compress_threshold:
+            compressed = base64.b64encode(zlib.compress(text.encode("utf-8"), 9)).decode("ascii")
+            blob = {"refs": 1, "z": True, "data": compressed}
+        else:
+            blob = {"refs": 1, "z": False, "data": text}
+        self.db.set(digest, blob)
+        return digest
+    
+    def get(self, digest: str) -> Optional[str]:
+        """Return the text stored under a hash, None if it is missing"""
+        blob = self.db.get(digest)
+        if not blob:
+            logger.error(f"Missing blob {digest} in {self.db.db_name}")
+            return None
+        return _inflate(blob["data"]) if blob["z"] else blob["data"]
+    
+    def release(self, digests: List[str], save: bool = True) -> None:
+        """Drop one reference per hash, deleting unreferenced blobs
         
-        # Load data from file with retry mechanism
-        max_retries = 5
-        for attempt in range(max_retries):
-            try:
-                with open(self.db_path, "r") as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                # If file is corrupted, create a new one
-                with open(self.db_path, "w") as f:
-                    json.dump({}, f)
-                return {}
-            except Exception as e:
-                # If file is locked, wait and retry
-                if attempt < max_retries - 1:
-                    time.sleep(0.1 + random.random() * 0.3)  # Random backoff
-                else:
-                    # Last attempt failed, return empty dict
-                    print(f"Error loading database {self.db_name}: {str(e)}")
-                    return {}
-    
-    def _save_db(self) -> None:
-        """Save database to file"""
-        # Create directory if it doesn't exist
-        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        The file is only written when a blob is deleted and `save` is set,
+        other changes go out with the next write. `collect` recounts the
+        references on startup if that never happens.
+        """
+        deleted = False
+        for digest in digests:
+            blob = self.db.get(digest)
+            if not blob:
+                continue
+            blob["refs"] -= 1
+            if blob["refs"] <= 0:
+                del self.db.data[digest]
+                deleted = True
+        if deleted and save:
+            self.db._save_db()
+    
+    def collect(self, databases: List["DedupJSONDatabase"]) -> None:
+        """Recount references from all databases and drop unreferenced blobs"""
+        refs = {}
+        for database in databases:
+            for value in database.data.values():
+                digest = DedupJSONDatabase._ref(value)
+                if digest:
+                    refs[digest] = refs.get(digest, 0) + 1
         
-        # Save data to file with retry mechanism
-        max_retries = 5
-        for attempt in range(max_retries):
-            try:
-                with open(self.db_path, "w") as f:
-                    json.dump(self.data, f, indent=4)
-                return
-            except Exception as e:
-                # If file is locked, wait and retry
-                if attempt < max_retries - 1:
-                    time.sleep(0.1 + random.random() * 0.3)  # Random backoff
-                else:
-                    # Last attempt failed, log error
-                    print(f"Error saving database {self.db_name}: {str(e)}")
+        changed = False
+        for digest in self.db.list_keys():
+            count = refs.get(digest, 0)
+            if count == 0:
+                del self.db.data[digest]
+                changed = True
+            elif self.db.data[digest]["refs"] != count:
+                self.db.data[digest]["refs"] = count
+                changed = True
+        if changed:
+            self.db._save_db()
+
+# Database with deduplicated text values
+class DedupJSONDatabase(JSONDatabase):
+    """JSONDatabase that keeps text values in a shared BlobStore
+
+    Values are stored as `{"$blob": hash}` references when `dedup` is on.
+    References are always resolved on read, and existing values are
+    converted on load, so the layer can be switched on and off freely.
+    """
+    
+    def __init__(self, db_name: str, blobs: BlobStore, dedup: bool = True, min_length: int = 128):
+        self.blobs = blobs
+        self.dedup = dedup
+        self.min_length = min_length
+        super().__init__(db_name)
+        self._convert()
+    
+    @staticmethod
+    def _ref(value: Any) -> Optional[str]:
+        """Return the blob hash a stored value references, if any"""
+        if isinstance(value, dict) and len(value) == 1 and "$blob" in value:
+            return value["$blob"]
+        return None
+    
+    def _store(self, value: Any) -> Any:
+        """Turn a value into what is kept in self.data"""
+        if self.dedup and isinstance(value, str) and len(value) >= self.min_length:
+            return {"$blob": self.blobs.put(value)}
+        return value
+    
+    def _convert(self) -> None:
+        """Convert existing values to the current storage mode"""
+        changed = False
+        released = []
+        for key, value in self.data.items():
+            digest = self._ref(value)
+            if self.dedup and digest is None:
+                stored = self._store(value)
+                if stored is not value:
+                    self.data[key] = stored
+                    changed = True
+            elif not self.dedup and digest is not None:
+                text = self.blobs.get(digest)
+                if text is None:
+                    # Keep the dangling reference rather than losing the key
+                    continue
+                self.data[key] = text
+                released.append(digest)
+                changed = True
+        if changed:
+            self._save_db()
+        self.blobs.release(released)
     
     def get(self, key: str, default: Any = None) -> Any:
         """Get value from database"""
-        return self.data.get(key, default)
+        value = self.data.get(key, default)
+        digest = self._ref(value)
+        return self.blobs.get(digest) if digest else value
     
     def set(self, key: str, value: Any) -> None:
-        """Set value in database"""
-        self.data[key] = value
-        self._save_db()
+        """Set value in database
+        
+        The new blob is written before the value referencing it, the old one
+        is released with the next blob write so a set only writes each file once.
+        """
+        old_digest = self._ref(self.data.get(key))
+        super().set(key, self._store(value))
+        if old_digest:
+            self.blobs.release([old_digest], save=False)
     
     def delete(self, key: str) -> None:
         """Delete key from database"""
-        if key in self.data:
-            del self.data[key]
-            self._save_db()
+        digest = self._ref(self.data.get(key))
+        super().delete(key)
+        if digest:
+            self.blobs.release([digest])
+    
+    def delete_many(self, keys: List[str]) -> None:
+        """Delete several keys from database with a single save"""
+        digests = [self._ref(self.data.get(key)) for key in keys]
+        super().delete_many(keys)
+        self.blobs.release([digest for digest in digests if digest])
+
+# Sorted per-chat key index
+class ChatKeyIndex:
+    """Sorted names of the `{chat_id}_{name}` keys of a database, by chat
+
+    Writes should go through the index so it stays in sync with the database.
+    """
+    
+    def __init__(self, db: JSONDatabase):
+        self.db = db
+        self._names: Optional[Dict[str, List[str]]] = None
+        self._versions: Dict[str, int] = {}
+    
+    def _index(self) -> Dict[str, List[str]]:
+        """Build the index on first use"""
+        if self._names is None:
+            names = {}
+            for key in self.db.list_keys():
+                chat_id, separator, name = key.partition("_")
+                if separator:
+                    names.setdefault(chat_id, []).append(name)
+            for chat_names in names.values():
+                chat_names.sort()
+            self._names = names
+        return self._names
     
-    def list_keys(self) -> List[str]:
-        """List all keys in database"""
-        return list(self.data.keys())
+    def names(self, chat_id: str) -> List[str]:
+        """Sorted names of a chat (do not modify the returned list)"""
+        return self._index().get(chat_id, [])
     
-    def contains(self, key: str) -> bool:
-        """Check if key exists in database"""
-        return key in self.data
+    def count(self, chat_id: str) -> int:
+        """Number of names in a chat"""
+        return len(self.names(chat_id))
+    
+    def page(self, chat_id: str, page: int, page_size: int) -> List[str]:
+        """Names on one page of a chat's sorted listing"""
+        return self.names(chat_id)[page * page_size:(page + 1) * page_size]
+    
+    def prefix(self, chat_id: str, prefix: str, limit: int) -> List[str]:
+        """Up to `limit` sorted names of a chat that start with `prefix`"""
+        chat_names = self.names(chat_id)
+        start = bisect.bisect_left(chat_names, prefix)
+        end = bisect.bisect_left(chat_names, prefix + "\uffff", start)
+        return chat_names[start:min(end, start + limit)]
+    
+    def version(self, chat_id: str) -> int:
+        """Counter that changes whenever the names or values of a chat change"""
+        return self._versions.get(chat_id, 0)
+    
+    def set(self, chat_id: str, name: str, value: Any) -> None:
+        """Set a value and index its name"""
+        self.db.set(f"{chat_id}_{name}", value)
+        self._versions[chat_id] = self.version(chat_id) + 1
+        chat_names = self._index().setdefault(chat_id, [])
+        position = bisect.bisect_left(chat_names, name)
+        if position == len(chat_names) or chat_names[position] != name:
+            chat_names.insert(position, name)
+    
+    def delete(self, chat_id: str, name: str) -> None:
+        """Delete a value and drop its name from the index"""
+        self.db.delete(f"{chat_id}_{name}")
+        self._versions[chat_id] = self.version(chat_id) + 1
+        chat_names = self._index().get(chat_id, [])
+        position = bisect.bisect_left(chat_names, name)
+        if position < len(chat_names) and chat_names[position] == name:
+            del chat_names[position]
+    
+    def clear(self, chat_id: str) -> int:
+        """Delete all values of a chat, returns how many were deleted"""
+        chat_names = self._index().pop(chat_id, [])
+        self.db.delete_many([f"{chat_id}_{name}" for name in chat_names])
+        self._versions[chat_id] = self.version(chat_id) + 1
+        return len(chat_names)
+
+# Store note and filter texts once across chats (set DEDUP_STORAGE=1)
+DEDUP_STORAGE = os.getenv("DEDUP_STORAGE", "").lower() in ["1", "true", "yes", "on"]
 
 # Database instances
-notes_db = JSONDatabase("notes")
+blobs_db = JSONDatabase("blobs")
+blob_store = BlobStore(blobs_db)
+notes_db = DedupJSONDatabase("notes", blob_store, DEDUP_STORAGE)
 welcome_db = JSONDatabase("welcome")
-filters_db = JSONDatabase("filters")
+filters_db = DedupJSONDatabase("filters", blob_store, DEDUP_STORAGE)
 warnings_db = JSONDatabase("warnings")
-settings_db = JSONDatabase("settings") 
\ No newline at end of file
+settings_db = JSONDatabase("settings")
+scheduler_db = JSONDatabase("scheduler")
+federation_db = SharedJSONDatabase("federation")
+connections_db = SharedJSONDatabase("connections")
+autodelete_db = JSONDatabase("autodelete")
+
+# Drop blobs left behind by interrupted writes
+blob_store.collect([notes_db, filters_db])
+
+# Per-chat indexes
+notes_index = ChatKeyIndex(notes_db)
+filters_index = ChatKeyIndex(filters_db)
+
+memory_tracker.track("database.notes_index", lambda: notes_index)
+memory_tracker.track("database.filters_index", lambda: filters_index) 
\ No newline at end of file
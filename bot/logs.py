@@ -0,0 +1,173 @@
+"""
+Logging through a background thread, as structured JSON
+"""
+
+import os
+import copy
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+# Log format ("json" or "text") and level
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+
+# Records per second logged in full, beyond that 1 in LOG_SAMPLE_RATE below ERROR is kept
+LOG_BURST = int(os.getenv("LOG_BURST", 200))
+LOG_SAMPLE_RATE = int(os.getenv("LOG_SAMPLE_RATE", 10))
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Context fields added to every record, e.g. the chat and handler of an update
+CONTEXT_FIELDS = ("chat_id", "user_id", "handler", "shard", "sample_rate")
+LOG_CONTEXT: ContextVar[Dict[str, Any]] = ContextVar("log_context", default={})
+
+
+# Add fields to the records logged in a block
+@contextmanager
+def log_context(update: Any = None, **fields: Any):
+    """Add the chat and user of `update` and the given fields to records
+    
+    The fields live in a context variable, so they follow the code through
+    awaits and into the tasks it creates, but not into other handlers.
+    """
+    if update is not None:
+        chat = getattr(update, "chat", None) or getattr(getattr(update, "message", None), "chat", None)
+        user = getattr(update, "from_user", None)
+        fields.setdefault("chat_id", getattr(chat, "id", None))
+        fields.setdefault("user_id", getattr(user, "id", None))
+    
+    token = LOG_CONTEXT.set({
+        **LOG_CONTEXT.get(),
+        **{name: value for name, value in fields.items() if value is not None}
+    })
+    try:
+        yield
+    finally:
+        LOG_CONTEXT.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Copy the log context onto records, in the thread that logs them"""
+    
+    def __init__(self, static: Optional[Dict[str, Any]] = None):
+        super().__init__()
+        self.static = static or {}
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        for name, value in {**self.static, **LOG_CONTEXT.get()}.items():
+            if not hasattr(record, name):
+                setattr(record, name, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Sample records when more than `burst` are logged in a second
+    
+    Beyond the burst only 1 in `rate` records is kept and marked with its
+    sample rate. Errors are always kept.
+    """
+    
+    def __init__(self, burst: int = LOG_BURST, rate: int = LOG_SAMPLE_RATE):
+        super().__init__()
+        self.burst = burst
+        self.rate = max(rate, 1)
+        self.dropped = 0
+        self._second = 0
+        self._count = 0
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR:
+            return True
+        
+        second = int(record.created)
+        if second != self._second:
+            self._second = second
+            self._count = 0
+        self._count += 1
+        
+        if self._count <= self.burst:
+            return True
+        if self._count % self.rate == 0:
+            record.sample_rate = self.rate
+            return True
+        self.dropped += 1
+        return False
+
+
+class JSONFormatter(logging.Formatter):
+    """Format records as one JSON object per line"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for name in CONTEXT_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class BackgroundQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves the formatting to the listener thread
+    
+    The standard QueueHandler formats the record (traceback included)
+    before queueing it; here only the message is merged with its arguments,
+    so mutable arguments can't change before the record is written.
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+# Shared sampler, its dropped count is exposed as a metric
+log_sampler = SamplingFilter()
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+# Set up logging
+def setup_logging() -> None:
+    """Route all logging through a queue to a thread that formats and writes it
+    
+    Logging from the event loop then only costs putting the record on a
+    queue. Calling it again does nothing.
+    """
+    global _listener
+    if _listener:
+        return
+    
+    output = logging.StreamHandler()
+    output.setFormatter(JSONFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+    
+    log_queue = queue.SimpleQueue()
+    handler = BackgroundQueueHandler(log_queue)
+    handler.addFilter(log_sampler)
+    shard = os.getenv("SHARD_INDEX")
+    handler.addFilter(ContextFilter({"shard": int(shard)} if shard is not None else None))
+    
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL.upper())
+    
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+    # Write out what is still queued on exit
+    atexit.register(_listener.stop)
@@ -0,0 +1,117 @@
+"""
+Registry of in-process structures and their approximate memory use
+"""
+
+import sys
+import asyncio
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# Objects visited by a whole report at most, so huge structures can't keep it running for long
+MAX_SIZED_OBJECTS = 2_000_000
+
+# Objects visited between yields to the event loop
+YIELD_INTERVAL = 10_000
+
+# Objects of these packages are sized with their attributes, others only shallowly
+# (e.g. a Client, which would otherwise pull in everything it references)
+TRAVERSED_MODULES = ("bot.", "pyrogram.types.")
+
+ATOMIC_TYPES = (str, bytes, int, float, bool, type(None))
+CONTAINER_TYPES = (list, tuple, set, frozenset, deque)
+
+
+class StructureSize(NamedTuple):
+    name: str
+    entries: Optional[int]
+    size: int
+    complete: bool
+
+
+# Approximate the size of an object and everything it holds
+async def deep_sizeof(obj: Any, exclude: Iterable[int] = (), limit: int = MAX_SIZED_OBJECTS) -> Tuple[int, bool, int]:
+    """Return the summed sys.getsizeof of an object graph, whether it was sized
+    completely and the number of objects visited
+    
+    Objects whose id is in `exclude` are skipped, along with everything only
+    reachable through them. Objects shared between structures are counted in
+    each of them, so the sizes are approximate. Other tasks get to run every
+    YIELD_INTERVAL objects.
+    """
+    seen = set(exclude)
+    stack = [obj]
+    size = 0
+    visited = 0
+    while stack:
+        if visited >= limit:
+            return size, False, visited
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        visited += 1
+        if visited % YIELD_INTERVAL == 0:
+            await asyncio.sleep(0)
+        
+        if isinstance(item, ATOMIC_TYPES):
+            continue
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, CONTAINER_TYPES):
+            stack.extend(item)
+        elif type(item).__module__.startswith(TRAVERSED_MODULES):
+            if hasattr(item, "__dict__"):
+                stack.append(item.__dict__)
+            for slot in getattr(type(item), "__slots__", ()):
+                if hasattr(item, slot):
+                    stack.append(getattr(item, slot))
+    return size, True, visited
+
+
+class MemoryTracker:
+    """Named in-process structures that may grow, such as caches and indexes
+    
+    Structures are registered with a function returning them, so ones that
+    are replaced (e.g. a database reloaded from disk) are still found.
+    """
+    
+    def __init__(self):
+        self._structures: Dict[str, Callable[[], Any]] = {}
+    
+    def track(self, name: str, getter: Callable[[], Any]) -> None:
+        """Register a structure, replacing one registered under the same name"""
+        self._structures[name] = getter
+    
+    async def report(self, limit: int = MAX_SIZED_OBJECTS) -> List[StructureSize]:
+        """Return the entry count and size of every structure, largest first
+        
+        Registered structures are excluded from each other's sizes, so an
+        index referencing its database doesn't count the database again.
+        All structures share a budget of `limit` visited objects, the ones
+        left when it runs out are marked incomplete.
+        """
+        roots = {}
+        for name, getter in self._structures.items():
+            try:
+                roots[name] = getter()
+            except Exception:
+                continue
+        root_ids = {id(root) for root in roots.values()}
+        
+        sizes = []
+        for name, root in roots.items():
+            size, complete, visited = await deep_sizeof(root, root_ids - {id(root)}, limit)
+            limit -= visited
+            try:
+                entries = len(root)
+            except TypeError:
+                entries = None
+            sizes.append(StructureSize(name, entries, size, complete))
+        sizes.sort(key=lambda structure: structure.size, reverse=True)
+        return sizes
+
+
+# Shared tracker instance
+memory_tracker = MemoryTracker()
@@ -0,0 +1,402 @@
+"""
+Metrics registry exposed in Prometheus text format
+"""
+
+import os
+import time
+import bisect
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from aiohttp import web
+from pyrogram import Client, ContinuePropagation, StopPropagation
+from pyrogram.errors import FloodWait, RPCError
+from pyrogram.handlers import RawUpdateHandler
+from pyrogram.handlers.handler import Handler
+from pyrogram.session import Session
+from bot.memstats import memory_tracker
+from bot.storage import set_timers
+from bot.logs import log_context, log_sampler
+
+logger = logging.getLogger(__name__)
+
+# Local port of the metrics endpoint, disabled when not set
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Handlers taking longer than this are logged, in seconds
+SLOW_HANDLER_SECONDS = float(os.getenv("SLOW_HANDLER_SECONDS", 3))
+
+# Histogram buckets in seconds, from a fast dict lookup to a slow API call
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+LabelValues = Tuple[str, ...]
+
+
+# Format a label set
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    """Return `{name="value",...}` with Prometheus escaping, empty without labels"""
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+# Format a sample value
+def format_value(value: float) -> str:
+    """Return a sample value, integers without a fraction"""
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """Base of all metric types
+    
+    A metric holds one child per label value combination. Handlers that
+    update the same labels on every call should keep the child returned by
+    `labels` instead of looking it up each time.
+    """
+    
+    type_name = "untyped"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[LabelValues, "Metric"] = {}
+    
+    def labels(self, *values: str) -> "Metric":
+        """Return the child of a label value combination"""
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            child = self._children[values] = self._new_child()
+        return child
+    
+    def _new_child(self) -> "Metric":
+        """Create the child holding the value of one label combination"""
+        raise NotImplementedError
+    
+    def children(self) -> Dict[LabelValues, "Metric"]:
+        """Return the children by label values"""
+        return dict(self._children)
+    
+    def clear(self) -> None:
+        """Drop all children"""
+        self._children.clear()
+    
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        """Yield (name suffix, formatted labels, value) of every child"""
+        # Metrics without labels hold their value themselves
+        if not self.labelnames:
+            yield from self._child_samples((), ())
+            return
+        for values, child in self._children.items():
+            yield from child._child_samples(self.labelnames, values)
+    
+    def _child_samples(self, names: Sequence[str], values: LabelValues) -> Iterable[Tuple[str, str, float]]:
+        raise NotImplementedError
+    
+    def render(self) -> List[str]:
+        """Return the lines of the metric in Prometheus text format"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    """Value that only goes up, e.g. handled updates"""
+    
+    type_name = "counter"
+    
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        function: Optional[Callable[[], float]] = None
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.value = 0.0
+        self.function = function
+    
+    def _new_child(self) -> "Counter":
+        return Counter(self.name, self.documentation)
+    
+    def inc(self, amount: float = 1) -> None:
+        """Increase the counter"""
+        self.value += amount
+    
+    def _child_samples(self, names, values):
+        yield "", format_labels(names, values), self.function() if self.function else self.value
+
+
+class Gauge(Metric):
+    """Value that goes up and down, e.g. queued updates
+    
+    With `function` the value is read when the metrics are scraped, which
+    keeps sizes of queues and caches out of the code that changes them.
+    """
+    
+    type_name = "gauge"
+    
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        function: Optional[Callable[[], float]] = None
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.value = 0.0
+        self.function = function
+    
+    def _new_child(self) -> "Gauge":
+        return Gauge(self.name, self.documentation)
+    
+    def set(self, value: float) -> None:
+        """Set the gauge"""
+        self.value = value
+    
+    def inc(self, amount: float = 1) -> None:
+        """Increase the gauge"""
+        self.value += amount
+    
+    def dec(self, amount: float = 1) -> None:
+        """Decrease the gauge"""
+        self.value -= amount
+    
+    def _child_samples(self, names, values):
+        yield "", format_labels(names, values), self.function() if self.function else self.value
+
+
+class Histogram(Metric):
+    """Distribution of observed values, e.g. handler latencies
+    
+    Observations are counted per bucket; the cumulative counts Prometheus
+    expects are only computed when the metrics are scraped.
+    """
+    
+    type_name = "histogram"
+    
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+    
+    def _new_child(self) -> "Histogram":
+        return Histogram(self.name, self.documentation, buckets=self.buckets)
+    
+    def observe(self, value: float) -> None:
+        """Record a value"""
+        self.sum += value
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+    
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile as the upper bound of the bucket it falls in"""
+        target = q * sum(self.counts)
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            if total >= target:
+                return bound
+        return float("inf")
+    
+    def _child_samples(self, names, values):
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            le = "+Inf" if bound == float("inf") else format_value(bound)
+            yield "_bucket", format_labels(names + ("le",), values + (le,)), total
+        yield "_sum", format_labels(names, values), self.sum
+        yield "_count", format_labels(names, values), total
+
+
+class MetricsRegistry:
+    """Collection of metrics served on a local HTTP endpoint"""
+    
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._runner: Optional[web.AppRunner] = None
+    
+    def _register(self, metric: Metric) -> Metric:
+        """Add a metric, names must be unique"""
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+    
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = (), function: Optional[Callable[[], float]] = None) -> Counter:
+        """Register a counter"""
+        return self._register(Counter(name, documentation, labelnames, function))
+    
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (), function: Optional[Callable[[], float]] = None) -> Gauge:
+        """Register a gauge"""
+        return self._register(Gauge(name, documentation, labelnames, function))
+    
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """Register a histogram"""
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+    
+    def render(self) -> str:
+        """Return all metrics in Prometheus text format"""
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines += metric.render()
+            except Exception as e:
+                logger.warning(f"Failed to collect metric {metric.name}: {str(e)}")
+        return "\n".join(lines) + "\n"
+    
+    async def _handle(self, request: web.Request) -> web.Response:
+        """Serve the metrics"""
+        return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+    
+    async def start(self, port: int, host: str = "127.0.0.1") -> None:
+        """Serve the metrics on http://host:port/metrics"""
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    
+    async def stop(self) -> None:
+        """Stop serving the metrics"""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+# Shared registry instance
+metrics = MetricsRegistry()
+memory_tracker.track("metrics.metrics", lambda: metrics)
+
+UPDATES = metrics.counter("bot_updates_total", "Updates received, by raw update type", ["type"])
+HANDLER_SECONDS = metrics.histogram("bot_handler_seconds", "Time spent in update handlers", ["handler"])
+HANDLER_ERRORS = metrics.counter("bot_handler_errors_total", "Update handlers that raised an error", ["handler"])
+SLOW_HANDLERS = metrics.counter("bot_slow_handlers_total", "Handler runs slower than SLOW_HANDLER_SECONDS", ["handler"])
+DB_SAVE_SECONDS = metrics.histogram("bot_db_save_seconds", "Time spent writing a database file", ["db"])
+DB_LOAD_SECONDS = metrics.histogram("bot_db_load_seconds", "Time spent reading a database file", ["db"])
+API_SECONDS = metrics.histogram("bot_api_request_seconds", "Duration of Telegram API requests, waits included", ["method"])
+API_ERRORS = metrics.counter("bot_api_errors_total", "Telegram API requests that failed", ["method", "error"])
+FLOOD_WAITS = metrics.counter("bot_flood_waits_total", "FloodWait errors received", ["method"])
+FLOOD_WAIT_SECONDS = metrics.counter("bot_flood_wait_seconds_total", "Seconds Telegram asked to wait", ["method"])
+metrics.counter("bot_log_records_dropped_total", "Log records dropped by sampling", function=lambda: log_sampler.dropped)
+
+
+# Get the metric label of a handler
+def handler_name(func: Callable) -> str:
+    """Return `module.function` of a handler, e.g. `warnings.warn_user`"""
+    return f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+
+# Time the database loads and saves
+def instrument_databases() -> None:
+    """Record the duration of every database load and save"""
+    set_timers(
+        lambda db_name, seconds: DB_LOAD_SECONDS.labels(db_name).observe(seconds),
+        lambda db_name, seconds: DB_SAVE_SECONDS.labels(db_name).observe(seconds)
+    )
+
+
+# Time a handler
+async def observe_handler(name: str, awaitable: Awaitable, update: Any = None) -> None:
+    """Await a handler, recording its duration and whether it raised or was slow
+    
+    Records logged meanwhile carry the handler and the update's chat and user.
+    """
+    start = time.perf_counter()
+    try:
+        with log_context(update, handler=name):
+            return await awaitable
+    except (StopPropagation, ContinuePropagation):
+        raise
+    except Exception:
+        HANDLER_ERRORS.labels(name).inc()
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        HANDLER_SECONDS.labels(name).observe(duration)
+        if duration >= SLOW_HANDLER_SECONDS:
+            SLOW_HANDLERS.labels(name).inc()
+            logger.warning(f"Slow handler {name} took {duration:.2f}s")
+
+
+# Time the handlers of a client
+def instrument_handlers(client: Client, handlers: List[Tuple[Handler, int]], exclude: List[Callable] = ()) -> None:
+    """Record the duration of the given handlers and count the client's updates
+    
+    The handlers are wrapped in place, before they are added to the client.
+    Handlers that run other handlers, such as the command router, are
+    excluded and time the handlers they run themselves.
+    """
+    for handler, _ in handlers:
+        if handler.callback in exclude:
+            continue
+        handler.callback = timed_callback(handler.callback)
+    
+    async def count_update(_, update, __, ___):
+        UPDATES.labels(type(update).__name__).inc()
+    client.add_handler(RawUpdateHandler(count_update), group=-1000)
+
+
+def timed_callback(callback: Callable) -> Callable:
+    """Turn a handler callback into one that records its duration"""
+    name = handler_name(callback)
+    async def timed(client: Client, *args):
+        await observe_handler(name, callback(client, *args), args[0] if args else None)
+    return timed
+
+
+# Time the API requests of a client
+def instrument_client(client: Client) -> None:
+    """Record the duration and errors of every API request, FloodWaits included
+    
+    Pyrogram silently sleeps through FloodWaits below the client's sleep
+    threshold. Requests are made with a threshold of 0 instead and the
+    waiting is done here, so every FloodWait is counted.
+    """
+    invoke = client.invoke
+    
+    async def instrumented_invoke(
+        query,
+        retries: int = Session.MAX_RETRIES,
+        timeout: float = Session.WAIT_TIMEOUT,
+        sleep_threshold: float = None
+    ):
+        method = query.QUALNAME.split(".", 1)[-1]
+        threshold = client.sleep_threshold if sleep_threshold is None else sleep_threshold
+        start = time.perf_counter()
+        try:
+            while True:
+                try:
+                    return await invoke(query, retries, timeout, 0)
+                except FloodWait as e:
+                    FLOOD_WAITS.labels(method).inc()
+                    FLOOD_WAIT_SECONDS.labels(method).inc(e.value)
+                    if e.value > threshold >= 0:
+                        raise
+                    logger.warning(f"Waiting {e.value} seconds before retrying {method} (FloodWait)")
+                    await asyncio.sleep(e.value)
+        except RPCError as e:
+            API_ERRORS.labels(method, e.ID or type(e).__name__).inc()
+            raise
+        finally:
+            API_SECONDS.labels(method).observe(time.perf_counter() - start)
+    
+    client.invoke = instrumented_invoke
@@ -2,14 +2,39 @@
 Bot modules initialization
 """
 
+import os
+from typing import List
+
 # List of all modules to be loaded
 ALL_MODULES = [
     "admin",
+    "captcha",
     "welcome",
     "notes",
     "filters",
     "help",
     "start",
     "antiflood",
-    "warnings"
-] 
\ No newline at end of file
+    "warnings",
+    "federation",
+    "devtools"
+]
+
+# Get modules enabled for this deployment
+def get_enabled_modules() -> List[str]:
+    """Return the modules to load, filtered by ENABLED_MODULES and DISABLED_MODULES
+    
+    Both variables are comma-separated module names. When ENABLED_MODULES is
+    not set every module is enabled.
+    """
+    enabled = [name.strip() for name in os.getenv("ENABLED_MODULES", "").split(",") if name.strip()]
+    disabled = [name.strip() for name in os.getenv("DISABLED_MODULES", "").split(",") if name.strip()]
+    return [
+        name for name in ALL_MODULES
+        if (not enabled or name in enabled) and name not in disabled
+    ]
+
+# Check if a module is enabled
+def is_module_enabled(module_name: str) -> bool:
+    """Check if a module is enabled for this deployment"""
+    return module_name in get_enabled_modules()
\ No newline at end of file
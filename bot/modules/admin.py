@@ -1,20 +1,39 @@
 import time
-import asyncio
-from pyrogram import Client, filters
-from pyrogram.types import Message, ChatPermissions
+from typing import Awaitable, Callable, Optional
+from pyrogram import Client
+from pyrogram.types import Message, Chat, ChatPermissions
 from pyrogram.errors import UserAdminInvalid, ChatAdminRequired, UserNotParticipant
 
-from bot.utils import extract_user, is_admin, is_bot_admin, get_readable_time
+from bot.database import settings_db
+from bot.utils import (
+    extract_user,
+    extract_users,
+    is_admin,
+    is_bot_admin,
+    get_chat_admins,
+    get_readable_time,
+    parse_time,
+    gather_bounded,
+    action_scheduler,
+    kick_member,
+    ban_member,
+    mute_member,
+    schedule_cleanup,
+    command
+)
+from bot.utils.scheduler import CAPTCHA_ACTION
 
 # Module info
 __MODULE__ = "Admin"
 __HELP__ = """
 **Admin Commands:**
 
-/ban [user] [reason] - Ban a user from the group
+/ban [users] [reason] - Ban one or more users from the group
+/tban [users] [time] [reason] - Ban users for a while, e.g. `/tban @user 1d`
 /unban [user] - Unban a user from the group
-/kick [user] [reason] - Kick a user from the group
-/mute [user] [reason] - Mute a user in the group
+/kick [users] [reason] - Kick one or more users from the group
+/mute [users] [reason] - Mute one or more users in the group
+/tmute [users] [time] [reason] - Mute users for a while, e.g. `/tmute @user 2h`
 /unmute [user] - Unmute a user in the group
 /promote [user] - Promote a user to admin
 /demote [user] - Demote an admin to regular user
@@ -22,53 +41,154 @@ __HELP__ = """
 /unpin - Unpin the replied message
 /unpinall - Unpin all pinned messages
 /purge - Purge messages from replied message to current message
+/autodelete [seconds|off] - Delete welcomes, flood notices and moderation replies after a delay
+
+/ban, /kick and /mute accept several user IDs or usernames at once, e.g. `/ban 123 @spammer 456 spam wave`.
+Durations use s, m, h, d or w, e.g. `30m`, `2h`, `1d`.
 """
 
-# Ban command handler
-@Client.on_message(filters.command("ban") & filters.group)
-async def ban_user(client: Client, message: Message):
-    """Ban a user from the group"""
+# Longest auto-delete delay, Telegram only lets bots delete messages for 48 hours
+MAX_AUTODELETE_DELAY = 172800
+
+# Maximum number of moderation API calls in flight per command
+MAX_CONCURRENT_ACTIONS = 10
+
+# Moderation actions
+async def ban_action(chat: Chat, user_id: int):
+    """Ban a user from the chat"""
+    await ban_member(chat, user_id)
+
+async def kick_action(chat: Chat, user_id: int):
+    """Kick a user from the chat"""
+    await kick_member(chat, user_id)
+
+async def mute_action(chat: Chat, user_id: int):
+    """Mute a user in the chat"""
+    await mute_member(chat, user_id)
+
+# Shared multi-target moderation flow
+async def moderate_users(
+    message: Message,
+    verb: str,
+    done: str,
+    where: str,
+    action: Callable[[Chat, int], Awaitable[None]],
+    expire_action: Optional[str] = None
+):
+    """Apply a moderation action to every user targeted by the command
+
+    Permissions are checked once per command, the targets are processed
+    concurrently and a single summary is sent back. With `expire_action`
+    the first argument after the users is a duration, and the scheduler
+    runs `expire_action` for every user once it has passed.
+    """
     # Check if the bot is admin
     if not await is_bot_admin(message):
-        await message.reply_text("I need to be an admin to ban users!")
+        await message.reply_text(f"I need to be an admin to {verb} users!")
         return
     
     # Check if the user is admin
     if not await is_admin(message, message.from_user.id):
-        await message.reply_text("You need to be an admin to ban users!")
+        await message.reply_text(f"You need to be an admin to {verb} users!")
         return
     
-    # Extract user to ban
-    user = await extract_user(message)
-    if not user:
+    # Extract users to act on
+    users, missing, args = await extract_users(message)
+    if not users and not missing:
         await message.reply_text("I can't find that user.")
         return
     
-    # Check if the user is an admin
-    if await is_admin(message, user.id):
-        await message.reply_text("I can't ban an admin!")
-        return
-    
-    # Get reason if provided
-    reason = ""
-    if len(message.command) > 1:
-        reason = " ".join(message.command[1:])
-    
-    # Ban the user
-    try:
-        await message.chat.ban_member(user.id)
+    # Get duration for timed actions
+    if expire_action:
+        duration = parse_time(args.pop(0)) if args else None
+        if not duration:
+            await message.reply_text("Please provide a valid duration, e.g. `30m`, `2h` or `1d`!")
+            return
         
-        # Send ban message
-        ban_text = f"Banned {user.mention} from the group!"
-        if reason:
-            ban_text += f"\nReason: {reason}"
+        where += f" for {get_readable_time(duration)}"
+        permanent_action = action
         
-        await message.reply_text(ban_text)
-    except Exception as e:
-        await message.reply_text(f"Failed to ban user: {str(e)}")
+        async def action(chat: Chat, user_id: int):
+            await permanent_action(chat, user_id)
+            action_scheduler.schedule(expire_action, chat.id, user_id, duration)
+    
+    reason = " ".join(args)
+    
+    # Skip duplicates and admins
+    admins = set(await get_chat_admins(message))
+    targets = []
+    skipped = []
+    seen = set()
+    for user in users:
+        if user.id in seen:
+            continue
+        seen.add(user.id)
+        if user.id in admins:
+            skipped.append(user)
+        else:
+            targets.append(user)
+    
+    # Single target keeps the plain reply
+    if len(targets) == 1 and not skipped and not missing:
+        user = targets[0]
+        try:
+            await action(message.chat, user.id)
+        except Exception as e:
+            await message.reply_text(f"Failed to {verb} user: {str(e)}")
+            return
+        
+        text = f"{done} {user.mention} {where}!"
+        if reason:
+            text += f"\nReason: {reason}"
+        schedule_cleanup(await message.reply_text(text))
+        return
+    
+    if len(users) == 1 and skipped:
+        await message.reply_text(f"I can't {verb} an admin!")
+        return
+    
+    # Run the action for all targets concurrently
+    results = await gather_bounded(
+        lambda user: action(message.chat, user.id),
+        targets,
+        MAX_CONCURRENT_ACTIONS
+    )
+    
+    # Build summary
+    succeeded = 0
+    lines = []
+    for user, result in zip(targets, results):
+        if isinstance(result, Exception):
+            lines.append(f"- {user.mention}: failed ({str(result)})")
+        else:
+            succeeded += 1
+            lines.append(f"- {user.mention}: done")
+    for user in skipped:
+        lines.append(f"- {user.mention}: skipped (admin)")
+    for identifier in missing:
+        lines.append(f"- `{identifier}`: user not found")
+    
+    text = f"{done} {succeeded}/{len(targets)} users {where}!"
+    if reason:
+        text += f"\nReason: {reason}"
+    text += "\n\n" + "\n".join(lines)
+    
+    schedule_cleanup(await message.reply_text(text))
+
+# Ban command handler
+@command("ban", group_only=True)
+async def ban_user(client: Client, message: Message):
+    """Ban one or more users from the group"""
+    await moderate_users(message, "ban", "Banned", "from the group", ban_action)
+
+# Temporary ban command handler
+@command("tban", group_only=True)
+async def temp_ban_user(client: Client, message: Message):
+    """Ban one or more users from the group for a while"""
+    await moderate_users(message, "ban", "Banned", "from the group", ban_action, "unban")
 
 # Unban command handler
-@Client.on_message(filters.command("unban") & filters.group)
+@command("unban", group_only=True)
 async def unban_user(client: Client, message: Message):
     """Unban a user from the group"""
     # Check if the bot is admin
@@ -90,108 +210,31 @@ async def unban_user(client: Client, message: Message):
     # Unban the user
     try:
         await message.chat.unban_member(user.id)
+        action_scheduler.cancel("unban", message.chat.id, user.id)
         await message.reply_text(f"Unbanned {user.mention} from the group!")
     except Exception as e:
         await message.reply_text(f"Failed to unban user: {str(e)}")
 
 # Kick command handler
-@Client.on_message(filters.command("kick") & filters.group)
+@command("kick", group_only=True)
 async def kick_user(client: Client, message: Message):
-    """Kick a user from the group"""
-    # Check if the bot is admin
-    if not await is_bot_admin(message):
-        await message.reply_text("I need to be an admin to kick users!")
-        return
-    
-    # Check if the user is admin
-    if not await is_admin(message, message.from_user.id):
-        await message.reply_text("You need to be an admin to kick users!")
-        return
-    
-    # Extract user to kick
-    user = await extract_user(message)
-    if not user:
-        await message.reply_text("I can't find that user.")
-        return
-    
-    # Check if the user is an admin
-    if await is_admin(message, user.id):
-        await message.reply_text("I can't kick an admin!")
-        return
-    
-    # Get reason if provided
-    reason = ""
-    if len(message.command) > 1:
-        reason = " ".join(message.command[1:])
-    
-    # Kick the user
-    try:
-        await message.chat.ban_member(user.id)
-        await asyncio.sleep(1)  # Wait a second
-        await message.chat.unban_member(user.id)  # Unban to allow them to join again
-        
-        # Send kick message
-        kick_text = f"Kicked {user.mention} from the group!"
-        if reason:
-            kick_text += f"\nReason: {reason}"
-        
-        await message.reply_text(kick_text)
-    except Exception as e:
-        await message.reply_text(f"Failed to kick user: {str(e)}")
+    """Kick one or more users from the group"""
+    await moderate_users(message, "kick", "Kicked", "from the group", kick_action)
 
 # Mute command handler
-@Client.on_message(filters.command("mute") & filters.group)
+@command("mute", group_only=True)
 async def mute_user(client: Client, message: Message):
-    """Mute a user in the group"""
-    # Check if the bot is admin
-    if not await is_bot_admin(message):
-        await message.reply_text("I need to be an admin to mute users!")
-        return
-    
-    # Check if the user is admin
-    if not await is_admin(message, message.from_user.id):
-        await message.reply_text("You need to be an admin to mute users!")
-        return
-    
-    # Extract user to mute
-    user = await extract_user(message)
-    if not user:
-        await message.reply_text("I can't find that user.")
-        return
-    
-    # Check if the user is an admin
-    if await is_admin(message, user.id):
-        await message.reply_text("I can't mute an admin!")
-        return
-    
-    # Get reason if provided
-    reason = ""
-    if len(message.command) > 1:
-        reason = " ".join(message.command[1:])
-    
-    # Mute the user
-    try:
-        await message.chat.restrict_member(
-            user.id,
-            ChatPermissions(
-                can_send_messages=False,
-                can_send_media_messages=False,
-                can_send_other_messages=False,
-                can_add_web_page_previews=False
-            )
-        )
-        
-        # Send mute message
-        mute_text = f"Muted {user.mention} in the group!"
-        if reason:
-            mute_text += f"\nReason: {reason}"
-        
-        await message.reply_text(mute_text)
-    except Exception as e:
-        await message.reply_text(f"Failed to mute user: {str(e)}")
+    """Mute one or more users in the group"""
+    await moderate_users(message, "mute", "Muted", "in the group", mute_action)
+
+# Temporary mute command handler
+@command("tmute", group_only=True)
+async def temp_mute_user(client: Client, message: Message):
+    """Mute one or more users in the group for a while"""
+    await moderate_users(message, "mute", "Muted", "in the group", mute_action, "unmute")
 
 # Unmute command handler
-@Client.on_message(filters.command("unmute") & filters.group)
+@command("unmute", group_only=True)
 async def unmute_user(client: Client, message: Message):
     """Unmute a user in the group"""
     # Check if the bot is admin
@@ -223,13 +266,16 @@ async def unmute_user(client: Client, message: Message):
                 can_invite_users=True
             )
         )
+        action_scheduler.cancel("unmute", message.chat.id, user.id)
+        # Unmuted by hand, so they don't have to pass the captcha anymore
+        action_scheduler.cancel(CAPTCHA_ACTION, message.chat.id, user.id)
         
         await message.reply_text(f"Unmuted {user.mention} in the group!")
     except Exception as e:
         await message.reply_text(f"Failed to unmute user: {str(e)}")
 
 # Promote command handler
-@Client.on_message(filters.command("promote") & filters.group)
+@command("promote", group_only=True)
 async def promote_user(client: Client, message: Message):
     """Promote a user to admin"""
     # Check if the bot is admin
@@ -265,7 +311,7 @@ async def promote_user(client: Client, message: Message):
         await message.reply_text(f"Failed to promote user: {str(e)}")
 
 # Demote command handler
-@Client.on_message(filters.command("demote") & filters.group)
+@command("demote", group_only=True)
 async def demote_user(client: Client, message: Message):
     """Demote an admin to regular user"""
     # Check if the bot is admin
@@ -301,7 +347,7 @@ async def demote_user(client: Client, message: Message):
         await message.reply_text(f"Failed to demote user: {str(e)}")
 
 # Pin command handler
-@Client.on_message(filters.command("pin") & filters.group)
+@command("pin", group_only=True)
 async def pin_message(client: Client, message: Message):
     """Pin the replied message"""
     # Check if the bot is admin
@@ -327,7 +373,7 @@ async def pin_message(client: Client, message: Message):
         await message.reply_text(f"Failed to pin message: {str(e)}")
 
 # Unpin command handler
-@Client.on_message(filters.command("unpin") & filters.group)
+@command("unpin", group_only=True)
 async def unpin_message(client: Client, message: Message):
     """Unpin the replied message"""
     # Check if the bot is admin
@@ -353,7 +399,7 @@ async def unpin_message(client: Client, message: Message):
         await message.reply_text(f"Failed to unpin message: {str(e)}")
 
 # Unpin all command handler
-@Client.on_message(filters.command("unpinall") & filters.group)
+@command("unpinall", group_only=True)
 async def unpin_all_messages(client: Client, message: Message):
     """Unpin all pinned messages"""
     # Check if the bot is admin
@@ -374,7 +420,7 @@ async def unpin_all_messages(client: Client, message: Message):
         await message.reply_text(f"Failed to unpin all messages: {str(e)}")
 
 # Purge command handler
-@Client.on_message(filters.command("purge") & filters.group)
+@command("purge", group_only=True)
 async def purge_messages(client: Client, message: Message):
     """Purge messages from replied message to current message"""
     # Check if the bot is admin
@@ -402,4 +448,42 @@ async def purge_messages(client: Client, message: Message):
         await client.delete_messages(message.chat.id, message_ids)
         await message.reply_text(f"Purged {len(message_ids)} messages!")
     except Exception as e:
-        await message.reply_text(f"Failed to purge messages: {str(e)}") 
\ No newline at end of file
+        await message.reply_text(f"Failed to purge messages: {str(e)}")
+
+# Auto-delete command handler
+@command("autodelete", group_only=True)
+async def set_autodelete(client: Client, message: Message):
+    """Show or set the auto-delete delay for bot messages"""
+    chat_id = str(message.chat.id)
+    
+    # Check if command has arguments
+    if len(message.command) < 2:
+        delay = settings_db.get(f"{chat_id}_autodelete", 0)
+        status = f"after {get_readable_time(delay)}" if delay > 0 else "off"
+        await message.reply_text(
+            f"Auto-delete is currently **{status}**.\n\n"
+            "Use `/autodelete [seconds]` to set the delay or `/autodelete off` to disable it."
+        )
+        return
+    
+    # Check if the user is admin
+    if not await is_admin(message, message.from_user.id):
+        await message.reply_text("You need to be an admin to change auto-delete settings!")
+        return
+    
+    arg = message.command[1].lower()
+    
+    # Disable auto-delete
+    if arg in ["off", "no", "disable", "0"]:
+        settings_db.delete(f"{chat_id}_autodelete")
+        await message.reply_text("Auto-delete has been disabled!")
+        return
+    
+    # Try to parse the delay
+    delay = int(arg) if arg.isdigit() else parse_time(arg)
+    if not delay or delay > MAX_AUTODELETE_DELAY:
+        await message.reply_text("Please provide a delay between 1 second and 2 days, e.g. `60` or `5m`!")
+        return
+    
+    settings_db.set(f"{chat_id}_autodelete", delay)
+    await message.reply_text(f"Bot messages will be deleted after {get_readable_time(delay)}.")
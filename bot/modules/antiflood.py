@@ -1,9 +1,13 @@
 import time
+import logging
 from collections import defaultdict
-from pyrogram import Client, filters
-from pyrogram.types import Message, ChatPermissions
+from pyrogram import Client
+from pyrogram.types import Message
 from bot.database import settings_db
-from bot.utils import is_admin, is_bot_admin
+from bot.memstats import memory_tracker
+from bot.utils import is_admin, is_bot_admin, kick_member, ban_member, mute_member, schedule_cleanup, message_pipeline, UpdateContext, command
+
+logger = logging.getLogger(__name__)
 
 # Module info
 __MODULE__ = "Anti-Flood"
@@ -26,9 +30,10 @@ DEFAULT_FLOOD_MODE = "mute"  # Options: mute, kick, ban
 
 # Store user message counts
 FLOOD_USERS = defaultdict(lambda: {"count": 0, "last_msg_time": 0})
+memory_tracker.track("antiflood.FLOOD_USERS", lambda: FLOOD_USERS)
 
 # Set flood limit handler
-@Client.on_message(filters.command("setflood") & filters.group)
+@command("setflood", group_only=True)
 async def set_flood_limit(client: Client, message: Message):
     """Set the flood limit"""
     chat_id = str(message.chat.id)
@@ -62,7 +67,7 @@ async def set_flood_limit(client: Client, message: Message):
         await message.reply_text("Please provide a valid number for the flood limit!")
 
 # Set flood time handler
-@Client.on_message(filters.command("setfloodtime") & filters.group)
+@command("setfloodtime", group_only=True)
 async def set_flood_time(client: Client, message: Message):
     """Set the flood time frame"""
     chat_id = str(message.chat.id)
@@ -96,7 +101,7 @@ async def set_flood_time(client: Client, message: Message):
         await message.reply_text("Please provide a valid number of seconds for the flood time frame!")
 
 # Flood settings handler
-@Client.on_message(filters.command("flood") & filters.group)
+@command("flood", group_only=True)
 async def flood_settings(client: Client, message: Message):
     """Show or toggle flood settings"""
     chat_id = str(message.chat.id)
@@ -140,26 +145,31 @@ async def flood_settings(client: Client, message: Message):
         "Use `/flood on/off` to enable/disable flood protection."
     )
 
-# Flood detection handler
-@Client.on_message(filters.group & ~filters.service & ~filters.me & ~filters.bot & ~filters.edited)
-async def check_flood(client: Client, message: Message):
-    """Check for message flooding"""
-    chat_id = str(message.chat.id)
-    user_id = message.from_user.id
+# Flood detection hook, runs before notes and filters
+@message_pipeline.hook(10, essential=True)
+async def check_flood(client: Client, ctx: UpdateContext):
+    """Check for message flooding, stops the pipeline if the sender was punished"""
+    message = ctx.message
+    chat_id = ctx.chat_id
+    user_id = ctx.user_id
     
-    # Skip if user is admin
-    if await is_admin(message, user_id):
+    # Skip messages of the bot, other bots and anonymous senders
+    if not user_id or message.outgoing or ctx.user.is_bot:
         return
     
     # Check if flood protection is enabled
-    flood_enabled = settings_db.get(f"{chat_id}_flood_enabled", True)
+    flood_enabled = ctx.setting("flood_enabled", True)
     if not flood_enabled:
         return
     
+    # Skip if user is admin
+    if await ctx.sender_is_admin():
+        return
+    
     # Get flood settings
-    flood_limit = settings_db.get(f"{chat_id}_flood_limit", DEFAULT_FLOOD_LIMIT)
-    flood_time = settings_db.get(f"{chat_id}_flood_time", DEFAULT_FLOOD_TIME)
-    flood_mode = settings_db.get(f"{chat_id}_flood_mode", DEFAULT_FLOOD_MODE)
+    flood_limit = ctx.setting("flood_limit", DEFAULT_FLOOD_LIMIT)
+    flood_time = ctx.setting("flood_time", DEFAULT_FLOOD_TIME)
+    flood_mode = ctx.setting("flood_mode", DEFAULT_FLOOD_MODE)
     
     # Get current time
     current_time = time.time()
@@ -188,45 +198,42 @@ async def check_flood(client: Client, message: Message):
         # Apply punishment based on flood mode
         if flood_mode == "mute":
             try:
-                await message.chat.restrict_member(
-                    user_id,
-                    ChatPermissions(
-                        can_send_messages=False,
-                        can_send_media_messages=False,
-                        can_send_other_messages=False,
-                        can_add_web_page_previews=False
-                    )
-                )
+                await mute_member(message.chat, user_id)
                 
-                await message.reply_text(
+                notice = await message.reply_text(
                     f"🛑 {message.from_user.mention} has been muted for flooding!"
                 )
+                schedule_cleanup(notice)
             except Exception as e:
-                print(f"Failed to mute user: {str(e)}")
+                logger.warning(f"Failed to mute flooding user {user_id}: {str(e)}")
         
         elif flood_mode == "kick":
             try:
-                await message.chat.ban_member(user_id)
-                await message.chat.unban_member(user_id)  # Unban to allow them to join again
+                await kick_member(message.chat, user_id)
                 
-                await message.reply_text(
+                notice = await message.reply_text(
                     f"🛑 {message.from_user.mention} has been kicked for flooding!"
                 )
+                schedule_cleanup(notice)
             except Exception as e:
-                print(f"Failed to kick user: {str(e)}")
+                logger.warning(f"Failed to kick flooding user {user_id}: {str(e)}")
         
         elif flood_mode == "ban":
             try:
-                await message.chat.ban_member(user_id)
+                await ban_member(message.chat, user_id)
                 
-                await message.reply_text(
+                notice = await message.reply_text(
                     f"🛑 {message.from_user.mention} has been banned for flooding!"
                 )
+                schedule_cleanup(notice)
             except Exception as e:
-                print(f"Failed to ban user: {str(e)}")
+                logger.warning(f"Failed to ban flooding user {user_id}: {str(e)}")
+        
+        # Don't answer notes or filters of a flooding user
+        return True
 
 # Set flood mode handler
-@Client.on_message(filters.command("setfloodmode") & filters.group)
+@command("setfloodmode", group_only=True)
 async def set_flood_mode(client: Client, message: Message):
     """Set the flood punishment mode"""
     chat_id = str(message.chat.id)
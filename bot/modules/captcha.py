@@ -0,0 +1,159 @@
+import logging
+from typing import List
+from pyrogram import Client, filters
+from pyrogram.types import Message, Chat, User, CallbackQuery, InlineKeyboardButton
+from bot.database import settings_db
+from bot.utils import (
+    is_admin,
+    get_readable_time,
+    parse_time,
+    gather_bounded,
+    MUTED_PERMISSIONS,
+    UNMUTED_PERMISSIONS,
+    action_scheduler,
+    command
+)
+from bot.utils.scheduler import CAPTCHA_ACTION
+
+logger = logging.getLogger(__name__)
+
+# Module info
+__MODULE__ = "Captcha"
+__HELP__ = """
+**Captcha Module:**
+
+/captcha - Show current captcha settings
+/captcha on/off - Enable/disable the captcha for new members
+/captchatime [time] - Set how long new members have to verify, e.g. `5m`
+
+New members are muted until they press the verification button under the welcome message.
+Members who don't verify in time are kicked.
+"""
+
+# Default time new members have to verify, in seconds
+DEFAULT_CAPTCHA_TIME = 300
+MAX_CAPTCHA_TIME = 86400
+
+# Maximum number of restrict requests in flight for one join
+CAPTCHA_CONCURRENCY = 10
+
+# Check if the captcha is enabled
+def captcha_enabled(chat_id: int) -> bool:
+    """Check if new members of the chat have to verify"""
+    return settings_db.get(f"{chat_id}_captcha", False)
+
+# Get captcha timeout
+def get_captcha_time(chat_id: int) -> int:
+    """Return how long new members of the chat have to verify"""
+    return settings_db.get(f"{chat_id}_captcha_time", DEFAULT_CAPTCHA_TIME)
+
+# Mute new members until they verify
+async def gate_new_members(chat: Chat, members: List[User]):
+    """Mute new members and schedule a kick for when their time runs out
+    
+    Pending members are tracked by the shared action scheduler, so a single
+    loop kicks everyone that timed out in batches. The kick is part of the
+    scheduler, pending kicks still run after this module was disabled.
+    """
+    timeout = get_captcha_time(chat.id)
+    
+    results = await gather_bounded(
+        lambda member: chat.restrict_member(member.id, MUTED_PERMISSIONS),
+        members,
+        CAPTCHA_CONCURRENCY
+    )
+    
+    for member, result in zip(members, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Failed to mute new member {member.id} in {chat.id}: {str(result)}")
+            continue
+        action_scheduler.schedule(CAPTCHA_ACTION, chat.id, member.id, timeout)
+
+# Verification button
+def get_captcha_button(chat_id: int) -> InlineKeyboardButton:
+    """Return the verification button for a chat"""
+    return InlineKeyboardButton("✅ I'm not a robot", callback_data=f"captcha_{chat_id}")
+
+# Captcha command handler
+@command("captcha", group_only=True)
+async def captcha_command(client: Client, message: Message):
+    """Show or toggle captcha settings"""
+    chat_id = message.chat.id
+    
+    # Check if command has arguments
+    if len(message.command) > 1:
+        # Check if user is admin
+        if not await is_admin(message, message.from_user.id):
+            await message.reply_text("You need to be an admin to change captcha settings!")
+            return
+        
+        arg = message.command[1].lower()
+        
+        # Enable/disable captcha
+        if arg in ["on", "yes", "enable"]:
+            settings_db.set(f"{chat_id}_captcha", True)
+            await message.reply_text("New members now have to verify before they can chat!")
+            return
+        elif arg in ["off", "no", "disable"]:
+            settings_db.set(f"{chat_id}_captcha", False)
+            await message.reply_text("Captcha has been disabled!")
+            return
+    
+    # Show current captcha settings
+    status = "enabled" if captcha_enabled(chat_id) else "disabled"
+    
+    await message.reply_text(
+        f"Captcha is currently **{status}**.\n"
+        f"New members have {get_readable_time(get_captcha_time(chat_id))} to verify.\n\n"
+        "Use `/captcha on/off` to enable/disable the captcha.\n"
+        "Use `/captchatime [time]` to set the verification time."
+    )
+
+# Captcha time command handler
+@command("captchatime", group_only=True)
+async def set_captcha_time(client: Client, message: Message):
+    """Set how long new members have to verify"""
+    chat_id = message.chat.id
+    
+    # Check if user is admin
+    if not await is_admin(message, message.from_user.id):
+        await message.reply_text("You need to be an admin to change captcha settings!")
+        return
+    
+    # Check if command has arguments
+    if len(message.command) < 2:
+        await message.reply_text("Please provide a verification time, e.g. `5m`!")
+        return
+    
+    # Try to parse the time
+    arg = message.command[1]
+    timeout = int(arg) if arg.isdigit() else parse_time(arg)
+    if not timeout or timeout < 30 or timeout > MAX_CAPTCHA_TIME:
+        await message.reply_text("The verification time must be between 30 seconds and 1 day!")
+        return
+    
+    settings_db.set(f"{chat_id}_captcha_time", timeout)
+    await message.reply_text(f"New members now have {get_readable_time(timeout)} to verify.")
+
+# Verification callback handler
+@Client.on_callback_query(filters.regex(r"^captcha_(-?\d+)$"))
+async def captcha_callback(client: Client, callback_query: CallbackQuery):
+    """Unmute a pending member that pressed the verification button"""
+    chat_id = int(callback_query.data.split("_")[1])
+    user_id = callback_query.from_user.id
+    
+    # Only members that are still pending can verify
+    if not action_scheduler.cancel(CAPTCHA_ACTION, chat_id, user_id):
+        await callback_query.answer("You don't need to verify.", show_alert=True)
+        return
+    
+    try:
+        await client.restrict_chat_member(chat_id, user_id, UNMUTED_PERMISSIONS)
+    except Exception as e:
+        logger.warning(f"Failed to unmute verified member {user_id} in {chat_id}: {str(e)}")
+        # Keep them pending so they can try again
+        action_scheduler.schedule(CAPTCHA_ACTION, chat_id, user_id, get_captcha_time(chat_id))
+        await callback_query.answer("Something went wrong, please try again.", show_alert=True)
+        return
+    
+    await callback_query.answer("Thanks, you can chat now!")
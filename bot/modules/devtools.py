@@ -0,0 +1,235 @@
+import os
+import time
+import pstats
+import asyncio
+import logging
+import cProfile
+import tempfile
+import tracemalloc
+from typing import Optional
+from pyrogram import Client
+from pyrogram.types import Message, User
+from bot.utils import parse_time, command
+from bot.memstats import memory_tracker
+
+logger = logging.getLogger(__name__)
+
+# Module info
+__MODULE__ = "Devtools"
+__HELP__ = """
+**Devtools Module:**
+
+These commands can only be used by the bot owners (`OWNER_ID`).
+
+/profile [time] - Profile the bot for a while (default 30s) and send the results
+/memstats - Show the size of caches, indexes and databases in memory
+/memstats trace on/off - Trace allocations, /memstats then also shows the top allocation sites and what changed since the last /memstats
+"""
+
+# Users that may use the developer commands, comma-separated IDs
+OWNER_IDS = {int(user_id) for user_id in os.getenv("OWNER_ID", "").replace(" ", "").split(",") if user_id}
+
+# Profiling limits
+DEFAULT_PROFILE_TIME = 30
+MAX_PROFILE_TIME = 600
+
+# Number of functions in the profile summary
+PROFILE_TOP = 15
+
+# Profile in progress, only one can run at a time
+PROFILE_TASK: Optional[asyncio.Task] = None
+
+# Frames stored per traced allocation and allocation sites listed by /memstats
+TRACE_FRAMES = 1
+MEMSTATS_TOP = 10
+
+# Allocations at the previous /memstats, to show what changed since
+LAST_SNAPSHOT: Optional[tracemalloc.Snapshot] = None
+
+# Check if a user owns the bot
+def is_owner(user: Optional[User]) -> bool:
+    """Check if a user may use the developer commands"""
+    return bool(user) and user.id in OWNER_IDS
+
+# Summarize a profile
+def format_profile(stats: pstats.Stats, duration: float) -> str:
+    """Return the functions with the most cumulative time as a table
+    
+    Event loop internals and built-in functions are left out, as they
+    contain every handler; the profile file has all of them.
+    """
+    asyncio_dir = os.path.dirname(asyncio.__file__)
+    idle = 0.0
+    rows = []
+    for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        if filename == "~":
+            # Time spent waiting for network events
+            if "select." in name:
+                idle += tottime
+            continue
+        if filename.startswith(asyncio_dir) or os.path.basename(filename) == "selectors.py":
+            continue
+        rows.append((cumtime, tottime, calls, f"{os.path.basename(filename)}:{line}({name})"))
+    rows.sort(reverse=True)
+    
+    lines = [f"{'cumtime':>8} {'tottime':>8} {'calls':>7}  function"]
+    for cumtime, tottime, calls, location in rows[:PROFILE_TOP]:
+        lines.append(f"{cumtime:8.3f} {tottime:8.3f} {calls:>7}  {location[:60]}")
+    
+    return (
+        f"**Profile of {duration:.0f} seconds**\n"
+        f"Function calls: {stats.total_calls}\n"
+        f"Event loop idle: {idle:.1f}s ({idle / duration:.0%})\n\n"
+        "```\n" + "\n".join(lines) + "\n```"
+    )
+
+# Profile the running bot
+async def run_profile(message: Message, duration: int):
+    """Profile everything the event loop runs for a while and send the results"""
+    global PROFILE_TASK
+    profiler = cProfile.Profile()
+    try:
+        # The profiler records the loop's thread, so it sees every handler
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            profiler.disable()
+        
+        stats = pstats.Stats(profiler)
+        await message.reply_text(format_profile(stats, time.perf_counter() - start))
+        
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/profile-{int(time.time())}.prof"
+            stats.dump_stats(path)
+            await message.reply_document(path, caption="Open with `python -m pstats` or snakeviz.")
+    except Exception as e:
+        logger.error(f"Error profiling the bot: {str(e)}")
+    finally:
+        PROFILE_TASK = None
+
+# Profile command handler
+@command("profile")
+async def profile_command(client: Client, message: Message):
+    """Profile the bot for a while"""
+    global PROFILE_TASK
+    if not is_owner(message.from_user):
+        return
+    
+    if PROFILE_TASK:
+        await message.reply_text("A profile is already running!")
+        return
+    
+    # Parse the duration
+    duration = DEFAULT_PROFILE_TIME
+    if len(message.command) > 1:
+        arg = message.command[1]
+        duration = int(arg) if arg.isdigit() else parse_time(arg)
+        if not duration or duration > MAX_PROFILE_TIME:
+            await message.reply_text("The profiling time must be between 1 second and 10 minutes!")
+            return
+    
+    await message.reply_text(f"Profiling the bot for {duration} seconds...")
+    
+    # Profile in the background, so the chat's other updates are not held up
+    PROFILE_TASK = asyncio.get_event_loop().create_task(run_profile(message, duration))
+
+# Size formatter
+def get_readable_size(size: float) -> str:
+    """Convert a number of bytes to a readable size"""
+    for unit in ["B", "KB", "MB"]:
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+# Get the resident memory of the process
+def get_rss() -> Optional[int]:
+    """Return the resident memory of the process in bytes, None where unknown"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+# Format an allocation site
+def format_site(traceback: tracemalloc.Traceback) -> str:
+    """Return `path:line` of an allocation, paths relative to the bot or the libraries"""
+    frame = traceback[0]
+    filename = frame.filename
+    stdlib_dir = os.path.dirname(os.__file__)
+    if "site-packages/" in filename:
+        filename = filename.split("site-packages/", 1)[1]
+    elif filename.startswith(stdlib_dir):
+        filename = os.path.relpath(filename, stdlib_dir)
+    elif filename.startswith(os.getcwd()):
+        filename = os.path.relpath(filename, os.getcwd())
+    return f"{filename}:{frame.lineno}"[-50:]
+
+# Take an allocation snapshot
+def take_snapshot() -> tracemalloc.Snapshot:
+    """Snapshot the traced allocations, leaving out tracemalloc and imports"""
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        tracemalloc.Filter(False, "<unknown>")
+    ])
+
+# Memory stats command handler
+@command("memstats")
+async def memstats_command(client: Client, message: Message):
+    """Show the memory used by in-process structures and allocation sites"""
+    global LAST_SNAPSHOT
+    if not is_owner(message.from_user):
+        return
+    
+    # Start or stop tracing allocations
+    if len(message.command) > 1 and message.command[1].lower() == "trace":
+        arg = message.command[2].lower() if len(message.command) > 2 else "on"
+        if arg in ["on", "yes", "enable"]:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACE_FRAMES)
+            LAST_SNAPSHOT = None
+            await message.reply_text("Tracing allocations, /memstats now shows where memory is allocated.")
+        elif arg in ["off", "no", "disable"]:
+            tracemalloc.stop()
+            LAST_SNAPSHOT = None
+            await message.reply_text("Stopped tracing allocations.")
+        return
+    
+    # Registered structures
+    lines = [f"{'size':>9} {'entries':>8}  structure"]
+    for structure in await memory_tracker.report():
+        size = get_readable_size(structure.size) + ("" if structure.complete else "+")
+        entries = "-" if structure.entries is None else structure.entries
+        lines.append(f"{size:>9} {entries:>8}  {structure.name}")
+    
+    rss = get_rss()
+    text = "**Memory usage**\n"
+    if rss:
+        text += f"Resident memory: {get_readable_size(rss)}\n"
+    text += "\n```\n" + "\n".join(lines) + "\n```"
+    
+    # Allocation sites, while tracing
+    if tracemalloc.is_tracing():
+        snapshot = take_snapshot()
+        traced, peak = tracemalloc.get_traced_memory()
+        text += f"\n**Traced allocations:** {get_readable_size(traced)} (peak {get_readable_size(peak)})\n"
+        
+        lines = [
+            f"{get_readable_size(stat.size):>9} {stat.count:>8}  {format_site(stat.traceback)}"
+            for stat in snapshot.statistics("lineno")[:MEMSTATS_TOP]
+        ]
+        text += "```\n" + "\n".join(lines) + "\n```"
+        
+        if LAST_SNAPSHOT:
+            lines = [
+                f"{'+' if stat.size_diff >= 0 else '-'}{get_readable_size(abs(stat.size_diff)):>9} "
+                f"{stat.count_diff:>+8}  {format_site(stat.traceback)}"
+                for stat in snapshot.compare_to(LAST_SNAPSHOT, "lineno")[:MEMSTATS_TOP]
+            ]
+            text += "\n**Since the last /memstats:**\n```\n" + "\n".join(lines) + "\n```"
+        LAST_SNAPSHOT = snapshot
+    
+    await message.reply_text(text)
\ No newline at end of file
@@ -0,0 +1,325 @@
+import re
+import logging
+from typing import Dict, List, Set
+from pyrogram import Client, enums, filters
+from pyrogram.types import Message
+from bot.database import federation_db
+from bot.utils import extract_users, is_admin, gather_bounded, action_scheduler, ban_member, command
+from bot.memstats import memory_tracker
+
+logger = logging.getLogger(__name__)
+
+# Module info
+__MODULE__ = "Federations"
+__HELP__ = """
+**Federation Module:**
+
+A federation is a named group of chats that share one ban list.
+
+/newfed [name] - Create a new federation
+/joinfed [name] - Add this chat to a federation (federation owner only)
+/leavefed - Remove this chat from its federation
+/fedinfo - Show the federation of this chat
+/fban [users] [reason] - Ban users in every chat of the federation
+/unfban [users] - Lift a federation ban
+
+Users on the ban list are banned as soon as they join any chat of the federation.
+"""
+
+# Maximum number of ban requests in flight during a fan-out
+FBAN_CONCURRENCY = 10
+
+# Valid federation names
+FED_NAME_PATTERN = re.compile(r"^[a-z0-9_]{1,32}$")
+
+# In-memory indexes: federation name -> banned user IDs, chat ID -> federation name
+FED_BANS: Dict[str, Set[int]] = {}
+CHAT_FEDS: Dict[int, str] = {}
+
+memory_tracker.track("federation.FED_BANS", lambda: FED_BANS)
+memory_tracker.track("federation.CHAT_FEDS", lambda: CHAT_FEDS)
+
+# Build indexes from the database
+def load_federations():
+    """Load ban lists and chat memberships into memory"""
+    FED_BANS.clear()
+    CHAT_FEDS.clear()
+    for key in federation_db.list_keys():
+        if not key.startswith("fed_"):
+            continue
+        name = key[len("fed_"):]
+        fed = federation_db.get(key)
+        FED_BANS[name] = {int(user_id) for user_id in fed["bans"]}
+        for chat_id in fed["chats"]:
+            CHAT_FEDS[chat_id] = name
+
+load_federations()
+
+# Other shards may change federations, rebuild the indexes when they do
+federation_db.on_reload(load_federations)
+
+# Get federation of the message's chat, if the sender owns it
+async def get_owned_fed(message: Message):
+    """Return the name and data of the chat's federation if the sender owns it"""
+    federation_db.refresh()
+    name = CHAT_FEDS.get(message.chat.id)
+    if not name:
+        await message.reply_text("This chat is not part of a federation!")
+        return None, None
+    
+    fed = federation_db.get(f"fed_{name}")
+    if fed["owner"] != message.from_user.id:
+        await message.reply_text("Only the federation owner can do that!")
+        return None, None
+    
+    return name, fed
+
+# Get the admins of every chat of a federation
+async def get_fed_admins(client: Client, chat_ids: List[int]) -> Dict[int, Set[int]]:
+    """Return the admin IDs of each chat, empty if they can't be fetched"""
+    async def fetch(chat_id):
+        admins = set()
+        async for admin in client.get_chat_members(chat_id, filter=enums.ChatMembersFilter.ADMINISTRATORS):
+            admins.add(admin.user.id)
+        return admins
+    
+    results = await gather_bounded(fetch, chat_ids, FBAN_CONCURRENCY)
+    admins = {}
+    for chat_id, result in zip(chat_ids, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Can't get the admins of federation chat {chat_id}: {str(result)}")
+            result = set()
+        admins[chat_id] = result
+    return admins
+
+# New federation handler
+@command("newfed")
+async def new_federation(client: Client, message: Message):
+    """Create a federation"""
+    # Check if command has arguments
+    if len(message.command) < 2:
+        await message.reply_text("Please provide a name for the federation!")
+        return
+    
+    name = message.command[1].lower()
+    if not FED_NAME_PATTERN.match(name):
+        await message.reply_text("Federation names may only contain letters, digits and underscores (max 32)!")
+        return
+    
+    if federation_db.contains(f"fed_{name}"):
+        await message.reply_text(f"Federation '{name}' already exists!")
+        return
+    
+    # Create federation
+    federation_db.set(f"fed_{name}", {"owner": message.from_user.id, "chats": [], "bans": {}})
+    FED_BANS[name] = set()
+    
+    await message.reply_text(
+        f"Federation '{name}' created!\n\n"
+        f"Use `/joinfed {name}` in your groups to add them."
+    )
+
+# Join federation handler
+@command("joinfed", group_only=True)
+async def join_federation(client: Client, message: Message):
+    """Add the chat to a federation"""
+    chat_id = message.chat.id
+    
+    # Check if user is admin
+    if not await is_admin(message, message.from_user.id):
+        await message.reply_text("You need to be an admin to manage federations!")
+        return
+    
+    # Check if command has arguments
+    if len(message.command) < 2:
+        await message.reply_text("Please provide the name of the federation!")
+        return
+    
+    name = message.command[1].lower()
+    fed = federation_db.get(f"fed_{name}")
+    if not fed:
+        await message.reply_text(f"Federation '{name}' not found!")
+        return
+    
+    if fed["owner"] != message.from_user.id:
+        await message.reply_text("Only the federation owner can add chats to it!")
+        return
+    
+    federation_db.refresh()
+    if chat_id in CHAT_FEDS:
+        await message.reply_text(
+            f"This chat is already part of federation '{CHAT_FEDS[chat_id]}'. Use /leavefed first."
+        )
+        return
+    
+    # Add chat to federation
+    fed["chats"].append(chat_id)
+    federation_db.set(f"fed_{name}", fed)
+    CHAT_FEDS[chat_id] = name
+    
+    await message.reply_text(f"This chat has joined federation '{name}'!")
+
+# Leave federation handler
+@command("leavefed", group_only=True)
+async def leave_federation(client: Client, message: Message):
+    """Remove the chat from its federation"""
+    chat_id = message.chat.id
+    
+    # Check if user is admin
+    if not await is_admin(message, message.from_user.id):
+        await message.reply_text("You need to be an admin to manage federations!")
+        return
+    
+    federation_db.refresh()
+    name = CHAT_FEDS.get(chat_id)
+    if not name:
+        await message.reply_text("This chat is not part of a federation!")
+        return
+    
+    # Remove chat from federation
+    fed = federation_db.get(f"fed_{name}")
+    fed["chats"].remove(chat_id)
+    federation_db.set(f"fed_{name}", fed)
+    del CHAT_FEDS[chat_id]
+    
+    await message.reply_text(f"This chat has left federation '{name}'.")
+
+# Federation info handler
+@command("fedinfo", group_only=True)
+async def federation_info(client: Client, message: Message):
+    """Show the chat's federation"""
+    federation_db.refresh()
+    name = CHAT_FEDS.get(message.chat.id)
+    if not name:
+        await message.reply_text("This chat is not part of a federation!")
+        return
+    
+    fed = federation_db.get(f"fed_{name}")
+    await message.reply_text(
+        f"**Federation:** {name}\n"
+        f"**Owner:** `{fed['owner']}`\n"
+        f"**Chats:** {len(fed['chats'])}\n"
+        f"**Banned users:** {len(fed['bans'])}"
+    )
+
+# Federation ban handler
+@command("fban", group_only=True)
+async def federation_ban(client: Client, message: Message):
+    """Ban users in every chat of the federation"""
+    name, fed = await get_owned_fed(message)
+    if not name:
+        return
+    
+    # Extract users to ban, never the sender or the bot itself
+    bot_id = (await client.get_me()).id
+    users, missing, args = await extract_users(message)
+    users = [user for user in users if user.id not in (message.from_user.id, bot_id)]
+    if not users:
+        await message.reply_text("I can't find that user.")
+        return
+    
+    reason = " ".join(args)
+    
+    # Update ban list first so joins are blocked while the fan-out runs
+    for user in users:
+        fed["bans"][str(user.id)] = reason
+        FED_BANS[name].add(user.id)
+    federation_db.set(f"fed_{name}", fed)
+    
+    # Ban in every chat where the bot is admin, skipping the chat's admins
+    chat_admins = await get_fed_admins(client, fed["chats"])
+    chats = [chat_id for chat_id in fed["chats"] if bot_id in chat_admins[chat_id]]
+    pairs = [
+        (chat_id, user) for user in users for chat_id in chats
+        if user.id not in chat_admins[chat_id]
+    ]
+    results = await gather_bounded(
+        lambda pair: client.ban_chat_member(pair[0], pair[1].id),
+        pairs,
+        FBAN_CONCURRENCY
+    )
+    
+    banned = {user.id: 0 for user in users}
+    for (chat_id, user), result in zip(pairs, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Federation ban of {user.id} failed in {chat_id}: {str(result)}")
+        else:
+            banned[user.id] += 1
+            # The ban is permanent, an earlier timed ban must not lift it
+            action_scheduler.cancel("unban", chat_id, user.id)
+    
+    # Send summary
+    lines = []
+    for user in users:
+        line = f"- {user.mention}: banned in {banned[user.id]}/{len(chats)} chats"
+        admin_in = sum(1 for chat_id in chats if user.id in chat_admins[chat_id])
+        if admin_in:
+            line += f" (skipped {admin_in} where admin)"
+        lines.append(line)
+    lines += [f"- `{identifier}`: user not found" for identifier in missing]
+    if len(chats) < len(fed["chats"]):
+        lines.append(f"\nI'm not an admin in {len(fed['chats']) - len(chats)} chats of the federation.")
+    
+    text = f"**Federation ban in '{name}'**\n\n" + "\n".join(lines)
+    if reason:
+        text += f"\n\nReason: {reason}"
+    
+    await message.reply_text(text)
+
+# Federation unban handler
+@command("unfban", group_only=True)
+async def federation_unban(client: Client, message: Message):
+    """Lift a federation ban"""
+    name, fed = await get_owned_fed(message)
+    if not name:
+        return
+    
+    # Extract users to unban
+    users, missing, args = await extract_users(message)
+    users = [user for user in users if user.id in FED_BANS[name]]
+    if not users:
+        await message.reply_text("None of these users are banned in this federation.")
+        return
+    
+    # Update ban list
+    for user in users:
+        fed["bans"].pop(str(user.id), None)
+        FED_BANS[name].discard(user.id)
+    federation_db.set(f"fed_{name}", fed)
+    
+    # Unban in every chat of the federation
+    pairs = [(chat_id, user) for user in users for chat_id in fed["chats"]]
+    await gather_bounded(
+        lambda pair: client.unban_chat_member(pair[0], pair[1].id),
+        pairs,
+        FBAN_CONCURRENCY
+    )
+    
+    mentions = ", ".join(user.mention for user in users)
+    await message.reply_text(f"Lifted the federation ban of {mentions} in '{name}'.")
+
+# Enforce federation bans on join
+@Client.on_message(filters.new_chat_members & filters.group, group=-1)
+async def enforce_federation_bans(client: Client, message: Message):
+    """Ban members that are on the federation ban list as they join"""
+    # Pick up bans issued on other shards, the reload rebuilds the indexes
+    federation_db.refresh()
+    name = CHAT_FEDS.get(message.chat.id)
+    if not name:
+        return
+    
+    bans = FED_BANS[name]
+    banned = [member for member in message.new_chat_members if member.id in bans]
+    if not banned:
+        return
+    
+    for member in banned:
+        try:
+            await ban_member(message.chat, member.id)
+        except Exception as e:
+            logger.warning(f"Failed to enforce federation ban of {member.id} in {message.chat.id}: {str(e)}")
+    
+    # Hide the banned users from the welcome and the captcha
+    message.new_chat_members = [member for member in message.new_chat_members if member.id not in bans]
+    if not message.new_chat_members:
+        message.stop_propagation()
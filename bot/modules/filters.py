@@ -1,8 +1,9 @@
 import re
 from pyrogram import Client, filters
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
-from bot.database import filters_db
-from bot.utils import is_admin
+from pyrogram.errors import MessageNotModified
+from bot.database import filters_db, filters_index
+from bot.utils import is_admin, build_page_keyboard, message_pipeline, UpdateContext, command
 
 # Module info
 __MODULE__ = "Filters"
@@ -17,8 +18,11 @@ __HELP__ = """
 When a user sends a message containing the keyword, the bot will reply with the filter message.
 """
 
+# Number of filters per page of the filters listing
+FILTERS_PAGE_SIZE = 50
+
 # Add filter handler
-@Client.on_message(filters.command("filter") & filters.group)
+@command("filter", group_only=True)
 async def add_filter(client: Client, message: Message):
     """Add a filter"""
     chat_id = str(message.chat.id)
@@ -54,34 +58,58 @@ async def add_filter(client: Client, message: Message):
         filter_content = message.text.split(None, 2)[2]
     
     # Save filter
-    filters_db.set(f"{chat_id}_{keyword}", filter_content)
+    filters_index.set(chat_id, keyword, filter_content)
     
     await message.reply_text(f"Filter for '{keyword}' added successfully!")
 
+# Build one page of the filters listing
+def build_filters_page(chat_id: str, page: int):
+    """Return the text and keyboard of a page of the chat's filters"""
+    total = filters_index.count(chat_id)
+    pages = (total + FILTERS_PAGE_SIZE - 1) // FILTERS_PAGE_SIZE
+    page = min(max(page, 0), pages - 1)
+    
+    filters_text = f"**Active Filters ({total}):**\n\n"
+    filters_text += "".join(
+        f"- `{filter_name}`\n" for filter_name in filters_index.page(chat_id, page, FILTERS_PAGE_SIZE)
+    )
+    
+    return filters_text, build_page_keyboard("filterspage", page, pages)
+
 # List filters handler
-@Client.on_message(filters.command("filters") & filters.group)
+@command("filters", group_only=True)
 async def list_filters(client: Client, message: Message):
-    """List all filters"""
+    """List filters, one page at a time"""
     chat_id = str(message.chat.id)
     
-    # Get all filters for this chat
-    chat_filters = []
-    for key in filters_db.list_keys():
-        if key.startswith(f"{chat_id}_"):
-            filter_name = key.replace(f"{chat_id}_", "")
-            chat_filters.append(filter_name)
-    
-    if chat_filters:
-        filters_text = "**Active Filters:**\n\n"
-        for filter_name in sorted(chat_filters):
-            filters_text += f"- `{filter_name}`\n"
-        
-        await message.reply_text(filters_text)
-    else:
+    if not filters_index.count(chat_id):
         await message.reply_text("No filters active in this chat!")
+        return
+    
+    filters_text, keyboard = build_filters_page(chat_id, 0)
+    await message.reply_text(filters_text, reply_markup=keyboard)
+
+# Filters page callback handler
+@Client.on_callback_query(filters.regex(r"^filterspage_(\d+)$"))
+async def filters_page_callback(client: Client, callback_query):
+    """Show another page of the filters listing"""
+    chat_id = str(callback_query.message.chat.id)
+    page = int(callback_query.data.split("_")[1])
+    
+    if not filters_index.count(chat_id):
+        await callback_query.message.edit_text("No filters active in this chat!")
+        await callback_query.answer()
+        return
+    
+    filters_text, keyboard = build_filters_page(chat_id, page)
+    try:
+        await callback_query.message.edit_text(filters_text, reply_markup=keyboard)
+    except MessageNotModified:
+        pass
+    await callback_query.answer()
 
 # Remove filter handler
-@Client.on_message(filters.command("stop") & filters.group)
+@command("stop", group_only=True)
 async def remove_filter(client: Client, message: Message):
     """Remove a filter"""
     chat_id = str(message.chat.id)
@@ -105,12 +133,12 @@ async def remove_filter(client: Client, message: Message):
         return
     
     # Remove filter
-    filters_db.delete(f"{chat_id}_{keyword}")
+    filters_index.delete(chat_id, keyword)
     
     await message.reply_text(f"Filter '{keyword}' removed successfully!")
 
 # Remove all filters handler
-@Client.on_message(filters.command("stopall") & filters.group)
+@command("stopall", group_only=True)
 async def remove_all_filters(client: Client, message: Message):
     """Remove all filters"""
     chat_id = str(message.chat.id)
@@ -157,34 +185,26 @@ async def remove_all_filters_callback(client: Client, callback_query):
     
     # Handle confirm action
     if action == "confirm":
-        # Get all filters for this chat
-        removed_count = 0
-        for key in filters_db.list_keys():
-            if key.startswith(f"{chat_id}_"):
-                filters_db.delete(key)
-                removed_count += 1
+        # Remove all filters for this chat
+        removed_count = filters_index.clear(chat_id)
         
         await callback_query.message.edit_text(f"Removed {removed_count} filters from this chat!")
         await callback_query.answer()
         return
 
-# Filter message handler
-@Client.on_message(filters.group & filters.text & ~filters.command)
-async def handle_filters(client: Client, message: Message):
+# Filter message hook
+@message_pipeline.hook(30)
+async def handle_filters(client: Client, ctx: UpdateContext):
     """Check if message contains filter keywords and reply with filter content"""
-    chat_id = str(message.chat.id)
+    # Skip commands and media captions
+    if not ctx.message.text or ctx.is_command:
+        return
     
-    # Get all filters for this chat
-    chat_filters = {}
-    for key in filters_db.list_keys():
-        if key.startswith(f"{chat_id}_"):
-            filter_name = key.replace(f"{chat_id}_", "")
-            filter_content = filters_db.get(key)
-            chat_filters[filter_name] = filter_content
+    chat_id = ctx.chat_id
     
     # Check if message contains any filter keywords
-    for keyword, content in chat_filters.items():
+    for keyword in filters_index.names(chat_id):
         pattern = r'(\W|^)' + re.escape(keyword) + r'(\W|$)'
-        if re.search(pattern, message.text.lower()):
-            await message.reply_text(content)
+        if re.search(pattern, ctx.lower_text):
+            await ctx.message.reply_text(filters_db.get(f"{chat_id}_{keyword}"))
             break  # Only reply with the first matching filter 
\ No newline at end of file
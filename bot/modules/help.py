@@ -1,7 +1,9 @@
 import re
-from pyrogram import Client, filters
+from pyrogram import Client, filters, enums
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-from bot.modules import ALL_MODULES
+from bot.plugins.loader import LOADED_MODULES
+from bot.memstats import memory_tracker
+from bot.utils import command
 
 # Module info
 __MODULE__ = "Help"
@@ -12,11 +14,12 @@ __HELP__ = """
 
 # Dictionary to store module help texts
 HELP_TEXTS = {}
+memory_tracker.track("help.HELP_TEXTS", lambda: HELP_TEXTS)
 
 # Load help texts from modules
 def load_help():
-    """Load help texts from all modules"""
-    for module_name in ALL_MODULES:
+    """Load help texts from all loaded modules"""
+    for module_name in LOADED_MODULES:
         try:
             imported_module = __import__(f"bot.modules.{module_name}", fromlist=["__HELP__"])
             if hasattr(imported_module, "__HELP__"):
@@ -25,7 +28,7 @@ def load_help():
             pass
 
 # Help command handler
-@Client.on_message(filters.command("help"))
+@command("help")
 async def help_command(client: Client, message: Message):
     """Handle the /help command"""
     # Load help texts if not loaded
@@ -38,12 +41,12 @@ async def help_command(client: Client, message: Message):
         if module_name in HELP_TEXTS:
             await message.reply_text(
                 f"Help for **{module_name.capitalize()}** module:\n\n{HELP_TEXTS[module_name]}",
-                parse_mode="markdown"
+                parse_mode=enums.ParseMode.MARKDOWN
             )
         else:
             await message.reply_text(
                 f"Module **{module_name}** not found. Use /help to see all available modules.",
-                parse_mode="markdown"
+                parse_mode=enums.ParseMode.MARKDOWN
             )
         return
     
@@ -182,7 +185,7 @@ Use /help to see the list of available commands.
         await callback_query.edit_message_text(
             f"Help for **{module_name.capitalize()}** module:\n\n{HELP_TEXTS[module_name]}",
             reply_markup=keyboard,
-            parse_mode="markdown"
+            parse_mode=enums.ParseMode.MARKDOWN
         )
         await callback_query.answer()
     else:
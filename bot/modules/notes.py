@@ -1,8 +1,21 @@
-from pyrogram import Client, filters
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
-from bot.database import notes_db
-from bot.utils import is_admin
+from pyrogram import Client, filters, enums
+from pyrogram.types import (
+    Message,
+    InlineKeyboardMarkup,
+    InlineKeyboardButton,
+    InlineQuery,
+    InlineQueryResultArticle,
+    InputTextMessageContent
+)
+from pyrogram.errors import MessageNotModified, UserNotParticipant
+from bot.database import notes_db, notes_index, connections_db
+from bot.utils import is_admin, build_page_keyboard, message_pipeline, UpdateContext, command
+from bot.utils.trigram import TrigramIndex
+from bot.memstats import memory_tracker
 import re
+import time
+from collections import OrderedDict
+from typing import List, Tuple
 
 # Module info
 __MODULE__ = "Notes"
@@ -14,12 +27,64 @@ __HELP__ = """
 /notes - List all saved notes
 /clear [name] - Delete a note
 /clearall - Delete all notes (admin only)
+/search [text] - Search notes by name and content
+/connect - Use this chat's notes in inline mode
+/disconnect - Stop using this chat's notes in inline mode
 
 You can also use #[name] to get a note.
+After /connect, type `@botusername [name]` in any chat to send a note.
 """
 
+# Number of notes per page of the notes listing
+NOTES_PAGE_SIZE = 50
+
+# Number of results of /search and of "did you mean" suggestions
+SEARCH_LIMIT = 10
+SUGGESTION_LIMIT = 3
+
+# Fuzzy indexes over note names and note contents
+NOTE_NAMES = TrigramIndex(lambda chat_id: ((name, name) for name in notes_index.names(chat_id)))
+NOTE_CONTENTS = TrigramIndex(
+    lambda chat_id: ((name, notes_db.get(f"{chat_id}_{name}", "")) for name in notes_index.names(chat_id))
+)
+
+# Inline results per answer (Telegram allows at most 50) and per query
+INLINE_PAGE_SIZE = 50
+INLINE_RESULT_LIMIT = 500
+
+# Lifetime and size of the inline prefix cache
+INLINE_CACHE_TTL = 30
+INLINE_CACHE_SIZE = 1024
+
+# (chat_id, prefix) -> (expiry time, index version, matching names)
+INLINE_CACHE: "OrderedDict[Tuple[str, str], Tuple[float, int, List[str]]]" = OrderedDict()
+
+# How long a checked connection is trusted, and how many checks are remembered
+CONNECTION_CHECK_TTL = 300
+CONNECTION_CHECK_SIZE = 1024
+
+# (user_id, chat_id) -> expiry time of connections whose user is still in the chat
+CONNECTION_CHECKS: "OrderedDict[Tuple[int, str], float]" = OrderedDict()
+
+# Chat member statuses that keep a connection usable
+CONNECTED_STATUSES = [
+    enums.ChatMemberStatus.OWNER,
+    enums.ChatMemberStatus.ADMINISTRATOR,
+    enums.ChatMemberStatus.MEMBER
+]
+
+memory_tracker.track("notes.NOTE_NAMES", lambda: NOTE_NAMES)
+memory_tracker.track("notes.NOTE_CONTENTS", lambda: NOTE_CONTENTS)
+memory_tracker.track("notes.INLINE_CACHE", lambda: INLINE_CACHE)
+memory_tracker.track("notes.CONNECTION_CHECKS", lambda: CONNECTION_CHECKS)
+
+# Suggest similar note names
+def suggest_notes(chat_id: str, note_name: str) -> List[str]:
+    """Return the names of the notes closest to a mistyped name"""
+    return [name for name, _ in NOTE_NAMES.search(chat_id, note_name, SUGGESTION_LIMIT)]
+
 # Save note handler
-@Client.on_message(filters.command("save") & filters.group)
+@command("save", group_only=True)
 async def save_note(client: Client, message: Message):
     """Save a note"""
     chat_id = str(message.chat.id)
@@ -55,12 +120,14 @@ async def save_note(client: Client, message: Message):
         note_content = message.text.split(None, 2)[2]
     
     # Save note
-    notes_db.set(f"{chat_id}_{note_name}", note_content)
+    notes_index.set(chat_id, note_name, note_content)
+    NOTE_NAMES.add(chat_id, note_name, note_name)
+    NOTE_CONTENTS.add(chat_id, note_name, note_content)
     
     await message.reply_text(f"Note '{note_name}' saved successfully!")
 
 # Get note handler
-@Client.on_message(filters.command("get") & filters.group)
+@command("get", group_only=True)
 async def get_note(client: Client, message: Message):
     """Get a note"""
     chat_id = str(message.chat.id)
@@ -79,16 +146,21 @@ async def get_note(client: Client, message: Message):
     if note_content:
         await message.reply_text(note_content)
     else:
-        await message.reply_text(f"Note '{note_name}' not found!")
+        not_found_text = f"Note '{note_name}' not found!"
+        suggestions = suggest_notes(chat_id, note_name)
+        if suggestions:
+            not_found_text += "\nDid you mean: " + ", ".join(f"`{name}`" for name in suggestions) + "?"
+        await message.reply_text(not_found_text)
 
 # Get note by hashtag
-@Client.on_message(filters.regex(r"^#([a-zA-Z0-9_]+)") & filters.group)
-async def get_note_by_hashtag(client: Client, message: Message):
+@message_pipeline.hook(20)
+async def get_note_by_hashtag(client: Client, ctx: UpdateContext):
     """Get a note by hashtag"""
-    chat_id = str(message.chat.id)
+    message = ctx.message
+    chat_id = ctx.chat_id
     
     # Get note name from hashtag
-    match = re.match(r"^#([a-zA-Z0-9_]+)", message.text)
+    match = re.match(r"^#([a-zA-Z0-9_]+)", ctx.text)
     if not match:
         return
     
@@ -99,33 +171,204 @@ async def get_note_by_hashtag(client: Client, message: Message):
     
     if note_content:
         await message.reply_text(note_content)
+        return
+    
+    # Only answer unknown hashtags when a close note exists
+    suggestions = suggest_notes(chat_id, note_name)
+    if suggestions:
+        await message.reply_text("Did you mean: " + ", ".join(f"`#{name}`" for name in suggestions) + "?")
+
+# Search notes handler
+@command("search", group_only=True)
+async def search_notes(client: Client, message: Message):
+    """Search notes by name and content"""
+    chat_id = str(message.chat.id)
+    
+    # Check if command has enough arguments
+    if len(message.command) < 2:
+        await message.reply_text("Please provide something to search for!")
+        return
+    
+    query = message.text.split(None, 1)[1]
+    
+    # Rank notes by their best name or content match
+    scores = {}
+    for name, score in NOTE_NAMES.search(chat_id, query, SEARCH_LIMIT):
+        scores[name] = score
+    for name, score in NOTE_CONTENTS.search(chat_id, query, SEARCH_LIMIT, min_score=0.6, containment=True):
+        scores[name] = max(scores.get(name, 0), score)
+    
+    if not scores:
+        await message.reply_text(f"No notes found for '{query}'.")
+        return
+    
+    results = sorted(scores, key=lambda name: (-scores[name], name))[:SEARCH_LIMIT]
+    await message.reply_text(
+        f"**Notes matching '{query}':**\n\n" +
+        "".join(f"- `{name}`\n" for name in results) +
+        "\nYou can get a note by using `/get notename` or `#notename`"
+    )
+
+# Find note names for an inline query
+def find_inline_notes(chat_id: str, prefix: str) -> List[str]:
+    """Return the names starting with a prefix, cached while typing"""
+    key = (chat_id, prefix)
+    version = notes_index.version(chat_id)
+    cached = INLINE_CACHE.get(key)
+    if cached and cached[0] > time.time() and cached[1] == version:
+        INLINE_CACHE.move_to_end(key)
+        return cached[2]
+    
+    names = notes_index.prefix(chat_id, prefix, INLINE_RESULT_LIMIT)
+    INLINE_CACHE[key] = (time.time() + INLINE_CACHE_TTL, version, names)
+    INLINE_CACHE.move_to_end(key)
+    if len(INLINE_CACHE) > INLINE_CACHE_SIZE:
+        INLINE_CACHE.popitem(last=False)
+    return names
+
+# Connect handler
+@command("connect", group_only=True)
+async def connect_chat(client: Client, message: Message):
+    """Use the chat's notes in inline mode"""
+    connections_db.set(f"{message.from_user.id}_connection", str(message.chat.id))
+    await message.reply_text(
+        f"You are now connected to the notes of {message.chat.title}!\n"
+        "Type `@botusername notename` in any chat to send a note."
+    )
+
+# Disconnect handler
+@command("disconnect")
+async def disconnect_chat(client: Client, message: Message):
+    """Stop using a chat's notes in inline mode"""
+    if not connections_db.contains(f"{message.from_user.id}_connection"):
+        await message.reply_text("You are not connected to any chat!")
+        return
+    
+    connections_db.delete(f"{message.from_user.id}_connection")
+    await message.reply_text("Disconnected. Inline mode no longer shows any notes.")
+
+# Get a user's connected chat
+async def get_connection(client: Client, user_id: int):
+    """Return the chat the user is connected to, dropping the connection once they left it"""
+    chat_id = connections_db.get(f"{user_id}_connection")
+    if not chat_id:
+        return None
+    
+    key = (user_id, chat_id)
+    if CONNECTION_CHECKS.get(key, 0) > time.time():
+        return chat_id
+    
+    try:
+        member = await client.get_chat_member(int(chat_id), user_id)
+        connected = member.status in CONNECTED_STATUSES or (
+            member.status == enums.ChatMemberStatus.RESTRICTED and member.is_member
+        )
+    except UserNotParticipant:
+        connected = False
+    except Exception:
+        # Can't tell right now, keep the connection for the next query
+        return None
+    
+    if not connected:
+        CONNECTION_CHECKS.pop(key, None)
+        connections_db.delete(f"{user_id}_connection")
+        return None
+    
+    CONNECTION_CHECKS[key] = time.time() + CONNECTION_CHECK_TTL
+    CONNECTION_CHECKS.move_to_end(key)
+    if len(CONNECTION_CHECKS) > CONNECTION_CHECK_SIZE:
+        CONNECTION_CHECKS.popitem(last=False)
+    return chat_id
+
+# Inline note lookup handler
+@Client.on_inline_query()
+async def inline_notes(client: Client, inline_query: InlineQuery):
+    """Answer inline queries with the notes of the connected chat"""
+    chat_id = await get_connection(client, inline_query.from_user.id)
+    if not chat_id:
+        await inline_query.answer(
+            [],
+            cache_time=0,
+            is_personal=True,
+            switch_pm_text="Use /connect in your group first",
+            switch_pm_parameter="connect"
+        )
+        return
+    
+    prefix = inline_query.query.strip().lower()
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    
+    names = find_inline_notes(chat_id, prefix)
+    page = names[offset:offset + INLINE_PAGE_SIZE]
+    next_offset = offset + INLINE_PAGE_SIZE
+    
+    results = []
+    for name in page:
+        content = notes_db.get(f"{chat_id}_{name}")
+        if not content:
+            continue
+        results.append(
+            InlineQueryResultArticle(
+                title=name,
+                description=content[:100],
+                input_message_content=InputTextMessageContent(content)
+            )
+        )
+    
+    await inline_query.answer(
+        results,
+        cache_time=INLINE_CACHE_TTL,
+        is_personal=True,
+        next_offset=str(next_offset) if next_offset < len(names) else ""
+    )
+
+# Build one page of the notes listing
+def build_notes_page(chat_id: str, page: int):
+    """Return the text and keyboard of a page of the chat's notes"""
+    total = notes_index.count(chat_id)
+    pages = (total + NOTES_PAGE_SIZE - 1) // NOTES_PAGE_SIZE
+    page = min(max(page, 0), pages - 1)
+    
+    notes_text = f"**Saved Notes ({total}):**\n\n"
+    notes_text += "".join(f"- `{note}`\n" for note in notes_index.page(chat_id, page, NOTES_PAGE_SIZE))
+    notes_text += "\nYou can get a note by using `/get notename` or `#notename`"
+    
+    return notes_text, build_page_keyboard("notespage", page, pages)
 
 # List notes handler
-@Client.on_message(filters.command("notes") & filters.group)
+@command("notes", group_only=True)
 async def list_notes(client: Client, message: Message):
-    """List all saved notes"""
+    """List saved notes, one page at a time"""
     chat_id = str(message.chat.id)
     
-    # Get all notes for this chat
-    notes = []
-    for key in notes_db.list_keys():
-        if key.startswith(f"{chat_id}_"):
-            note_name = key.replace(f"{chat_id}_", "")
-            notes.append(note_name)
-    
-    if notes:
-        notes_text = "**Saved Notes:**\n\n"
-        for note in sorted(notes):
-            notes_text += f"- `{note}`\n"
-        
-        notes_text += "\nYou can get a note by using `/get notename` or `#notename`"
-        
-        await message.reply_text(notes_text)
-    else:
+    if not notes_index.count(chat_id):
         await message.reply_text("No notes saved in this chat!")
+        return
+    
+    notes_text, keyboard = build_notes_page(chat_id, 0)
+    await message.reply_text(notes_text, reply_markup=keyboard)
+
+# Notes page callback handler
+@Client.on_callback_query(filters.regex(r"^notespage_(\d+)$"))
+async def notes_page_callback(client: Client, callback_query):
+    """Show another page of the notes listing"""
+    chat_id = str(callback_query.message.chat.id)
+    page = int(callback_query.data.split("_")[1])
+    
+    if not notes_index.count(chat_id):
+        await callback_query.message.edit_text("No notes saved in this chat!")
+        await callback_query.answer()
+        return
+    
+    notes_text, keyboard = build_notes_page(chat_id, page)
+    try:
+        await callback_query.message.edit_text(notes_text, reply_markup=keyboard)
+    except MessageNotModified:
+        pass
+    await callback_query.answer()
 
 # Clear note handler
-@Client.on_message(filters.command("clear") & filters.group)
+@command("clear", group_only=True)
 async def clear_note(client: Client, message: Message):
     """Delete a note"""
     chat_id = str(message.chat.id)
@@ -149,12 +392,14 @@ async def clear_note(client: Client, message: Message):
         return
     
     # Delete note
-    notes_db.delete(f"{chat_id}_{note_name}")
+    notes_index.delete(chat_id, note_name)
+    NOTE_NAMES.remove(chat_id, note_name)
+    NOTE_CONTENTS.remove(chat_id, note_name)
     
     await message.reply_text(f"Note '{note_name}' deleted successfully!")
 
 # Clear all notes handler
-@Client.on_message(filters.command("clearall") & filters.group)
+@command("clearall", group_only=True)
 async def clear_all_notes(client: Client, message: Message):
     """Delete all notes"""
     chat_id = str(message.chat.id)
@@ -201,12 +446,10 @@ async def clear_all_notes_callback(client: Client, callback_query):
     
     # Handle confirm action
     if action == "confirm":
-        # Get all notes for this chat
-        deleted_count = 0
-        for key in notes_db.list_keys():
-            if key.startswith(f"{chat_id}_"):
-                notes_db.delete(key)
-                deleted_count += 1
+        # Delete all notes for this chat
+        deleted_count = notes_index.clear(chat_id)
+        NOTE_NAMES.clear(chat_id)
+        NOTE_CONTENTS.clear(chat_id)
         
         await callback_query.message.edit_text(f"Deleted {deleted_count} notes from this chat!")
         await callback_query.answer()
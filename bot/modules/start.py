@@ -1,15 +1,17 @@
-from pyrogram import Client, filters
+from pyrogram import Client
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
+from bot.utils import command
 
 # Module info
 __MODULE__ = "Start"
 __HELP__ = """
 /start - Start the bot
 /help - Show help message
+/ping - Check if the bot is online
 """
 
 # Start command handler
-@Client.on_message(filters.command("start"))
+@command("start")
 async def start_command(client: Client, message: Message):
     """Handle the /start command"""
     # Get bot info
@@ -43,4 +45,10 @@ Use /help to see the list of available commands.
         welcome_text,
         reply_markup=keyboard,
         disable_web_page_preview=True
-    ) 
\ No newline at end of file
+    )
+
+# Ping command handler
+@command("ping")
+async def ping_command(client: Client, message: Message):
+    """Check if the bot is online"""
+    await message.reply_text("Pong!")
\ No newline at end of file
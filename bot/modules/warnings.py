@@ -1,7 +1,21 @@
-from pyrogram import Client, filters
+import time
+import heapq
+from typing import Any, Dict, List
+from pyrogram import Client
 from pyrogram.types import Message
 from bot.database import warnings_db
-from bot.utils import extract_user, is_admin, is_bot_admin
+from bot.utils import (
+    extract_user,
+    is_admin,
+    is_bot_admin,
+    kick_member,
+    ban_member,
+    mute_member,
+    get_readable_time,
+    parse_time,
+    action_scheduler,
+    command
+)
 
 # Module info
 __MODULE__ = "Warnings"
@@ -13,6 +27,8 @@ __HELP__ = """
 /resetwarns [user] - Reset a user's warnings
 /warnlimit - Show or set the warning limit
 /warnmode - Show or set the warning mode (ban, kick, mute)
+/warntime [time|off] - Show or set after how long warnings expire, e.g. `7d`
+/warnstats - Show the most warned users and warnings per day
 
 When a user reaches the warning limit, they will be banned, kicked, or muted based on the warning mode.
 """
@@ -20,9 +36,138 @@ When a user reaches the warning limit, they will be banned, kicked, or muted bas
 # Default warning settings
 DEFAULT_WARN_LIMIT = 3
 DEFAULT_WARN_MODE = "ban"  # Options: ban, kick, mute
+DEFAULT_WARN_TIME = 0  # Warnings never expire
+
+# Longest configurable warning expiry, in seconds
+MAX_WARN_TIME = 365 * 86400
+
+# Scheduler action that drops a user's expired warnings
+WARN_EXPIRE_ACTION = "warn_expire"
+
+# Size of the leaderboard and number of days of warning counts kept
+WARNSTATS_TOP_K = 10
+WARNSTATS_DAYS = 30
+
+# Get warning statistics
+def get_warn_stats(chat_id: Any) -> Dict[str, Any]:
+    """Return the chat's warning aggregates
+    
+    `users` holds the active warnings per user, `top` the users with the
+    most of them sorted by count and `days` the warnings issued per UTC day.
+    """
+    return warnings_db.get(f"{chat_id}_warnstats") or {"total": 0, "users": {}, "top": [], "days": {}}
+
+# Update warning statistics
+def update_warn_stats(chat_id: Any, user_id: int, delta: int, issued: bool = False):
+    """Apply a change of a user's active warnings to the chat's aggregates"""
+    stats = get_warn_stats(chat_id)
+    users, top = stats["users"], stats["top"]
+    key = str(user_id)
+    
+    # Warnings from before stats were kept are not counted, so never go below 0
+    count = max(users.get(key, 0) + delta, 0)
+    stats["total"] = max(stats["total"] + count - users.get(key, 0), 0)
+    if count:
+        users[key] = count
+    else:
+        users.pop(key, None)
+    
+    # Keep the leaderboard sorted, it only has to be rebuilt when a leader drops
+    position = next((i for i, (top_user, _) in enumerate(top) if top_user == key), None)
+    if position is not None and delta < 0:
+        top[:] = [list(item) for item in heapq.nlargest(WARNSTATS_TOP_K, users.items(), key=lambda item: item[1])]
+    else:
+        if position is not None:
+            del top[position]
+        if count:
+            top.append([key, count])
+            top.sort(key=lambda item: -item[1])
+            del top[WARNSTATS_TOP_K:]
+    
+    # Count issued warnings per day and drop old days
+    if issued:
+        days = stats["days"]
+        today = time.strftime("%Y-%m-%d", time.gmtime())
+        days[today] = days.get(today, 0) + 1
+        oldest = time.strftime("%Y-%m-%d", time.gmtime(time.time() - (WARNSTATS_DAYS - 1) * 86400))
+        for day in [day for day in days if day < oldest]:
+            del days[day]
+    
+    warnings_db.set(f"{chat_id}_warnstats", stats)
+
+# Get warning expiry
+def get_warn_time(chat_id: Any) -> int:
+    """Return after how many seconds warnings of the chat expire, 0 for never"""
+    return warnings_db.get(f"{chat_id}_warn_time", DEFAULT_WARN_TIME)
+
+# Get a user's active warnings
+def get_warns(chat_id: Any, user_id: int) -> List[Dict[str, Any]]:
+    """Return the user's unexpired warnings, oldest first
+    
+    Each warning is a record with its time, reason and issuer. Counts stored
+    by older versions are turned into records dated now.
+    """
+    warns = warnings_db.get(f"{chat_id}_{user_id}_warns", [])
+    if isinstance(warns, int):
+        warns = [{"time": time.time(), "reason": "", "by": None} for _ in range(warns)]
+    
+    warn_time = get_warn_time(chat_id)
+    if warn_time:
+        expired_before = time.time() - warn_time
+        return [warn for warn in warns if warn["time"] > expired_before]
+    return list(warns)
+
+# Store a user's warnings
+def set_warns(chat_id: Any, user_id: int, warns: List[Dict[str, Any]], issued: bool = False):
+    """Store the user's warnings and schedule the expiry of the oldest one"""
+    user_warns_key = f"{chat_id}_{user_id}_warns"
+    
+    # Update statistics with the change of active warnings
+    old_warns = warnings_db.get(user_warns_key, [])
+    delta = len(warns) - (old_warns if isinstance(old_warns, int) else len(old_warns))
+    if delta or issued:
+        update_warn_stats(chat_id, user_id, delta, issued)
+    
+    if not warns:
+        warnings_db.delete(user_warns_key)
+        action_scheduler.cancel(WARN_EXPIRE_ACTION, int(chat_id), user_id)
+        return
+    
+    warnings_db.set(user_warns_key, warns)
+    schedule_warn_expiry(chat_id, user_id, warns)
+
+# Schedule the expiry of a user's warnings
+def schedule_warn_expiry(chat_id: Any, user_id: int, warns: List[Dict[str, Any]]):
+    """Schedule the expiry of the oldest warning, or cancel it if warnings don't expire"""
+    warn_time = get_warn_time(chat_id)
+    if warn_time:
+        delay = warns[0]["time"] + warn_time - time.time()
+        action_scheduler.schedule(WARN_EXPIRE_ACTION, int(chat_id), user_id, max(delay, 0))
+    else:
+        action_scheduler.cancel(WARN_EXPIRE_ACTION, int(chat_id), user_id)
+
+# Reschedule the expiry of a chat's warnings
+def reschedule_chat_warns(chat_id: Any):
+    """Schedule the expiry of every warned user of the chat with its warning time"""
+    prefix = f"{chat_id}_"
+    for key in warnings_db.list_keys():
+        if not key.startswith(prefix) or not key.endswith("_warns"):
+            continue
+        user_id = key[len(prefix):-len("_warns")]
+        warns = warnings_db.get(key)
+        # Counts stored by older versions have no times to expire by
+        if user_id.isdigit() and isinstance(warns, list) and warns:
+            schedule_warn_expiry(chat_id, int(user_id), warns)
+
+# Drop expired warnings
+@action_scheduler.register(WARN_EXPIRE_ACTION)
+async def expire_warns(client: Client, chat_id: int, user_id: int):
+    """Remove a user's expired warnings, then wait for the next one to expire"""
+    if warnings_db.contains(f"{chat_id}_{user_id}_warns"):
+        set_warns(chat_id, user_id, get_warns(chat_id, user_id))
 
 # Warn command handler
-@Client.on_message(filters.command("warn") & filters.group)
+@command("warn", group_only=True)
 async def warn_user(client: Client, message: Message):
     """Warn a user"""
     chat_id = str(message.chat.id)
@@ -43,23 +188,22 @@ async def warn_user(client: Client, message: Message):
         await message.reply_text("I can't warn an admin!")
         return
     
-    # Get reason if provided
-    reason = ""
-    if len(message.command) > 1:
-        reason = " ".join(message.command[1:])
-    
-    # Get user's current warnings
-    user_warns_key = f"{chat_id}_{user.id}_warns"
-    user_warns = warnings_db.get(user_warns_key, 0)
+    # Get reason if provided (after the user when not replying)
+    reason_args = message.command[1:] if message.reply_to_message else message.command[2:]
+    reason = " ".join(reason_args)
     
-    # Increment warnings
-    user_warns += 1
-    warnings_db.set(user_warns_key, user_warns)
+    # Add warning to the user's active warnings
+    warns = get_warns(chat_id, user.id)
+    warns.append({"time": time.time(), "reason": reason, "by": message.from_user.id})
+    user_warns = len(warns)
     
     # Get warning limit and mode
     warn_limit = warnings_db.get(f"{chat_id}_warn_limit", DEFAULT_WARN_LIMIT)
     warn_mode = warnings_db.get(f"{chat_id}_warn_mode", DEFAULT_WARN_MODE)
     
+    # Store warnings, they are reset once the limit is reached
+    set_warns(chat_id, user.id, warns if user_warns < warn_limit else [], issued=True)
+    
     # Create warning message
     warn_text = f"⚠️ {user.mention} has been warned! ({user_warns}/{warn_limit})"
     if reason:
@@ -69,36 +213,24 @@ async def warn_user(client: Client, message: Message):
     if user_warns >= warn_limit:
         warn_text += f"\n\nUser has reached the warning limit and will be {warn_mode}ned!"
         
-        # Reset warnings
-        warnings_db.set(user_warns_key, 0)
-        
         # Apply punishment based on warning mode
         if warn_mode == "ban":
             if await is_bot_admin(message):
-                await message.chat.ban_member(user.id)
+                await ban_member(message.chat, user.id)
                 warn_text += "\nUser has been banned!"
             else:
                 warn_text += "\nI don't have permission to ban users!"
         
         elif warn_mode == "kick":
             if await is_bot_admin(message):
-                await message.chat.ban_member(user.id)
-                await message.chat.unban_member(user.id)  # Unban to allow them to join again
+                await kick_member(message.chat, user.id)
                 warn_text += "\nUser has been kicked!"
             else:
                 warn_text += "\nI don't have permission to kick users!"
         
         elif warn_mode == "mute":
             if await is_bot_admin(message):
-                await message.chat.restrict_member(
-                    user.id,
-                    permissions=dict(
-                        can_send_messages=False,
-                        can_send_media_messages=False,
-                        can_send_other_messages=False,
-                        can_add_web_page_previews=False
-                    )
-                )
+                await mute_member(message.chat, user.id)
                 warn_text += "\nUser has been muted!"
             else:
                 warn_text += "\nI don't have permission to mute users!"
@@ -106,7 +238,7 @@ async def warn_user(client: Client, message: Message):
     await message.reply_text(warn_text)
 
 # Check warnings command handler
-@Client.on_message(filters.command("warns") & filters.group)
+@command("warns", group_only=True)
 async def check_warns(client: Client, message: Message):
     """Check a user's warnings"""
     chat_id = str(message.chat.id)
@@ -117,17 +249,21 @@ async def check_warns(client: Client, message: Message):
         # If no user specified, check the sender's warnings
         user = message.from_user
     
-    # Get user's current warnings
-    user_warns_key = f"{chat_id}_{user.id}_warns"
-    user_warns = warnings_db.get(user_warns_key, 0)
+    # Get user's active warnings
+    warns = get_warns(chat_id, user.id)
     
     # Get warning limit
     warn_limit = warnings_db.get(f"{chat_id}_warn_limit", DEFAULT_WARN_LIMIT)
     
-    await message.reply_text(f"{user.mention} has {user_warns}/{warn_limit} warnings.")
+    warns_text = f"{user.mention} has {len(warns)}/{warn_limit} warnings."
+    now = time.time()
+    for i, warn in enumerate(warns, 1):
+        warns_text += f"\n{i}. {warn['reason'] or 'No reason'} ({get_readable_time(int(now - warn['time']))} ago)"
+    
+    await message.reply_text(warns_text)
 
 # Reset warnings command handler
-@Client.on_message(filters.command("resetwarns") & filters.group)
+@command("resetwarns", group_only=True)
 async def reset_warns(client: Client, message: Message):
     """Reset a user's warnings"""
     chat_id = str(message.chat.id)
@@ -144,13 +280,12 @@ async def reset_warns(client: Client, message: Message):
         return
     
     # Reset user's warnings
-    user_warns_key = f"{chat_id}_{user.id}_warns"
-    warnings_db.set(user_warns_key, 0)
+    set_warns(chat_id, user.id, [])
     
     await message.reply_text(f"Warnings for {user.mention} have been reset.")
 
 # Warning limit command handler
-@Client.on_message(filters.command("warnlimit") & filters.group)
+@command("warnlimit", group_only=True)
 async def warn_limit(client: Client, message: Message):
     """Show or set the warning limit"""
     chat_id = str(message.chat.id)
@@ -183,7 +318,7 @@ async def warn_limit(client: Client, message: Message):
         )
 
 # Warning mode command handler
-@Client.on_message(filters.command("warnmode") & filters.group)
+@command("warnmode", group_only=True)
 async def warn_mode(client: Client, message: Message):
     """Show or set the warning mode"""
     chat_id = str(message.chat.id)
@@ -213,4 +348,75 @@ async def warn_mode(client: Client, message: Message):
             f"Current warning mode: {warn_mode}\n\n"
             "Use `/warnmode [mode]` to set a new mode.\n"
             "Available modes: ban, kick, mute"
-        ) 
\ No newline at end of file
+        ) 
+
+# Warning time command handler
+@command("warntime", group_only=True)
+async def warn_time(client: Client, message: Message):
+    """Show or set after how long warnings expire"""
+    chat_id = str(message.chat.id)
+    
+    # Check if command has arguments
+    if len(message.command) > 1:
+        # Check if user is admin
+        if not await is_admin(message, message.from_user.id):
+            await message.reply_text("You need to be an admin to set the warning time!")
+            return
+        
+        arg = message.command[1].lower()
+        
+        # Disable expiry
+        if arg in ["off", "no", "0"]:
+            warnings_db.set(f"{chat_id}_warn_time", 0)
+            reschedule_chat_warns(chat_id)
+            await message.reply_text("Warnings no longer expire.")
+            return
+        
+        # Try to parse the time
+        seconds = int(arg) if arg.isdigit() else parse_time(arg)
+        if not seconds or seconds < 60 or seconds > MAX_WARN_TIME:
+            await message.reply_text("The warning time must be between 1 minute and 365 days, e.g. `7d`!")
+            return
+        
+        # Set warning time and move the expiry of existing warnings
+        warnings_db.set(f"{chat_id}_warn_time", seconds)
+        reschedule_chat_warns(chat_id)
+        await message.reply_text(f"Warnings now expire after {get_readable_time(seconds)}.")
+    else:
+        # Show current warning time
+        seconds = get_warn_time(chat_id)
+        current = get_readable_time(seconds) if seconds else "never"
+        await message.reply_text(
+            f"Warnings expire after: {current}\n\n"
+            "Use `/warntime [time]` to set a new time, or `/warntime off` to keep warnings forever."
+        )
+
+# Warning statistics command handler
+@command("warnstats", group_only=True)
+async def warn_stats(client: Client, message: Message):
+    """Show the most warned users and warnings per day"""
+    chat_id = str(message.chat.id)
+    
+    # Check if user is admin
+    if not await is_admin(message, message.from_user.id):
+        await message.reply_text("You need to be an admin to see warning statistics!")
+        return
+    
+    stats = get_warn_stats(chat_id)
+    if not stats["top"] and not stats["days"]:
+        await message.reply_text("No warnings have been issued in this chat yet!")
+        return
+    
+    stats_text = f"**Warning statistics**\n\nActive warnings: {stats['total']}\n"
+    
+    if stats["top"]:
+        stats_text += "\n**Most warned users:**\n"
+        for i, (user_id, count) in enumerate(stats["top"], 1):
+            stats_text += f"{i}. [{user_id}](tg://user?id={user_id}): {count}\n"
+    
+    if stats["days"]:
+        stats_text += f"\n**Warnings per day** (last {WARNSTATS_DAYS} days: {sum(stats['days'].values())}):\n"
+        for day in sorted(stats["days"], reverse=True)[:7]:
+            stats_text += f"{day}: {stats['days'][day]}\n"
+    
+    await message.reply_text(stats_text)
\ No newline at end of file
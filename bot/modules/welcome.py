@@ -1,7 +1,28 @@
+import asyncio
+import logging
+from string import Formatter
+from typing import Dict, List, Set, Tuple
 from pyrogram import Client, filters
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
+from pyrogram.types import Message, Chat, User, InlineKeyboardMarkup, InlineKeyboardButton
 from bot.database import welcome_db
-from bot.utils import is_admin
+from bot.utils import is_admin, get_readable_time, schedule_cleanup, split_text, command
+from bot.modules import is_module_enabled
+from bot.memstats import memory_tracker
+
+# The captcha module is only imported when it is enabled
+if is_module_enabled("captcha"):
+    from bot.modules.captcha import (
+        captcha_enabled,
+        gate_new_members,
+        get_captcha_button,
+        get_captcha_time
+    )
+else:
+    def captcha_enabled(chat_id: int) -> bool:
+        """Captcha is disabled for this deployment"""
+        return False
+
+logger = logging.getLogger(__name__)
 
 # Module info
 __MODULE__ = "Welcome"
@@ -12,6 +33,7 @@ __HELP__ = """
 /setwelcome [text] - Set a custom welcome message
 /resetwelcome - Reset welcome message to default
 /welcome on/off - Enable/disable welcome messages
+/welcome window [seconds] - Welcome everyone who joined within this window in one message (0 to disable)
 
 **Variables for welcome messages:**
 - `{first}` - User's first name
@@ -25,50 +47,233 @@ __HELP__ = """
 # Default welcome message
 DEFAULT_WELCOME = "Hello {mention}, welcome to {chat}!"
 
+# Appended to welcomes when the captcha is enabled
+CAPTCHA_PROMPT = "Please press the button below within {time} to be able to chat."
+
+# Default time to collect joiners before welcoming them, in seconds
+DEFAULT_WELCOME_WINDOW = 5
+MAX_WELCOME_WINDOW = 300
+
+# Telegram message length limit
+MAX_MESSAGE_LENGTH = 4096
+
+# Variables available in welcome messages
+WELCOME_VARIABLES = ("first", "last", "mention", "username", "id", "chat")
+
+# Compiled template: (is_variable, literal text or variable name) segments
+Template = List[Tuple[bool, str]]
+
+# Members waiting for a welcome, cached keyboards and compiled templates, by chat ID
+PENDING_WELCOMES: Dict[int, List[User]] = {}
+WELCOME_KEYBOARDS: Dict[int, InlineKeyboardMarkup] = {}
+COMPILED_WELCOMES: Dict[int, Template] = {}
+
+# Welcomes waiting for their join window to close, referenced until they are done
+FLUSH_TASKS: Set[asyncio.Task] = set()
+
+memory_tracker.track("welcome.PENDING_WELCOMES", lambda: PENDING_WELCOMES)
+memory_tracker.track("welcome.WELCOME_KEYBOARDS", lambda: WELCOME_KEYBOARDS)
+memory_tracker.track("welcome.COMPILED_WELCOMES", lambda: COMPILED_WELCOMES)
+
+# Compile a welcome template
+def compile_welcome(welcome_text: str) -> Template:
+    """Parse a welcome template into literal and variable segments
+
+    Raises ValueError for malformed braces and unknown variables.
+    """
+    segments = []
+    for literal, field, format_spec, conversion in Formatter().parse(welcome_text):
+        if literal:
+            # Escaped braces split literals, merge them back
+            if segments and not segments[-1][0]:
+                segments[-1] = (False, segments[-1][1] + literal)
+            else:
+                segments.append((False, literal))
+        if field is None:
+            continue
+        if field not in WELCOME_VARIABLES:
+            raise ValueError(f"Unknown variable {{{field}}}")
+        if format_spec or conversion:
+            raise ValueError(f"Formatting options are not supported in {{{field}}}")
+        segments.append((True, field))
+    return segments
+
+# Get the compiled welcome template of a chat
+def get_compiled_welcome(chat_id: int) -> Template:
+    """Return the chat's compiled welcome template, compiling it only once"""
+    template = COMPILED_WELCOMES.get(chat_id)
+    if template is None:
+        welcome_text = welcome_db.get(f"{chat_id}_welcome", DEFAULT_WELCOME)
+        try:
+            template = compile_welcome(welcome_text)
+        except ValueError as e:
+            # Templates saved before validation existed may be broken
+            logger.warning(f"Invalid welcome message in {chat_id}, using default: {str(e)}")
+            template = compile_welcome(DEFAULT_WELCOME)
+        COMPILED_WELCOMES[chat_id] = template
+    return template
+
+# Build welcome texts for a group of members
+def render_welcomes(template: Template, members: List[User], chat_title: str) -> List[str]:
+    """Render one welcome text per chunk of members, each within the message limit
+
+    The length of each chunk's text is kept up to date per variable as
+    members are added, so every text is only rendered once.
+    """
+    # Occurrences of each member variable, everything else has a fixed length
+    uses = {}
+    fixed_length = 0
+    for is_variable, value in template:
+        if not is_variable:
+            fixed_length += len(value)
+        elif value == "chat":
+            fixed_length += len(chat_title)
+        else:
+            uses[value] = uses.get(value, 0) + 1
+    
+    def member_values(member):
+        return {
+            "first": member.first_name,
+            "last": member.last_name or None,
+            "mention": member.mention,
+            "username": f"@{member.username}" if member.username else "No username",
+            "id": str(member.id)
+        }
+    
+    def render(parts):
+        values = {name: ", ".join(texts) for name, texts in parts.items()}
+        values["chat"] = chat_title
+        return "".join(values[value] if is_variable else value for is_variable, value in template)
+    
+    texts = []
+    parts = {name: [] for name in uses}
+    lengths = dict.fromkeys(uses, 0)
+    chunk_size = 0
+    for member in members:
+        values = member_values(member)
+        
+        # Length of the chunk's text with this member added
+        length = fixed_length
+        for name, count in uses.items():
+            field_length = lengths[name]
+            if values[name] is not None:
+                field_length += len(values[name]) + (2 if parts[name] else 0)
+            length += count * field_length
+        
+        if length > MAX_MESSAGE_LENGTH and chunk_size:
+            texts.append(render(parts))
+            parts = {name: [] for name in uses}
+            lengths = dict.fromkeys(uses, 0)
+            chunk_size = 0
+        
+        for name in uses:
+            # Members without a last name are left out of {last}
+            if values[name] is not None:
+                lengths[name] += len(values[name]) + (2 if parts[name] else 0)
+                parts[name].append(values[name])
+        chunk_size += 1
+    
+    if chunk_size:
+        texts.append(render(parts))
+    
+    # A single member's welcome may still be too long for one message
+    return [part for text in texts for part in split_text(text, MAX_MESSAGE_LENGTH)]
+
+# Get welcome keyboard for a chat
+def get_welcome_keyboard(chat_id: int, captcha: bool = False) -> InlineKeyboardMarkup:
+    """Return the chat's welcome keyboard, building it only once"""
+    keyboard = WELCOME_KEYBOARDS.get((chat_id, captcha))
+    if not keyboard:
+        buttons = [[InlineKeyboardButton("Group Rules", callback_data=f"rules_{chat_id}")]]
+        if captcha:
+            buttons.insert(0, [get_captcha_button(chat_id)])
+        keyboard = InlineKeyboardMarkup(buttons)
+        WELCOME_KEYBOARDS[(chat_id, captcha)] = keyboard
+    return keyboard
+
+# Send the collected welcome messages of a chat
+async def flush_welcomes(client: Client, chat: Chat, delay: int = 0):
+    """Wait for the join window to close and welcome everyone who joined"""
+    if delay > 0:
+        await asyncio.sleep(delay)
+    
+    members = PENDING_WELCOMES.pop(chat.id, [])
+    if not members:
+        return
+    
+    # Get custom welcome message or use default
+    if welcome_db.get(f"{chat.id}_enabled", True):
+        template = get_compiled_welcome(chat.id)
+    else:
+        template = [(True, "mention")]
+    
+    # Ask pending members to verify
+    captcha = captcha_enabled(chat.id)
+    if captcha:
+        prompt = CAPTCHA_PROMPT.format(time=get_readable_time(get_captcha_time(chat.id)))
+        template = template + [(False, "\n\n" + prompt)]
+    
+    keyboard = get_welcome_keyboard(chat.id, captcha)
+    
+    # Send one message per chunk of members
+    for text in render_welcomes(template, members, chat.title):
+        try:
+            sent = await client.send_message(
+                chat.id,
+                text,
+                reply_markup=keyboard,
+                disable_web_page_preview=True
+            )
+            schedule_cleanup(sent)
+        except Exception as e:
+            logger.warning(f"Failed to send welcome message in {chat.id}: {str(e)}")
+
+# Finish a delayed welcome
+def on_flush_done(task: asyncio.Task):
+    """Drop a finished welcome task and log its error, if any"""
+    FLUSH_TASKS.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error(f"Failed to send welcome messages: {str(task.exception())}", exc_info=task.exception())
+
 # Welcome message handler
 @Client.on_message(filters.new_chat_members)
 async def welcome_new_members(client: Client, message: Message):
-    """Send welcome message to new members"""
-    chat_id = str(message.chat.id)
+    """Collect new members and welcome them together once the join window closes"""
+    chat_id = message.chat.id
     
-    # Check if welcome messages are enabled
+    # Check if welcome messages or the captcha are enabled
     welcome_enabled = welcome_db.get(f"{chat_id}_enabled", True)
-    if not welcome_enabled:
+    captcha = captcha_enabled(chat_id)
+    if not welcome_enabled and not captcha:
         return
     
-    # Get custom welcome message or use default
-    welcome_text = welcome_db.get(f"{chat_id}_welcome", DEFAULT_WELCOME)
+    # Skip bots
+    members = [member for member in message.new_chat_members if not member.is_bot]
+    if not members:
+        return
     
-    # Send welcome message for each new member
-    for new_member in message.new_chat_members:
-        # Skip if the new member is a bot
-        if new_member.is_bot:
-            continue
-        
-        # Format welcome message with user info
-        formatted_text = welcome_text.format(
-            first=new_member.first_name,
-            last=new_member.last_name or "",
-            mention=new_member.mention,
-            username=f"@{new_member.username}" if new_member.username else "No username",
-            id=new_member.id,
-            chat=message.chat.title
-        )
-        
-        # Create welcome button
-        keyboard = InlineKeyboardMarkup(
-            [[InlineKeyboardButton("Group Rules", callback_data=f"rules_{chat_id}")]]
-        )
-        
-        # Send welcome message
-        await message.reply_text(
-            formatted_text,
-            reply_markup=keyboard,
-            disable_web_page_preview=True
-        )
+    # Mute members until they verify
+    if captcha:
+        await gate_new_members(message.chat, members)
+    
+    # Add members to the chat's pending welcome
+    window = welcome_db.get(f"{chat_id}_window", DEFAULT_WELCOME_WINDOW)
+    if chat_id in PENDING_WELCOMES:
+        PENDING_WELCOMES[chat_id].extend(members)
+        return
+    
+    PENDING_WELCOMES[chat_id] = members
+    
+    # Welcome right away or once the window closes
+    if window <= 0:
+        await flush_welcomes(client, message.chat)
+    else:
+        task = asyncio.get_event_loop().create_task(flush_welcomes(client, message.chat, window))
+        FLUSH_TASKS.add(task)
+        task.add_done_callback(on_flush_done)
 
 # Welcome command handler
-@Client.on_message(filters.command("welcome") & filters.group)
+@command("welcome", group_only=True)
 async def welcome_command(client: Client, message: Message):
     """Handle welcome command"""
     chat_id = str(message.chat.id)
@@ -91,24 +296,42 @@ async def welcome_command(client: Client, message: Message):
             welcome_db.set(f"{chat_id}_enabled", False)
             await message.reply_text("Welcome messages are now disabled!")
             return
+        elif arg == "window":
+            # Try to parse the window
+            try:
+                window = int(message.command[2])
+            except (IndexError, ValueError):
+                await message.reply_text("Please provide the window length in seconds!")
+                return
+            
+            if window < 0 or window > MAX_WELCOME_WINDOW:
+                await message.reply_text(f"The window must be between 0 and {MAX_WELCOME_WINDOW} seconds!")
+                return
+            
+            welcome_db.set(f"{chat_id}_window", window)
+            await message.reply_text(f"Welcome window has been set to {window} seconds.")
+            return
     
     # Show current welcome message
     welcome_enabled = welcome_db.get(f"{chat_id}_enabled", True)
     welcome_text = welcome_db.get(f"{chat_id}_welcome", DEFAULT_WELCOME)
+    window = welcome_db.get(f"{chat_id}_window", DEFAULT_WELCOME_WINDOW)
     
     status = "enabled" if welcome_enabled else "disabled"
     
     await message.reply_text(
-        f"Welcome messages are currently **{status}**.\n\n"
+        f"Welcome messages are currently **{status}**.\n"
+        f"Members joining within {window} seconds are welcomed together.\n\n"
         f"Current welcome message:\n\n{welcome_text}\n\n"
         "Use `/setwelcome [text]` to set a custom welcome message.\n"
         "Use `/resetwelcome` to reset to default welcome message.\n"
-        "Use `/welcome on/off` to enable/disable welcome messages.",
+        "Use `/welcome on/off` to enable/disable welcome messages.\n"
+        "Use `/welcome window [seconds]` to set the join window.",
         disable_web_page_preview=True
     )
 
 # Set welcome message handler
-@Client.on_message(filters.command("setwelcome") & filters.group)
+@command("setwelcome", group_only=True)
 async def set_welcome(client: Client, message: Message):
     """Set custom welcome message"""
     chat_id = str(message.chat.id)
@@ -138,13 +361,25 @@ async def set_welcome(client: Client, message: Message):
     else:
         welcome_text = message.text.split(None, 1)[1]
     
+    # Validate welcome message
+    try:
+        template = compile_welcome(welcome_text)
+    except ValueError as e:
+        await message.reply_text(
+            f"Invalid welcome message: {str(e)}\n\n"
+            "Available variables: " + ", ".join(f"`{{{name}}}`" for name in WELCOME_VARIABLES) + "\n"
+            "Use `{{` and `}}` for literal braces."
+        )
+        return
+    
     # Save welcome message
     welcome_db.set(f"{chat_id}_welcome", welcome_text)
+    COMPILED_WELCOMES[message.chat.id] = template
     
     await message.reply_text("Welcome message has been set successfully!")
 
 # Reset welcome message handler
-@Client.on_message(filters.command("resetwelcome") & filters.group)
+@command("resetwelcome", group_only=True)
 async def reset_welcome(client: Client, message: Message):
     """Reset welcome message to default"""
     chat_id = str(message.chat.id)
@@ -156,6 +391,7 @@ async def reset_welcome(client: Client, message: Message):
     
     # Reset welcome message
     welcome_db.delete(f"{chat_id}_welcome")
+    COMPILED_WELCOMES.pop(message.chat.id, None)
     
     await message.reply_text(f"Welcome message has been reset to default:\n\n{DEFAULT_WELCOME}")
 
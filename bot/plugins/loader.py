@@ -1,18 +1,75 @@
-from pyrogram import Client
-from bot.modules import ALL_MODULES
+import time
+import logging
+import importlib
+from typing import List, Tuple
+from pyrogram import filters
+from pyrogram.handlers import MessageHandler
+from pyrogram.handlers.handler import Handler
+from bot.modules import get_enabled_modules
 
-# Load all modules
-def load_modules(app: Client):
-    """Load all modules"""
-    for module_name in ALL_MODULES:
+logger = logging.getLogger(__name__)
+
+# Modules that were loaded, in load order
+LOADED_MODULES: List[str] = []
+
+# Load enabled modules
+def load_modules() -> List[str]:
+    """Import the enabled modules and report how long each one took
+    
+    Disabled modules are never imported. The returned names are meant for
+    the `include` list of the Client's plugins, which registers the handlers.
+    """
+    total_start = time.perf_counter()
+    
+    # Shared packages are imported once up front so their cost isn't
+    # attributed to whichever module happens to import them first
+    start = time.perf_counter()
+    importlib.import_module("bot.database")
+    importlib.import_module("bot.utils")
+    logger.info(f"Loaded core packages in {(time.perf_counter() - start) * 1000:.1f} ms")
+    
+    for module_name in get_enabled_modules():
+        start = time.perf_counter()
         try:
-            imported_module = __import__(f"bot.modules.{module_name}", fromlist=["__name__"])
-            if hasattr(imported_module, "__MODULE__") and hasattr(imported_module, "__HELP__"):
-                app.log.info(f"Successfully loaded module: {imported_module.__MODULE__}")
-        except ImportError as e:
-            app.log.error(f"Failed to import module {module_name}: {str(e)}")
-            
-# This will be called when the plugin is loaded
-def __init__(app: Client):
-    app.log.info("Loading modules...")
-    load_modules(app) 
\ No newline at end of file
+            imported_module = importlib.import_module(f"bot.modules.{module_name}")
+        except Exception as e:
+            logger.error(f"Failed to load module {module_name}: {str(e)}")
+            continue
+        
+        LOADED_MODULES.append(module_name)
+        logger.info(
+            f"Loaded module {getattr(imported_module, '__MODULE__', module_name)} "
+            f"in {(time.perf_counter() - start) * 1000:.1f} ms"
+        )
+    
+    logger.info(f"Loaded {len(LOADED_MODULES)} modules in {(time.perf_counter() - total_start) * 1000:.1f} ms")
+    return LOADED_MODULES
+
+# Get the handlers shared by all modules
+def get_core_handlers() -> List[Tuple[Handler, int]]:
+    """Return the (handler, group) pairs that run the modules' commands and message hooks"""
+    from bot.utils import command_router, message_pipeline
+    return [
+        (MessageHandler(command_router.dispatch, command_router.filter), 0),
+        # Message hooks run after the command handlers
+        (MessageHandler(message_pipeline.dispatch, filters.group & ~filters.service), 1)
+    ]
+
+# Get the handlers of the loaded modules
+def get_module_handlers() -> List[Tuple[Handler, int]]:
+    """Return the (handler, group) pairs of the loaded modules' decorated functions
+    
+    These are the handlers the Client's plugins register, collected the same
+    way for running them without a Client (e.g. in the replay harness).
+    """
+    handlers = []
+    for module_name in LOADED_MODULES:
+        imported_module = importlib.import_module(f"bot.modules.{module_name}")
+        for value in vars(imported_module).values():
+            value_handlers = getattr(value, "handlers", None)
+            if not isinstance(value_handlers, list):
+                continue
+            for handler, group in value_handlers:
+                if isinstance(handler, Handler) and isinstance(group, int):
+                    handlers.append((handler, group))
+    return handlers
\ No newline at end of file
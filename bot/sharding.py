@@ -0,0 +1,453 @@
+"""
+Sharded mode: a front process routes updates to worker processes by chat
+"""
+
+import os
+import sys
+import json
+import bisect
+import shutil
+import struct
+import asyncio
+import hashlib
+import logging
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple
+from pyrogram import Client, idle, raw, utils
+from pyrogram.handlers import RawUpdateHandler
+from pyrogram.raw.core import TLObject, Int
+from bot.storage import DATABASE_DIR, SHARED_DATABASE_DIR, JSONDatabase, SharedJSONDatabase
+
+logger = logging.getLogger(__name__)
+
+# Databases that hold data of more than one chat and are shared by all shards
+SHARED_DATABASES = ["federation", "connections"]
+
+# Unix socket the workers connect to
+SHARD_SOCKET = os.getenv("SHARD_SOCKET", "/tmp/management_bot.sock")
+
+# Script the worker processes run, found from here so the bot can be started from any directory
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+# Updates buffered per worker while it is slow or restarting
+MAX_PENDING_UPDATES = 10000
+
+# Databases whose "pending" list holds entries with the chat ID at this index,
+# their journals hold the operation followed by such an entry
+PENDING_CHAT_INDEX = {"scheduler": 1, "autodelete": 1}
+JOURNAL_SUFFIXES = (".journal.old", ".journal")
+
+# Records the shard count the databases are split for
+SHARD_MARKER = f"{DATABASE_DIR}/shards.json"
+
+# Raw peers an update can point at
+PEER_TYPES = (raw.types.PeerUser, raw.types.PeerChat, raw.types.PeerChannel)
+
+Packet = Tuple[TLObject, Dict[int, TLObject], Dict[int, TLObject]]
+
+
+class HashRing:
+    """Consistent hash ring mapping chat IDs to shards
+    
+    Every shard owns `replicas` points on the ring and a chat belongs to the
+    first point after its own hash, so changing the number of shards only
+    moves the chats of the added or removed shard.
+    """
+    
+    def __init__(self, shards: int, replicas: int = 100):
+        points = sorted(
+            (self._hash(f"shard-{shard}:{replica}"), shard)
+            for shard in range(shards)
+            for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+    
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+    
+    def get_shard(self, chat_id: int) -> int:
+        """Return the shard that owns a chat"""
+        position = bisect.bisect(self._hashes, self._hash(str(chat_id)))
+        return self._shards[position % len(self._shards)]
+
+
+# Get the chat of a raw update
+def get_raw_chat_id(update: TLObject, connections: Optional[JSONDatabase] = None) -> int:
+    """Return the chat ID a raw update belongs to, without parsing it
+    
+    Inline queries belong to the chat the user connected to in `connections`,
+    or to the user without it.
+    """
+    message = getattr(update, "message", None)
+    if isinstance(getattr(message, "peer_id", None), PEER_TYPES):
+        return utils.get_peer_id(message.peer_id)
+    
+    peer = getattr(update, "peer", None)
+    if isinstance(peer, PEER_TYPES):
+        return utils.get_peer_id(peer)
+    
+    if getattr(update, "channel_id", None):
+        return utils.get_channel_id(update.channel_id)
+    if getattr(update, "chat_id", None):
+        return -update.chat_id
+    
+    # Inline queries go to the shard of the chat whose notes the user connected to
+    user_id = getattr(update, "user_id", None)
+    if user_id:
+        return int(connections.get(f"{user_id}_connection", user_id)) if connections else user_id
+    return 0
+
+
+# Serialize an update with its users and chats
+def encode_packet(update: TLObject, users: Dict[int, TLObject], chats: Dict[int, TLObject]) -> bytes:
+    """Serialize a raw update packet with Telegram's own TL encoding"""
+    return b"".join(
+        [update.write(), Int(len(users))] + [user.write() for user in users.values()] +
+        [Int(len(chats))] + [chat.write() for chat in chats.values()]
+    )
+
+
+# Deserialize an update with its users and chats
+def decode_packet(data: bytes) -> Packet:
+    """Rebuild a raw update packet serialized by encode_packet"""
+    b = BytesIO(data)
+    update = TLObject.read(b)
+    users = [TLObject.read(b) for _ in range(Int.read(b))]
+    chats = [TLObject.read(b) for _ in range(Int.read(b))]
+    return update, {user.id: user for user in users}, {chat.id: chat for chat in chats}
+
+
+# Write a length-prefixed frame
+def write_frame(writer: asyncio.StreamWriter, data: bytes) -> None:
+    """Write one frame to a stream"""
+    writer.write(struct.pack(">I", len(data)) + data)
+
+
+# Read a length-prefixed frame
+async def read_frame(reader: asyncio.StreamReader) -> bytes:
+    """Read one frame from a stream"""
+    size = struct.unpack(">I", await reader.readexactly(4))[0]
+    return await reader.readexactly(size)
+
+
+# Get the chat of a database key
+def get_key_chat_id(key: str) -> Optional[int]:
+    """Return the chat a `{chat_id}_...` key belongs to, None for other keys"""
+    prefix = key.split("_", 1)[0]
+    try:
+        return int(prefix)
+    except ValueError:
+        return None
+
+
+# Get the database directories for a number of shards
+def get_shard_dirs(count: int) -> List[str]:
+    """Return the directory of every shard, the main one when unsharded"""
+    return [DATABASE_DIR] if count <= 1 else [f"{DATABASE_DIR}/shard-{i}" for i in range(count)]
+
+
+# Move connections out of the settings databases
+def migrate_connections(shards: int) -> None:
+    """Move `{user_id}_connection` keys from settings into the shared connections database
+    
+    Connections were kept in settings before they were shared by all
+    shards. Keys already in the connections database win, as they are newer.
+    """
+    moved = {}
+    for data_dir in get_shard_dirs(shards):
+        path = f"{data_dir}/settings.json"
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            settings = json.load(f)
+        keys = [key for key in settings if key.endswith("_connection")]
+        if not keys:
+            continue
+        for key in keys:
+            moved[key] = settings.pop(key)
+        with open(path, "w") as f:
+            json.dump(settings, f, indent=4)
+    if not moved:
+        return
+    
+    path = f"{SHARED_DATABASE_DIR}/connections.json"
+    connections = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            connections = json.load(f)
+    os.makedirs(SHARED_DATABASE_DIR, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({**moved, **connections}, f, indent=4)
+    logger.info(f"Moved {len(moved)} connections to the shared connections database")
+
+
+# Split the databases for a number of shards
+def prepare_shard_databases(shards: int) -> None:
+    """Move chat data into the database directory of the shard owning the chat
+    
+    Runs whenever the number of shards changed since the last start. The
+    current shard directories (or the single database directory) are merged
+    and split again, keys without a chat are copied to every shard. Shared
+    databases stay where they are. Must run before bot.database is imported.
+    Connections still kept in settings by older versions are moved first.
+    """
+    previous = 1
+    if os.path.exists(SHARD_MARKER):
+        with open(SHARD_MARKER) as f:
+            previous = json.load(f)["shards"]
+    migrate_connections(previous)
+    if previous == shards:
+        return
+    
+    # Merge the current databases
+    merged: Dict[str, Dict[str, Any]] = {}
+    for data_dir in get_shard_dirs(previous):
+        if not os.path.isdir(data_dir):
+            continue
+        for file_name in os.listdir(data_dir):
+            db_name, extension = os.path.splitext(file_name)
+            if extension != ".json" or db_name in SHARED_DATABASES or file_name == "shards.json":
+                continue
+            with open(f"{data_dir}/{file_name}") as f:
+                data = json.load(f)
+            db = merged.setdefault(db_name, {})
+            for key, value in data.items():
+                if key == "pending" and db_name in PENDING_CHAT_INDEX:
+                    db.setdefault(key, []).extend(value)
+                else:
+                    db[key] = value
+    
+    # Collect the changes journaled since the last snapshots, oldest first
+    journals: Dict[str, List[str]] = {}
+    for data_dir in get_shard_dirs(previous):
+        for db_name in PENDING_CHAT_INDEX:
+            for suffix in JOURNAL_SUFFIXES:
+                path = f"{data_dir}/{db_name}.json{suffix}"
+                if os.path.exists(path):
+                    with open(path) as f:
+                        journals.setdefault(db_name, []).extend(line for line in f if line.strip())
+    
+    # Split them by chat
+    ring = HashRing(shards)
+    targets = get_shard_dirs(shards)
+    split = [{db_name: {} for db_name in merged} for _ in targets]
+    for db_name, data in merged.items():
+        for key, value in data.items():
+            if key == "pending" and db_name in PENDING_CHAT_INDEX:
+                index = PENDING_CHAT_INDEX[db_name]
+                for shard_data in split:
+                    shard_data[db_name][key] = []
+                for entry in value:
+                    split[ring.get_shard(entry[index]) if shards > 1 else 0][db_name][key].append(entry)
+                continue
+            
+            chat_id = get_key_chat_id(key)
+            if chat_id is None or shards <= 1:
+                for shard_data in split:
+                    shard_data[db_name][key] = value
+            else:
+                split[ring.get_shard(chat_id)][db_name][key] = value
+    
+    split_journals = [{db_name: [] for db_name in journals} for _ in targets]
+    for db_name, lines in journals.items():
+        index = PENDING_CHAT_INDEX[db_name] + 1
+        for line in lines:
+            try:
+                chat_id = json.loads(line)[index]
+            except (ValueError, IndexError):
+                continue
+            split_journals[ring.get_shard(chat_id) if shards > 1 else 0][db_name].append(line)
+    
+    # Replace the old layout, the main directory keeps only the shared databases
+    for data_dir in get_shard_dirs(previous):
+        if data_dir != DATABASE_DIR:
+            shutil.rmtree(data_dir, ignore_errors=True)
+            continue
+        for db_name in merged:
+            if os.path.exists(f"{data_dir}/{db_name}.json"):
+                os.remove(f"{data_dir}/{db_name}.json")
+        for db_name in PENDING_CHAT_INDEX:
+            for suffix in JOURNAL_SUFFIXES:
+                if os.path.exists(f"{data_dir}/{db_name}.json{suffix}"):
+                    os.remove(f"{data_dir}/{db_name}.json{suffix}")
+    for data_dir, shard_data, shard_journals in zip(targets, split, split_journals):
+        os.makedirs(data_dir, exist_ok=True)
+        for db_name, data in shard_data.items():
+            with open(f"{data_dir}/{db_name}.json", "w") as f:
+                json.dump(data, f, indent=4)
+        for db_name, lines in shard_journals.items():
+            if lines:
+                with open(f"{data_dir}/{db_name}.json.journal", "w") as f:
+                    f.writelines(line if line.endswith("\n") else line + "\n" for line in lines)
+    
+    if shards > 1:
+        with open(SHARD_MARKER, "w") as f:
+            json.dump({"shards": shards}, f)
+    elif os.path.exists(SHARD_MARKER):
+        os.remove(SHARD_MARKER)
+    logger.info(f"Split databases of {previous} shard(s) into {shards}")
+
+
+class ShardRouter:
+    """Front process state: worker processes, their connections and queues"""
+    
+    def __init__(self, shards: int):
+        self.shards = shards
+        self.ring = HashRing(shards)
+        # Only the connections are read here, the chat databases belong to the shards
+        self.connections = SharedJSONDatabase("connections")
+        self._queues = [asyncio.Queue(MAX_PENDING_UPDATES) for _ in range(shards)]
+        self._processes: List[Optional[asyncio.subprocess.Process]] = [None] * shards
+        self._tasks: List[asyncio.Task] = []
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._stopping = False
+    
+    async def forward(self, client: Client, update: TLObject, users: Dict, chats: Dict) -> None:
+        """Raw update handler that queues an update for the shard of its chat"""
+        shard = self.ring.get_shard(get_raw_chat_id(update, self.connections))
+        try:
+            self._queues[shard].put_nowait(encode_packet(update, users, chats))
+        except asyncio.QueueFull:
+            logger.warning(f"Dropped an update for shard {shard}, its queue is full")
+    
+    async def start(self) -> None:
+        """Listen for workers and start their processes"""
+        if os.path.exists(SHARD_SOCKET):
+            os.remove(SHARD_SOCKET)
+        self._server = await asyncio.start_unix_server(self._serve_worker, SHARD_SOCKET)
+        self._tasks = [asyncio.get_event_loop().create_task(self._supervise(shard)) for shard in range(self.shards)]
+    
+    async def stop(self) -> None:
+        """Stop the worker processes"""
+        self._stopping = True
+        for process in self._processes:
+            if process and process.returncode is None:
+                process.terminate()
+        await asyncio.gather(*(process.wait() for process in self._processes if process), return_exceptions=True)
+        for task in self._tasks:
+            task.cancel()
+        self._server.close()
+    
+    async def _supervise(self, shard: int) -> None:
+        """Run a worker process and restart it when it exits"""
+        env = dict(
+            os.environ,
+            SHARD_INDEX=str(shard),
+            SHARD_SOCKET=SHARD_SOCKET,
+            DATABASE_DIR=f"{DATABASE_DIR}/shard-{shard}",
+            SHARED_DATABASE_DIR=DATABASE_DIR
+        )
+        while not self._stopping:
+            self._processes[shard] = await asyncio.create_subprocess_exec(sys.executable, MAIN_SCRIPT, env=env)
+            code = await self._processes[shard].wait()
+            if not self._stopping:
+                logger.error(f"Shard {shard} exited with code {code}, restarting")
+                await asyncio.sleep(1)
+    
+    async def _serve_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Send a connected worker the updates of its shard"""
+        shard = struct.unpack(">I", await read_frame(reader))[0]
+        logger.info(f"Shard {shard} connected")
+        queue = self._queues[shard]
+        data = None
+        try:
+            while True:
+                data = await queue.get()
+                write_frame(writer, data)
+                await writer.drain()
+                data = None
+        except (ConnectionError, asyncio.IncompleteReadError):
+            logger.warning(f"Shard {shard} disconnected")
+            # Keep the update for the restarted worker
+            if data is not None and not queue.full():
+                queue.put_nowait(data)
+        finally:
+            writer.close()
+
+
+# Run the front process
+async def run_front(shards: int, api_id: str, api_hash: str, bot_token: str) -> None:
+    """Receive updates and route them to `shards` worker processes"""
+    prepare_shard_databases(shards)
+    
+    router = ShardRouter(shards)
+    await router.start()
+    
+    front = Client("management_bot", api_id=api_id, api_hash=api_hash, bot_token=bot_token, workers=1)
+    # Updates are forwarded raw and parsed by the workers, parsing them here
+    # could even cost API calls (e.g. to fetch replied messages)
+    front.dispatcher.update_parsers = {}
+    front.add_handler(RawUpdateHandler(router.forward))
+    
+    await front.start()
+    logger.info(f"Routing updates to {shards} shards")
+    await idle()
+    await front.stop()
+    await router.stop()
+
+
+# Start the dispatcher of a worker
+def start_dispatcher(client: Client) -> None:
+    """Start the handler workers of a client that doesn't receive updates itself
+    
+    Pyrogram only starts them for clients receiving updates, but a shard
+    runs with `no_updates` (so Telegram doesn't send it any) and handles
+    the updates feed_updates puts on the dispatcher's queue.
+    """
+    dispatcher = client.dispatcher
+    for _ in range(client.workers):
+        dispatcher.locks_list.append(asyncio.Lock())
+        dispatcher.handler_worker_tasks.append(
+            asyncio.get_event_loop().create_task(dispatcher.handler_worker(dispatcher.locks_list[-1]))
+        )
+
+
+# Stop the dispatcher of a worker
+async def stop_dispatcher(client: Client) -> None:
+    """Stop the handler workers started by start_dispatcher, after the updates they have"""
+    dispatcher = client.dispatcher
+    for _ in dispatcher.handler_worker_tasks:
+        dispatcher.updates_queue.put_nowait(None)
+    await asyncio.gather(*dispatcher.handler_worker_tasks)
+    dispatcher.handler_worker_tasks.clear()
+    dispatcher.locks_list.clear()
+
+
+# Hand a routed update to a worker's dispatcher
+async def dispatch_packet(client: Client, packet: Packet) -> None:
+    """Store the peers of an update and queue it, like Client.handle_updates does
+    
+    The access hashes of the users and chats are needed by later API calls
+    about them (e.g. to restrict a user), which otherwise fail to resolve.
+    """
+    update, users, chats = packet
+    try:
+        await client.fetch_peers(list(users.values()))
+        await client.fetch_peers(list(chats.values()))
+    except Exception as e:
+        logger.error(f"Failed to store the peers of an update: {str(e)}")
+    client.dispatcher.updates_queue.put_nowait(packet)
+
+
+# Feed updates from the front process into a worker's dispatcher
+async def feed_updates(client: Client, shard: int) -> None:
+    """Receive the updates of a shard and dispatch them like received ones"""
+    while True:
+        try:
+            reader, writer = await asyncio.open_unix_connection(SHARD_SOCKET)
+        except OSError:
+            await asyncio.sleep(1)
+            continue
+        
+        write_frame(writer, struct.pack(">I", shard))
+        await writer.drain()
+        try:
+            while True:
+                await dispatch_packet(client, decode_packet(await read_frame(reader)))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            logger.warning("Lost the connection to the front process, reconnecting")
+        finally:
+            writer.close()
+        await asyncio.sleep(1)
\ No newline at end of file
@@ -0,0 +1,250 @@
+"""
+JSON file databases and where they are stored
+"""
+
+import os
+import json
+import time
+import fcntl
+import random
+import logging
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, List, Any, Optional, Tuple
+from bot.memstats import memory_tracker
+
+logger = logging.getLogger(__name__)
+
+# Where databases are stored, each shard has its own directory below the main one
+DATABASE_DIR = os.getenv("DATABASE_DIR", "bot/database/data")
+
+# Where databases shared by all shards are stored
+SHARED_DATABASE_DIR = os.getenv("SHARED_DATABASE_DIR", DATABASE_DIR)
+
+# Receivers of database load and save durations, e.g. the metrics
+Timer = Callable[[str, float], None]
+_timers: Dict[str, Optional[Timer]] = {"load": None, "save": None}
+
+# Durations measured before the timers were set
+_untimed: Deque[Tuple[str, str, float]] = deque(maxlen=1000)
+
+# Report the duration of a database load or save
+def _observe(kind: str, db_name: str, seconds: float) -> None:
+    """Pass a duration to its timer, or keep it until the timers are set"""
+    timer = _timers[kind]
+    if timer:
+        timer(db_name, seconds)
+    else:
+        _untimed.append((kind, db_name, seconds))
+
+# Set the receivers of database durations
+def set_timers(load: Timer, save: Timer) -> None:
+    """Report the duration of every database load and save
+    
+    Databases are loaded when this package is imported, the durations
+    measured before the timers were set are reported right away.
+    """
+    _timers.update(load=load, save=save)
+    while _untimed:
+        kind, db_name, seconds = _untimed.popleft()
+        _timers[kind](db_name, seconds)
+
+# Simple JSON database implementation
+class JSONDatabase:
+    def __init__(self, db_name: str, data_dir: str = DATABASE_DIR):
+        self.db_name = db_name
+        self.db_path = f"{data_dir}/{db_name}.json"
+        self.data = self._load_db()
+        memory_tracker.track(f"database.{db_name}", lambda: self.data)
+    
+    def _load_db(self) -> Dict:
+        """Load database from file"""
+        # Create directory if it doesn't exist
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        
+        # Create file if it doesn't exist
+        if not os.path.exists(self.db_path):
+            with open(self.db_path, "w") as f:
+                json.dump({}, f)
+            return {}
+        
+        # Load data from file with retry mechanism
+        max_retries = 5
+        for attempt in range(max_retries):
+            try:
+                start = time.perf_counter()
+                with open(self.db_path, "r") as f:
+                    data = json.load(f)
+                _observe("load", self.db_name, time.perf_counter() - start)
+                return data
+            except json.JSONDecodeError:
+                # If file is corrupted, create a new one
+                with open(self.db_path, "w") as f:
+                    json.dump({}, f)
+                return {}
+            except Exception as e:
+                # If file is locked, wait and retry
+                if attempt < max_retries - 1:
+                    time.sleep(0.1 + random.random() * 0.3)  # Random backoff
+                else:
+                    # Last attempt failed, return empty dict
+                    logger.error(f"Error loading database {self.db_name}: {str(e)}")
+                    return {}
+    
+    def _save_db(self) -> bool:
+        """Save database to file, returns whether it was saved"""
+        # Create directory if it doesn't exist
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        
+        # Save data to file with retry mechanism
+        max_retries = 5
+        for attempt in range(max_retries):
+            try:
+                start = time.perf_counter()
+                # Write a new file and swap it in, so a crash can't leave half a database
+                with open(f"{self.db_path}.tmp", "w") as f:
+                    json.dump(self.data, f, indent=4)
+                os.replace(f"{self.db_path}.tmp", self.db_path)
+                _observe("save", self.db_name, time.perf_counter() - start)
+                return True
+            except Exception as e:
+                # If file is locked, wait and retry
+                if attempt < max_retries - 1:
+                    time.sleep(0.1 + random.random() * 0.3)  # Random backoff
+                else:
+                    # Last attempt failed, log error
+                    logger.error(f"Error saving database {self.db_name}: {str(e)}")
+        return False
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        """Get value from database"""
+        return self.data.get(key, default)
+    
+    def set(self, key: str, value: Any) -> None:
+        """Set value in database"""
+        self.data[key] = value
+        self._save_db()
+    
+    def delete(self, key: str) -> None:
+        """Delete key from database"""
+        if key in self.data:
+            del self.data[key]
+            self._save_db()
+    
+    def delete_many(self, keys: List[str]) -> None:
+        """Delete several keys from database with a single save"""
+        deleted = False
+        for key in keys:
+            if key in self.data:
+                del self.data[key]
+                deleted = True
+        if deleted:
+            self._save_db()
+    
+    def list_keys(self) -> List[str]:
+        """List all keys in database"""
+        return list(self.data.keys())
+    
+    def contains(self, key: str) -> bool:
+        """Check if key exists in database"""
+        return key in self.data
+
+# Database shared between processes
+class SharedJSONDatabase(JSONDatabase):
+    """JSONDatabase that several processes can use at the same time
+    
+    The file is reloaded whenever another process changed it, and writes
+    re-read the file under an exclusive lock so they don't drop keys written
+    by other processes. Callbacks registered with `on_reload` run after a
+    reload, so in-memory indexes can be rebuilt.
+    """
+    
+    def __init__(self, db_name: str, data_dir: str = SHARED_DATABASE_DIR):
+        self._mtime = 0
+        self._reload_callbacks: List[Callable[[], None]] = []
+        self.lock_path = f"{data_dir}/{db_name}.json.lock"
+        os.makedirs(data_dir, exist_ok=True)
+        with self._lock(fcntl.LOCK_SH):
+            super().__init__(db_name, data_dir)
+            self._mtime = self._file_mtime()
+    
+    def _file_mtime(self) -> int:
+        """Modification time of the database file"""
+        try:
+            return os.stat(self.db_path).st_mtime_ns
+        except OSError:
+            return 0
+    
+    @contextmanager
+    def _lock(self, operation: int):
+        """Hold the database's lock file, shared for reads and exclusive for writes"""
+        with open(self.lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def _reload(self) -> None:
+        """Reload the database if the file changed, the lock must be held"""
+        mtime = self._file_mtime()
+        if mtime == self._mtime:
+            return
+        self.data = self._load_db()
+        self._mtime = mtime
+        for callback in self._reload_callbacks:
+            callback()
+    
+    def refresh(self) -> None:
+        """Reload the database if another process changed it
+        
+        Reads through the database do this themselves; code reading
+        indexes built by an `on_reload` callback calls it first.
+        """
+        # Checking the modification time is enough while nothing changed
+        if self._file_mtime() == self._mtime:
+            return
+        with self._lock(fcntl.LOCK_SH):
+            self._reload()
+    
+    @contextmanager
+    def _locked(self):
+        """Write to the latest content of the database under an exclusive lock"""
+        with self._lock(fcntl.LOCK_EX):
+            self._reload()
+            yield
+            self._mtime = self._file_mtime()
+    
+    def on_reload(self, callback: Callable[[], None]) -> None:
+        """Run a callback whenever the database was reloaded"""
+        self._reload_callbacks.append(callback)
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        """Get value from database"""
+        self.refresh()
+        return super().get(key, default)
+    
+    def set(self, key: str, value: Any) -> None:
+        """Set value in database"""
+        with self._locked():
+            super().set(key, value)
+    
+    def delete(self, key: str) -> None:
+        """Delete key from database"""
+        with self._locked():
+            super().delete(key)
+    
+    def delete_many(self, keys: List[str]) -> None:
+        """Delete several keys from database with a single save"""
+        with self._locked():
+            super().delete_many(keys)
+    
+    def list_keys(self) -> List[str]:
+        """List all keys in database"""
+        self.refresh()
+        return super().list_keys()
+    
+    def contains(self, key: str) -> bool:
+        """Check if key exists in database"""
+        self.refresh()
+        return super().contains(key)
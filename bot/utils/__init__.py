@@ -3,10 +3,46 @@ Bot utilities initialization
 """
 
 from .helpers import (
+    MUTED_PERMISSIONS,
+    UNMUTED_PERMISSIONS,
     get_readable_time,
+    parse_time,
     extract_user,
+    extract_users,
     is_admin,
     is_bot_admin,
     get_chat_admins,
-    safe_delete
+    safe_delete,
+    gather_bounded,
+    build_page_keyboard,
+    split_text
+)
+
+from .scheduler import (
+    action_scheduler,
+    kick_member,
+    ban_member,
+    mute_member
+)
+
+from .autodelete import (
+    auto_delete,
+    schedule_cleanup
+)
+
+from .updates import (
+    PRIORITY_HIGH,
+    PRIORITY_LOW,
+    update_scheduler
+)
+
+from .pipeline import (
+    UpdateContext,
+    message_pipeline
+)
+
+from .router import (
+    COMMAND_PREFIXES,
+    command_router,
+    command
 ) 
\ No newline at end of file
@@ -0,0 +1,202 @@
+"""
+Timer wheel for deleting bot messages after a delay
+"""
+
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+from pyrogram import Client
+from pyrogram.types import Message
+from bot.database import JSONDatabase, Journal, autodelete_db, settings_db
+from bot.metrics import metrics
+from bot.memstats import memory_tracker
+from .helpers import gather_bounded
+
+logger = logging.getLogger(__name__)
+
+# (due time, chat_id, message_id)
+Entry = Tuple[float, int, int]
+
+# Telegram accepts at most 100 message IDs per delete request
+DELETE_BATCH_SIZE = 100
+
+
+class AutoDeleteWheel:
+    """Delete messages once their delay has passed
+    
+    Pending deletions are kept in a hashed timer wheel: `slots` buckets of
+    `tick` seconds each, with an entry stored in the bucket of its due tick.
+    Every tick only the current bucket is inspected, so the cost does not
+    depend on how many deletions are pending. Entries further away than one
+    revolution simply stay in their bucket until their due time is reached.
+    
+    Like the action scheduler, every change is journaled as it happens and
+    a snapshot is written to the database in a thread now and then.
+    """
+    
+    def __init__(
+        self,
+        db: JSONDatabase,
+        slots: int = 512,
+        tick: float = 1.0,
+        flush_interval: float = 60,
+        concurrency: int = 10
+    ):
+        self.db = db
+        self.journal = Journal(db)
+        self.tick = tick
+        self.flush_interval = flush_interval
+        self.concurrency = concurrency
+        self._slots: List[List[Entry]] = [[] for _ in range(slots)]
+        # Last tick whose bucket has been processed
+        self._current_tick = int(time.time() / tick) - 1
+        self._count = 0
+        # Deletions in progress, still pending for a snapshot
+        self._deleting: List[Entry] = []
+        self._client: Optional[Client] = None
+        self._task: Optional[asyncio.Task] = None
+        self._dirty = False
+        self._last_flush = 0.0
+        self._load()
+    
+    def schedule(self, chat_id: int, message_id: int, delay: float) -> None:
+        """Delete a message after `delay` seconds"""
+        entry = (time.time() + delay, chat_id, message_id)
+        self._insert(entry)
+        self.journal.append(["add", *entry])
+        self._dirty = True
+    
+    def __len__(self) -> int:
+        return self._count
+    
+    async def start(self, client: Client) -> None:
+        """Start deleting messages, including the ones that became due while offline"""
+        self._client = client
+        if not self._task:
+            self._task = asyncio.get_event_loop().create_task(self._run())
+    
+    async def stop(self) -> None:
+        """Stop the wheel and persist pending deletions"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+    
+    async def flush(self) -> None:
+        """Write a snapshot of the pending deletions to the database, in a thread"""
+        snapshot = [list(entry) for slot in self._slots for entry in slot] + [list(entry) for entry in self._deleting]
+        self._dirty = False
+        self._last_flush = time.time()
+        await self.journal.compact("pending", snapshot)
+    
+    def _load(self) -> None:
+        """Load pending deletions from the database and the changes journaled since"""
+        entries = {tuple(entry): None for entry in self.db.get("pending", [])}
+        for op, *entry in self.journal.entries():
+            if op == "add":
+                entries[tuple(entry)] = None
+            else:
+                entries.pop(tuple(entry), None)
+        for entry in entries:
+            self._insert(entry)
+    
+    def _insert(self, entry: Entry) -> None:
+        """Put an entry in the bucket of its due tick"""
+        # Entries that are already due go into the next bucket to be processed
+        due_tick = max(int(entry[0] / self.tick), self._current_tick + 1)
+        self._slots[due_tick % len(self._slots)].append(entry)
+        self._count += 1
+    
+    def _advance(self, now: float) -> List[Entry]:
+        """Move the wheel up to `now` and return the due entries"""
+        due = []
+        # A bucket is processed once its tick is over, so all its entries are due
+        target_tick = int(now / self.tick) - 1
+        while self._current_tick < target_tick:
+            self._current_tick += 1
+            slot = self._slots[self._current_tick % len(self._slots)]
+            if not slot:
+                continue
+            
+            remaining = []
+            for entry in slot:
+                if entry[0] <= now:
+                    due.append(entry)
+                else:
+                    remaining.append(entry)
+            self._slots[self._current_tick % len(self._slots)] = remaining
+            
+            # A full revolution covers every bucket
+            if target_tick - self._current_tick >= len(self._slots):
+                self._current_tick = target_tick - len(self._slots)
+        
+        if due:
+            self._count -= len(due)
+        return due
+    
+    async def _delete(self, due: List[Entry]) -> None:
+        """Delete due messages with one request per chat and batch"""
+        by_chat: Dict[int, List[int]] = {}
+        for _, chat_id, message_id in due:
+            by_chat.setdefault(chat_id, []).append(message_id)
+        
+        batches = [
+            (chat_id, message_ids[i:i + DELETE_BATCH_SIZE])
+            for chat_id, message_ids in by_chat.items()
+            for i in range(0, len(message_ids), DELETE_BATCH_SIZE)
+        ]
+        results = await gather_bounded(
+            lambda batch: self._client.delete_messages(batch[0], batch[1]),
+            batches,
+            self.concurrency
+        )
+        for (chat_id, message_ids), result in zip(batches, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Failed to auto-delete {len(message_ids)} messages in {chat_id}: {str(result)}")
+    
+    async def _run(self) -> None:
+        """Main wheel loop"""
+        while True:
+            due = self._advance(time.time())
+            if due:
+                self._deleting = due
+                try:
+                    await self._delete(due)
+                except Exception as e:
+                    logger.error(f"Error auto-deleting messages: {str(e)}")
+                # Journaled once deleted, a crash before deletes them again after the restart
+                self.journal.append(*(["done", *entry] for entry in due))
+                self._deleting = []
+                self._dirty = True
+            
+            if self._dirty and time.time() - self._last_flush >= self.flush_interval:
+                try:
+                    await self.flush()
+                except Exception as e:
+                    logger.error(f"Error saving auto-deletions: {str(e)}")
+            
+            # Sleep until the next tick is over
+            await asyncio.sleep(max((self._current_tick + 2) * self.tick - time.time(), 0))
+
+
+# Shared wheel instance
+auto_delete = AutoDeleteWheel(autodelete_db)
+
+metrics.gauge("bot_pending_auto_deletes", "Messages waiting to be auto-deleted", function=lambda: len(auto_delete))
+memory_tracker.track("autodelete.auto_delete", lambda: auto_delete)
+
+
+# Auto-delete a bot message if the chat wants it
+def schedule_cleanup(message: Optional[Message]) -> None:
+    """Schedule deletion of a bot message using the chat's auto-delete delay"""
+    if not message:
+        return
+    
+    delay = settings_db.get(f"{message.chat.id}_autodelete", 0)
+    if delay > 0:
+        auto_delete.schedule(message.chat.id, message.id, delay)
@@ -2,10 +2,32 @@ import os
 import re
 import time
 import asyncio
-from typing import List, Dict, Union, Optional
-from pyrogram.types import Message, User, ChatMember
+from typing import Any, Awaitable, Callable, Iterable, List, Dict, Tuple, Union, Optional
+from pyrogram import enums
+from pyrogram.types import Message, User, ChatMember, ChatPermissions, InlineKeyboardMarkup, InlineKeyboardButton
 from pyrogram.errors import FloodWait, UserNotParticipant
 
+# Permissions applied to muted users
+MUTED_PERMISSIONS = ChatPermissions(
+    can_send_messages=False,
+    can_send_media_messages=False,
+    can_send_other_messages=False,
+    can_add_web_page_previews=False
+)
+
+# Permissions restored when a user is unmuted
+UNMUTED_PERMISSIONS = ChatPermissions(
+    can_send_messages=True,
+    can_send_media_messages=True,
+    can_send_other_messages=True,
+    can_add_web_page_previews=True,
+    can_send_polls=True,
+    can_invite_users=True
+)
+
+# Shortest number taken as a user ID, shorter ones are durations or counts
+MIN_USER_ID_DIGITS = 5
+
 # Time formatter
 def get_readable_time(seconds: int) -> str:
     """Convert seconds to readable time format"""
@@ -31,6 +53,24 @@ def get_readable_time(seconds: int) -> str:
     
     return readable_time if count > 0 else "a few seconds"
 
+# Time parser
+def parse_time(text: str) -> Optional[int]:
+    """Convert a duration such as 30m, 2h or 1d to seconds"""
+    time_units = {
+        's': 1,
+        'm': 60,
+        'h': 3600,
+        'd': 86400,
+        'w': 604800
+    }
+    
+    match = re.fullmatch(r"(\d+)([smhdw])", text.lower())
+    if not match:
+        return None
+    
+    seconds = int(match.group(1)) * time_units[match.group(2)]
+    return seconds if seconds > 0 else None
+
 # Extract user from message
 async def extract_user(message: Message) -> Optional[User]:
     """Extract user from message (reply, mention, or ID)"""
@@ -45,9 +85,9 @@ async def extract_user(message: Message) -> Optional[User]:
     if message.text:
         # Split message text by spaces
         entities = message.text.split()
-        # Remove the command
-        if entities and entities[0].startswith('/'):
-            entities = entities[1:]
+        # Remove the command (its prefix may be customized)
+        if message.command:
+            entities = message.command[1:]
         
         if entities:
             # Check if the first entity is a user ID
@@ -57,7 +97,7 @@ async def extract_user(message: Message) -> Optional[User]:
             elif entities[0].startswith('@'):
                 username = entities[0][1:]
                 try:
-                    user = await message.chat.client.get_users(username)
+                    user = await message._client.get_users(username)
                     return user
                 except Exception:
                     return None
@@ -65,18 +105,71 @@ async def extract_user(message: Message) -> Optional[User]:
     # If user_id was found, get the user
     if user_id:
         try:
-            user = await message.chat.client.get_users(user_id)
+            user = await message._client.get_users(user_id)
         except Exception:
             return None
     
     return user
 
+# Check if an argument looks like a user ID
+def is_user_id(token: str) -> bool:
+    """Check if an argument is a number long enough to be a user ID"""
+    return token.isdigit() and len(token) >= MIN_USER_ID_DIGITS
+
+# Extract several users from message
+async def extract_users(message: Message) -> Tuple[List[User], List[str], List[str]]:
+    """Extract users from message (reply, mentions and IDs)
+
+    Returns the resolved users, the identifiers that could not be resolved
+    and the remaining command arguments (usually the reason).
+    """
+    users = []
+    missing = []
+    
+    # If message is a reply, the replied user is always a target
+    if message.reply_to_message and message.reply_to_message.from_user:
+        users.append(message.reply_to_message.from_user)
+    
+    # Leading arguments that look like user IDs or usernames are targets
+    args = message.command[1:] if message.command else []
+    identifiers = []
+    while args and (is_user_id(args[0]) or args[0].startswith('@')):
+        token = args.pop(0)
+        identifiers.append(int(token) if token.isdigit() else token[1:])
+    
+    if not identifiers:
+        return users, missing, args
+    
+    # Resolve all identifiers with a single request if possible
+    client = message._client
+    try:
+        users.extend(await client.get_users(identifiers))
+        return users, missing, args
+    except Exception:
+        pass
+    
+    # Fall back to resolving them one by one to find the bad ones
+    async def resolve(identifier):
+        try:
+            return await client.get_users(identifier)
+        except Exception:
+            return None
+    
+    resolved = await asyncio.gather(*[resolve(i) for i in identifiers])
+    for identifier, user in zip(identifiers, resolved):
+        if user:
+            users.append(user)
+        else:
+            missing.append(str(identifier))
+    
+    return users, missing, args
+
 # Check if user is admin
 async def is_admin(message: Message, user_id: int) -> bool:
     """Check if a user is an admin in the chat"""
     try:
         chat_member = await message.chat.get_member(user_id)
-        return chat_member.status in ["creator", "administrator"]
+        return chat_member.status in [enums.ChatMemberStatus.OWNER, enums.ChatMemberStatus.ADMINISTRATOR]
     except UserNotParticipant:
         return False
     except Exception:
@@ -85,25 +178,115 @@ async def is_admin(message: Message, user_id: int) -> bool:
 # Check if bot is admin
 async def is_bot_admin(message: Message) -> bool:
     """Check if the bot is an admin in the chat"""
-    bot_id = (await message.chat.client.get_me()).id
+    bot_id = (await message._client.get_me()).id
     return await is_admin(message, bot_id)
 
 # Get chat admins
 async def get_chat_admins(message: Message) -> List[int]:
     """Get a list of admin IDs in the chat"""
     admins = []
-    async for admin in message.chat.get_members(filter="administrators"):
+    async for admin in message.chat.get_members(filter=enums.ChatMembersFilter.ADMINISTRATORS):
         admins.append(admin.user.id)
     return admins
 
 # Safe message deletion
-async def safe_delete(message: Message, delay: int = 0) -> bool:
-    """Safely delete a message with optional delay"""
+async def safe_delete(message: Message, delay: int = 0) -> Optional[bool]:
+    """Safely delete a message with optional delay, returns whether it was deleted
+
+    Delayed deletions are handed to the auto-delete wheel and return None
+    immediately, as nothing was deleted yet.
+    """
     if delay > 0:
-        await asyncio.sleep(delay)
+        from .autodelete import auto_delete
+        auto_delete.schedule(message.chat.id, message.id, delay)
+        return None
     
     try:
         await message.delete()
         return True
     except Exception:
-        return False 
\ No newline at end of file
+        return False
+
+# When the last FloodWait seen by a bounded call ends, in time.monotonic() seconds
+_flood_wait_until = 0.0
+
+# Wait out a pending FloodWait
+async def _wait_flood() -> None:
+    """Sleep until the FloodWait seen last by any bounded call has passed"""
+    while True:
+        delay = _flood_wait_until - time.monotonic()
+        if delay <= 0:
+            return
+        await asyncio.sleep(delay)
+
+# Bounded concurrent execution
+async def gather_bounded(
+    func: Callable[[Any], Awaitable[Any]],
+    items: Iterable[Any],
+    limit: int = 10,
+    max_flood_wait: int = 60
+) -> List[Any]:
+    """Run func for every item with at most `limit` calls in flight
+
+    A FloodWait shorter than `max_flood_wait` pauses every bounded call,
+    here and in other calls of this function, until it has passed. The
+    failed call is then retried once. Waiting doesn't hold a slot, and
+    exceptions are returned in place of results.
+    """
+    semaphore = asyncio.Semaphore(limit)
+    
+    async def run(item):
+        global _flood_wait_until
+        retried = False
+        while True:
+            await _wait_flood()
+            async with semaphore:
+                # A FloodWait may have come in while this call waited for a slot
+                if _flood_wait_until > time.monotonic():
+                    continue
+                try:
+                    return await func(item)
+                except FloodWait as e:
+                    if retried or e.value > max_flood_wait:
+                        return e
+                    retried = True
+                    _flood_wait_until = max(_flood_wait_until, time.monotonic() + e.value)
+                except Exception as e:
+                    return e
+    
+    return await asyncio.gather(*[run(item) for item in items])
+
+# Pagination keyboard
+def build_page_keyboard(prefix: str, page: int, pages: int) -> Optional[InlineKeyboardMarkup]:
+    """Build previous/next buttons with `{prefix}_{page}` callback data"""
+    if pages <= 1:
+        return None
+    
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("⬅️ Previous", callback_data=f"{prefix}_{page - 1}"))
+    buttons.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"{prefix}_{page}"))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"{prefix}_{page + 1}"))
+    
+    return InlineKeyboardMarkup([buttons])
+
+# Split a long text into messages
+def split_text(text: str, limit: int = 4096) -> List[str]:
+    """Split a text into parts of at most `limit` characters
+    
+    Parts end at the last line break or space within the limit, so words,
+    mentions and links aren't cut unless a single one is longer than that.
+    """
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit + 1)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n ")
+    if text:
+        parts.append(text)
+    return parts
@@ -0,0 +1,102 @@
+"""
+Pre-dispatch pipeline for group messages
+"""
+
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from pyrogram import Client
+from pyrogram.types import Message
+from bot.database import settings_db
+from bot.metrics import handler_name, observe_handler
+from bot.plugins.loader import LOADED_MODULES
+from .helpers import is_admin
+from .router import command_router
+from .updates import update_scheduler, PRIORITY_HIGH, PRIORITY_LOW
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateContext:
+    """Per-message state shared by all pipeline hooks
+    
+    Values that several hooks need are computed once per message: the chat
+    key, the text, the chat's settings and the sender's admin status. The
+    latter two are fetched on first use and then cached for the other hooks.
+    """
+    
+    def __init__(self, client: Client, message: Message, modules: List[str]):
+        self.client = client
+        self.message = message
+        self.chat_id = str(message.chat.id)
+        self.user = message.from_user
+        self.user_id = message.from_user.id if message.from_user else None
+        self.text = message.text or message.caption or ""
+        self.lower_text = self.text.lower()
+        self.is_command = command_router.is_command(self.text)
+        self.modules = modules
+        self.stopped = False
+        self._settings: Dict[str, Any] = {}
+        self._sender_is_admin: Optional[bool] = None
+    
+    def setting(self, name: str, default: Any = None) -> Any:
+        """Return a setting of the chat, `name` without the chat ID prefix"""
+        if name not in self._settings:
+            self._settings[name] = settings_db.get(f"{self.chat_id}_{name}", default)
+        return self._settings[name]
+    
+    async def sender_is_admin(self) -> bool:
+        """Check if the sender is an admin of the chat"""
+        if self._sender_is_admin is None:
+            self._sender_is_admin = bool(self.user_id) and await is_admin(self.message, self.user_id)
+        return self._sender_is_admin
+
+
+# Hooks return True to stop the hooks after them
+Hook = Callable[[Client, UpdateContext], Awaitable[Optional[bool]]]
+
+
+class MessagePipeline:
+    """Run hooks of the loaded modules on group messages in a fixed order
+    
+    A single message handler builds the UpdateContext and passes it to each
+    hook by ascending order, instead of every module registering its own
+    handler that recomputes the same values.
+    
+    Essential hooks (moderation such as flood checks) run as a high priority
+    job of the update scheduler and the others (replies) as a low priority
+    job that is shed under load, so essential hooks run before the others.
+    """
+    
+    def __init__(self):
+        self._hooks: List[Tuple[int, bool, Hook, str]] = []
+    
+    def hook(self, order: int, essential: bool = False) -> Callable[[Hook], Hook]:
+        """Register a hook, lower orders run first"""
+        def decorator(func: Hook) -> Hook:
+            self._hooks.append((order, essential, func, handler_name(func)))
+            self._hooks.sort(key=lambda item: (not item[1], item[0]))
+            return func
+        return decorator
+    
+    async def dispatch(self, client: Client, message: Message) -> None:
+        """Message handler that queues the hooks for the message's chat"""
+        ctx = UpdateContext(client, message, LOADED_MODULES)
+        await update_scheduler.submit(message.chat.id, lambda: self.run(ctx, True), PRIORITY_HIGH)
+        await update_scheduler.submit(message.chat.id, lambda: self.run(ctx, False), PRIORITY_LOW)
+    
+    async def run(self, ctx: UpdateContext, essential: bool) -> None:
+        """Run the essential or the other hooks on a message"""
+        for _, hook_essential, hook, metric_name in self._hooks:
+            if ctx.stopped:
+                break
+            if hook_essential != essential:
+                continue
+            try:
+                if await observe_handler(metric_name, hook(ctx.client, ctx), ctx.message):
+                    ctx.stopped = True
+            except Exception as e:
+                logger.error(f"Error in message hook {hook.__module__}.{hook.__name__}: {str(e)}")
+
+
+# Shared pipeline instance
+message_pipeline = MessagePipeline()
\ No newline at end of file
@@ -0,0 +1,99 @@
+"""
+Command router dispatching commands through a lookup table
+"""
+
+import os
+import re
+from typing import Awaitable, Callable, Dict, List, Tuple
+from pyrogram import Client, enums, filters
+from pyrogram.types import Message
+from bot.metrics import handler_name, observe_handler
+
+# Command handlers have the same signature as message handlers
+CommandHandler = Callable[[Client, Message], Awaitable[None]]
+
+# Prefixes that start a command, e.g. COMMAND_PREFIXES="/!" for both / and !
+COMMAND_PREFIXES: List[str] = list(os.getenv("COMMAND_PREFIXES", "/")) or ["/"]
+
+# Command name with an optional @username suffix
+COMMAND_PATTERN = re.compile(r"([^\s@]+)(?:@(\S+))?(?:\s|$)")
+
+# Quoted or whitespace separated arguments, like Pyrogram's command filter
+ARGUMENT_PATTERN = re.compile(r"([\"'])(.*?)(?<!\\)\1|(\S+)")
+
+# Group chats, for commands that only work in groups
+GROUP_CHAT_TYPES = (enums.ChatType.GROUP, enums.ChatType.SUPERGROUP)
+
+
+class CommandRouter:
+    """Dispatch commands to their handlers with a single message handler
+    
+    Instead of every command having its own `filters.command` filter that
+    is evaluated for each message, the command token is parsed once and
+    looked up in a table. Messages that don't start with a command prefix
+    are rejected by the handler filter without being parsed at all.
+    """
+    
+    def __init__(self, prefixes: List[str]):
+        self.prefixes = tuple(prefixes)
+        self._commands: Dict[str, Tuple[CommandHandler, bool, str]] = {}
+        
+        # Async, as Pyrogram runs synchronous filters in a thread pool
+        async def is_command_message(_, __, message: Message) -> bool:
+            return self.is_command(message.text or message.caption)
+        self.filter = filters.create(is_command_message)
+    
+    def command(self, *names: str, group_only: bool = False) -> Callable[[CommandHandler], CommandHandler]:
+        """Register a handler for one or more commands"""
+        def decorator(func: CommandHandler) -> CommandHandler:
+            for name in names:
+                name = name.lower()
+                if name in self._commands:
+                    raise ValueError(f"Command /{name} is already registered")
+                self._commands[name] = (func, group_only, handler_name(func))
+            return func
+        return decorator
+    
+    def is_command(self, text: str) -> bool:
+        """Check if a text starts with a command prefix"""
+        return bool(text) and text.startswith(self.prefixes)
+    
+    def commands(self) -> List[str]:
+        """Names of all registered commands"""
+        return sorted(self._commands)
+    
+    async def dispatch(self, client: Client, message: Message) -> None:
+        """Message handler that runs the handler of a command"""
+        text = message.text or message.caption
+        prefix = next(prefix for prefix in self.prefixes if text.startswith(prefix))
+        
+        # Split off the command token
+        match = COMMAND_PATTERN.match(text[len(prefix):])
+        if not match:
+            return
+        name, username = match.groups()
+        arguments = text[len(prefix) + match.end():]
+        
+        # Commands addressed to another bot are not ours
+        if username and username.lower() != (client.me.username or "").lower():
+            return
+        
+        entry = self._commands.get(name.lower())
+        if not entry:
+            return
+        
+        func, group_only, metric_name = entry
+        if group_only and message.chat.type not in GROUP_CHAT_TYPES:
+            return
+        
+        # Set the parsed command like Pyrogram's command filter does
+        message.command = [name.lower()] + [
+            re.sub(r"\\([\"'])", r"\1", argument.group(2) or argument.group(3) or "")
+            for argument in ARGUMENT_PATTERN.finditer(arguments)
+        ]
+        await observe_handler(metric_name, func(client, message), message)
+
+
+# Shared router instance
+command_router = CommandRouter(COMMAND_PREFIXES)
+command = command_router.command
\ No newline at end of file
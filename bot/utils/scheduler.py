@@ -0,0 +1,279 @@
+"""
+Persistent scheduler for deferred moderation actions
+"""
+
+import time
+import heapq
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from pyrogram import Client, enums
+from pyrogram.types import Chat
+from bot.database import JSONDatabase, Journal, scheduler_db
+from bot.metrics import metrics
+from bot.memstats import memory_tracker
+from .helpers import gather_bounded, MUTED_PERMISSIONS, UNMUTED_PERMISSIONS
+
+logger = logging.getLogger(__name__)
+
+# (action, chat_id, user_id)
+ActionKey = Tuple[str, int, int]
+Executor = Callable[[Client, int, int], Awaitable[None]]
+
+# Delay between the ban and the unban of a kick
+KICK_UNBAN_DELAY = 1
+
+# Action kicking new members that didn't pass the captcha in time
+CAPTCHA_ACTION = "captcha_kick"
+
+
+class ActionScheduler:
+    """Run actions such as unbans at a later time
+
+    Pending actions live in a min-heap ordered by due time. To survive
+    crashes and restarts, every change is appended to a journal as it
+    happens, and a snapshot of all pending actions is written to the
+    database in a thread now and then. There is at most one pending action
+    per (action, chat_id, user_id); scheduling it again replaces the
+    previous due time.
+    """
+
+    def __init__(
+        self,
+        db: JSONDatabase,
+        flush_interval: float = 60,
+        batch_size: int = 500,
+        concurrency: int = 10
+    ):
+        self.db = db
+        self.journal = Journal(db)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self._heap: List[Tuple[float, str, int, int]] = []
+        self._pending: Dict[ActionKey, float] = {}
+        # Actions being executed, they are still pending for a snapshot
+        self._running: Dict[ActionKey, float] = {}
+        self._executors: Dict[str, Executor] = {}
+        self._client: Optional[Client] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dirty = False
+        self._last_flush = 0.0
+        self._load()
+
+    def register(self, action: str) -> Callable[[Executor], Executor]:
+        """Register the coroutine that performs an action"""
+        def decorator(func: Executor) -> Executor:
+            self._executors[action] = func
+            return func
+        return decorator
+
+    def schedule(self, action: str, chat_id: int, user_id: int, delay: float) -> None:
+        """Schedule an action to run after `delay` seconds"""
+        run_at = time.time() + delay
+        self._pending[(action, chat_id, user_id)] = run_at
+        heapq.heappush(self._heap, (run_at, action, chat_id, user_id))
+        self.journal.append(["schedule", action, chat_id, user_id, run_at])
+        self._dirty = True
+
+        # Wake the loop up if this is now the earliest action
+        if self._wakeup and self._heap[0][0] == run_at:
+            self._wakeup.set()
+
+    def cancel(self, action: str, chat_id: int, user_id: int) -> bool:
+        """Cancel a pending action, returns whether one was pending"""
+        if self._pending.pop((action, chat_id, user_id), None) is None:
+            return False
+        self.journal.append(["cancel", action, chat_id, user_id])
+        self._dirty = True
+        return True
+
+    def is_scheduled(self, action: str, chat_id: int, user_id: int) -> bool:
+        """Check if an action is pending"""
+        return (action, chat_id, user_id) in self._pending
+
+    def get_run_at(self, action: str, chat_id: int, user_id: int) -> Optional[float]:
+        """Return when a pending action runs, None if it isn't pending"""
+        return self._pending.get((action, chat_id, user_id))
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def start(self, client: Client) -> None:
+        """Start processing actions, including the ones that expired while offline"""
+        self._client = client
+        self._wakeup = asyncio.Event()
+        if not self._task:
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop processing actions and persist the pending ones"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Write a snapshot of the pending actions to the database, in a thread"""
+        snapshot = [
+            [action, chat_id, user_id, run_at]
+            for (action, chat_id, user_id), run_at in {**self._running, **self._pending}.items()
+        ]
+        self._dirty = False
+        self._last_flush = time.time()
+        await self.journal.compact("pending", snapshot)
+
+    def _load(self) -> None:
+        """Load pending actions from the database and the changes journaled since"""
+        for action, chat_id, user_id, run_at in self.db.get("pending", []):
+            self._pending[(action, chat_id, user_id)] = run_at
+        for op, *entry in self.journal.entries():
+            key = tuple(entry[:3])
+            if op == "schedule":
+                self._pending[key] = entry[3]
+            # Actions that ran only count if they weren't scheduled again meanwhile
+            elif op == "cancel" or self._pending.get(key) == entry[3]:
+                self._pending.pop(key, None)
+        self._heap = [
+            (run_at, action, chat_id, user_id)
+            for (action, chat_id, user_id), run_at in self._pending.items()
+        ]
+        heapq.heapify(self._heap)
+
+    def _pop_due(self, now: float) -> List[ActionKey]:
+        """Pop up to `batch_size` actions that are due"""
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+            run_at, action, chat_id, user_id = heapq.heappop(self._heap)
+            key = (action, chat_id, user_id)
+            # Skip entries that were cancelled or rescheduled
+            if self._pending.get(key) != run_at:
+                continue
+            self._running[key] = self._pending.pop(key)
+            due.append(key)
+
+        # Drop stale heap entries once they dominate the heap
+        if len(self._heap) > 2 * len(self._pending) + 1000:
+            self._heap = [
+                (run_at, action, chat_id, user_id)
+                for (action, chat_id, user_id), run_at in self._pending.items()
+            ]
+            heapq.heapify(self._heap)
+
+        return due
+
+    async def _execute(self, due: List[ActionKey]) -> None:
+        """Run a batch of due actions grouped by type"""
+        by_action: Dict[str, List[ActionKey]] = {}
+        for key in due:
+            by_action.setdefault(key[0], []).append(key)
+
+        for action, keys in by_action.items():
+            executor = self._executors.get(action)
+            if not executor:
+                logger.error(f"No executor registered for scheduled action {action}")
+                continue
+
+            results = await gather_bounded(
+                lambda key: executor(self._client, key[1], key[2]),
+                keys,
+                self.concurrency
+            )
+            for key, result in zip(keys, results):
+                if isinstance(result, Exception):
+                    logger.warning(f"Scheduled {action} failed in {key[1]} for {key[2]}: {str(result)}")
+
+    async def _run(self) -> None:
+        """Main scheduler loop"""
+        while True:
+            now = time.time()
+            due = self._pop_due(now)
+            if due:
+                try:
+                    await self._execute(due)
+                except Exception as e:
+                    logger.error(f"Error running scheduled actions: {str(e)}")
+                # Journaled once they ran, a crash before runs them again after the restart
+                self.journal.append(*(["done", *key, self._running.pop(key)] for key in due))
+                self._dirty = True
+                # More actions may already be due
+                if self._heap and self._heap[0][0] <= time.time():
+                    continue
+
+            if self._dirty and time.time() - self._last_flush >= self.flush_interval:
+                try:
+                    await self.flush()
+                except Exception as e:
+                    logger.error(f"Error saving scheduled actions: {str(e)}")
+
+            # Sleep until the next action is due or a new one is scheduled
+            timeout = self.flush_interval
+            if self._heap:
+                timeout = min(timeout, max(self._heap[0][0] - time.time(), 0))
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+# Shared scheduler instance
+action_scheduler = ActionScheduler(scheduler_db)
+
+metrics.gauge("bot_scheduled_actions", "Pending scheduled moderation actions", function=lambda: len(action_scheduler))
+memory_tracker.track("scheduler.action_scheduler", lambda: action_scheduler)
+
+
+@action_scheduler.register("unban")
+async def _unban(client: Client, chat_id: int, user_id: int) -> None:
+    """Lift a ban"""
+    await client.unban_chat_member(chat_id, user_id)
+
+
+@action_scheduler.register("unmute")
+async def _unmute(client: Client, chat_id: int, user_id: int) -> None:
+    """Lift a mute"""
+    await client.restrict_chat_member(chat_id, user_id, UNMUTED_PERMISSIONS)
+
+
+@action_scheduler.register(CAPTCHA_ACTION)
+async def _kick_unverified(client: Client, chat_id: int, user_id: int) -> None:
+    """Kick a member who didn't pass the captcha in time, unless they were banned or unmuted meanwhile"""
+    member = await client.get_chat_member(chat_id, user_id)
+    if member.status != enums.ChatMemberStatus.RESTRICTED or (member.permissions and member.permissions.can_send_messages):
+        return
+    await client.ban_chat_member(chat_id, user_id)
+    action_scheduler.schedule("unban", chat_id, user_id, KICK_UNBAN_DELAY)
+
+
+# Kick a member without blocking the handler
+async def kick_member(chat: Chat, user_id: int) -> None:
+    """Ban a user now and let the scheduler unban them shortly after
+
+    A later unban of a timed ban is kept, so kicking doesn't cut it short.
+    """
+    await chat.ban_member(user_id)
+    run_at = action_scheduler.get_run_at("unban", chat.id, user_id)
+    if run_at is None or run_at < time.time() + KICK_UNBAN_DELAY:
+        action_scheduler.schedule("unban", chat.id, user_id, KICK_UNBAN_DELAY)
+
+
+# Ban a member for good
+async def ban_member(chat: Chat, user_id: int) -> None:
+    """Ban a user, dropping the pending unban of an earlier timed ban and their captcha kick"""
+    await chat.ban_member(user_id)
+    action_scheduler.cancel("unban", chat.id, user_id)
+    action_scheduler.cancel(CAPTCHA_ACTION, chat.id, user_id)
+
+
+# Mute a member for good
+async def mute_member(chat: Chat, user_id: int) -> None:
+    """Mute a user, dropping the pending unmute of an earlier timed mute and their captcha kick"""
+    await chat.restrict_member(user_id, MUTED_PERMISSIONS)
+    action_scheduler.cancel("unmute", chat.id, user_id)
+    action_scheduler.cancel(CAPTCHA_ACTION, chat.id, user_id)
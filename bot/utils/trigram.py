@@ -0,0 +1,112 @@
+"""
+Trigram index for fuzzy name lookups
+"""
+
+import re
+from typing import Callable, Dict, FrozenSet, Iterable, List, Set, Tuple
+
+# Loads the (name, text) pairs of a chat when its index is first needed
+Loader = Callable[[str], Iterable[Tuple[str, str]]]
+
+
+# Split text into trigrams
+def trigrams(text: str) -> FrozenSet[str]:
+    """Return the trigrams of every word in the text, padded like pg_trgm"""
+    grams = set()
+    for word in re.split(r"[\W_]+", text.lower()):
+        if not word:
+            continue
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return frozenset(grams)
+
+
+class TrigramIndex:
+    """Per-chat inverted index from trigrams to names
+    
+    Chats are indexed lazily through `loader` and then kept up to date with
+    `add` and `remove`, so a lookup only touches the postings of the query's
+    trigrams instead of every name in the chat.
+    """
+    
+    def __init__(self, loader: Loader, max_text_length: int = 1000):
+        self.loader = loader
+        self.max_text_length = max_text_length
+        self._postings: Dict[str, Dict[str, Set[str]]] = {}
+        self._grams: Dict[str, Dict[str, FrozenSet[str]]] = {}
+    
+    def _chat(self, chat_id: str) -> Tuple[Dict[str, Set[str]], Dict[str, FrozenSet[str]]]:
+        """Return the postings and trigrams of a chat, indexing it on first use"""
+        if chat_id not in self._grams:
+            self._postings[chat_id] = {}
+            self._grams[chat_id] = {}
+            for name, text in self.loader(chat_id):
+                self.add(chat_id, name, text)
+        return self._postings[chat_id], self._grams[chat_id]
+    
+    def add(self, chat_id: str, name: str, text: str) -> None:
+        """Index (or re-index) a name"""
+        if chat_id not in self._grams:
+            # Indexed from the loader on first lookup
+            return
+        self.remove(chat_id, name)
+        postings, grams = self._postings[chat_id], self._grams[chat_id]
+        name_grams = trigrams(text[:self.max_text_length])
+        grams[name] = name_grams
+        for gram in name_grams:
+            postings.setdefault(gram, set()).add(name)
+    
+    def remove(self, chat_id: str, name: str) -> None:
+        """Drop a name from the index"""
+        if chat_id not in self._grams:
+            return
+        postings, grams = self._postings[chat_id], self._grams[chat_id]
+        for gram in grams.pop(name, ()):
+            names = postings.get(gram)
+            if names:
+                names.discard(name)
+                if not names:
+                    del postings[gram]
+    
+    def clear(self, chat_id: str) -> None:
+        """Drop a chat from the index"""
+        self._postings.pop(chat_id, None)
+        self._grams.pop(chat_id, None)
+    
+    def search(
+        self,
+        chat_id: str,
+        query: str,
+        limit: int = 5,
+        min_score: float = 0.3,
+        containment: bool = False
+    ) -> List[Tuple[str, float]]:
+        """Return the best matching names with their scores
+        
+        The score is the Jaccard similarity of the trigram sets, or with
+        `containment` the share of the query's trigrams found in the text.
+        """
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+        
+        postings, grams = self._chat(chat_id)
+        
+        # Count shared trigrams per candidate
+        shared: Dict[str, int] = {}
+        for gram in query_grams:
+            for name in postings.get(gram, ()):
+                shared[name] = shared.get(name, 0) + 1
+        
+        results = []
+        for name, count in shared.items():
+            if containment:
+                score = count / len(query_grams)
+            else:
+                score = count / (len(query_grams) + len(grams[name]) - count)
+            if score >= min_score:
+                results.append((name, score))
+        
+        results.sort(key=lambda result: (-result[1], result[0]))
+        return results[:limit]
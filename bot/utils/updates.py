@@ -0,0 +1,197 @@
+"""
+Per-chat update queues served by a bounded worker pool
+"""
+
+import os
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+from pyrogram import Client, StopPropagation, ContinuePropagation
+from pyrogram.handlers.handler import Handler
+from bot.metrics import metrics
+from bot.memstats import memory_tracker
+
+logger = logging.getLogger(__name__)
+
+# Work that has to be done (moderation, flood checks) and work that may be dropped (replies)
+PRIORITY_HIGH = 0
+PRIORITY_LOW = 1
+
+Job = Callable[[], Awaitable[Any]]
+
+
+# Get the queue key of an update
+def get_update_key(update: Any) -> int:
+    """Return the chat an update belongs to, or its sender if it has no chat"""
+    chat = getattr(update, "chat", None)
+    if chat is None and getattr(update, "message", None) is not None:
+        chat = update.message.chat
+    if chat is not None:
+        return chat.id
+    user = getattr(update, "from_user", None)
+    return user.id if user else 0
+
+
+class UpdateScheduler:
+    """Run update handlers per chat in order, round-robin across chats
+    
+    Every chat has its own FIFO queue and at most one of its jobs runs at a
+    time, so a chat's updates are handled in arrival order. Chats with work
+    wait in a ready queue and `workers` tasks take turns serving them one
+    job at a time, so a busy chat can't starve the others.
+    
+    When a chat's queue or the total reaches its limit, low priority jobs
+    are shed, queued ones first. High priority jobs are still queued beyond
+    a chat's limit, up to `hard_chat_queue`, so a flooded chat never holds
+    up the dispatching of other chats' updates. Only the total limit makes
+    them wait. Past the hard limit, the chat's jobs are dropped.
+    """
+    
+    def __init__(self, workers: int = 8, max_chat_queue: int = 100, max_total: int = 5000, hard_chat_queue: int = 0):
+        self.workers = workers
+        self.max_chat_queue = max_chat_queue
+        self.max_total = max_total
+        self.hard_chat_queue = hard_chat_queue or 4 * max_chat_queue
+        self.shed_count = 0
+        self._queues: Dict[int, Deque[Tuple[int, Job]]] = {}
+        self._scheduled: Set[int] = set()
+        self._ready: Optional[asyncio.Queue] = None
+        self._space: Optional[asyncio.Condition] = None
+        self._tasks: List[asyncio.Task] = []
+        self._size = 0
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    async def submit(self, key: int, job: Job, priority: int = PRIORITY_HIGH) -> bool:
+        """Queue a job for a chat, returns False if it was shed"""
+        if not self._tasks:
+            # Not started, run inline
+            await job()
+            return True
+        
+        if not self._has_room(key):
+            # Make room by dropping the chat's oldest low priority job
+            if self._shed(self._queues.get(key, ())):
+                await self._notify()
+            if priority == PRIORITY_LOW and not self._has_room(key):
+                self.shed_count += 1
+                return False
+        
+        # A chat too far behind loses even high priority jobs
+        if len(self._queues.get(key, ())) >= self.hard_chat_queue:
+            self.shed_count += 1
+            logger.warning(f"Dropped an update of {key}, its queue is full")
+            return False
+        
+        # High priority jobs wait for room in the total instead of being dropped
+        if self._size >= self.max_total:
+            async with self._space:
+                await self._space.wait_for(lambda: self._size < self.max_total)
+        
+        self._queues.setdefault(key, deque()).append((priority, job))
+        self._size += 1
+        if key not in self._scheduled:
+            self._scheduled.add(key)
+            self._ready.put_nowait(key)
+        return True
+    
+    def wrap(self, callback: Callable, priority: int = PRIORITY_HIGH) -> Callable:
+        """Turn a handler callback into one that queues it for the update's chat"""
+        async def scheduled_callback(client: Client, update: Any, *args):
+            await self.submit(get_update_key(update), lambda: callback(client, update, *args), priority)
+        scheduled_callback.__wrapped__ = callback
+        return scheduled_callback
+    
+    def install(self, handlers: List[Tuple[Handler, int]], exclude: List[Callable] = ()) -> None:
+        """Queue the callbacks of the given handlers, before they are added to a client
+        
+        Handlers in negative groups keep running inline, as they may stop
+        the propagation of an update before the other groups see it.
+        """
+        for handler, group in handlers:
+            if group < 0 or handler.callback in exclude or hasattr(handler.callback, "__wrapped__"):
+                continue
+            handler.callback = self.wrap(handler.callback)
+    
+    async def start(self) -> None:
+        """Start the workers"""
+        self._ready = asyncio.Queue()
+        self._space = asyncio.Condition()
+        if not self._tasks:
+            self._tasks = [asyncio.get_event_loop().create_task(self._work()) for _ in range(self.workers)]
+    
+    async def join(self) -> None:
+        """Wait until every queued job is done"""
+        async with self._space:
+            await self._space.wait_for(lambda: not self._scheduled)
+    
+    async def stop(self) -> None:
+        """Stop the workers, dropping queued jobs"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queues.clear()
+        self._scheduled.clear()
+        self._size = 0
+    
+    def _has_room(self, key: int) -> bool:
+        """Check if a job of a chat fits in both the chat's and the total limit"""
+        return len(self._queues.get(key, ())) < self.max_chat_queue and self._size < self.max_total
+    
+    async def _notify(self) -> None:
+        """Wake up the jobs waiting for room and join"""
+        async with self._space:
+            self._space.notify_all()
+    
+    def _shed(self, queue: Deque[Tuple[int, Job]]) -> bool:
+        """Drop the oldest low priority job of a queue, returns whether there was one"""
+        for i, (priority, _) in enumerate(queue):
+            if priority == PRIORITY_LOW:
+                del queue[i]
+                self._size -= 1
+                self.shed_count += 1
+                return True
+        return False
+    
+    async def _work(self) -> None:
+        """Worker loop, serves one job of the next ready chat at a time"""
+        while True:
+            key = await self._ready.get()
+            queue = self._queues[key]
+            
+            # The queue may have been emptied by shedding while it waited
+            if queue:
+                _, job = queue.popleft()
+                self._size -= 1
+                
+                try:
+                    await job()
+                except (StopPropagation, ContinuePropagation):
+                    # Other groups were already dispatched, nothing left to stop
+                    pass
+                except Exception as e:
+                    logger.exception(f"Error handling update of {key}: {str(e)}")
+            
+            # Back of the line if the chat has more work
+            if queue:
+                self._ready.put_nowait(key)
+            else:
+                del self._queues[key]
+                self._scheduled.discard(key)
+            
+            await self._notify()
+
+
+# Shared scheduler instance
+update_scheduler = UpdateScheduler(
+    workers=int(os.getenv("UPDATE_WORKERS", 8)),
+    max_chat_queue=int(os.getenv("MAX_CHAT_QUEUE", 100)),
+    max_total=int(os.getenv("MAX_QUEUED_UPDATES", 5000))
+)
+
+metrics.gauge("bot_update_queue_size", "Handler jobs waiting in the update scheduler", function=lambda: len(update_scheduler))
+metrics.counter("bot_update_jobs_shed_total", "Low priority handler jobs dropped under load", function=lambda: update_scheduler.shed_count)
+memory_tracker.track("updates.update_scheduler", lambda: update_scheduler)
\ No newline at end of file
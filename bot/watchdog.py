@@ -0,0 +1,124 @@
+"""
+Event loop watchdog catching code that blocks the loop
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from types import FrameType
+from typing import Optional
+from bot.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Loop lag that counts as a stall, in seconds
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", 0.5))
+
+# Files of the bot, to point stalls at our code rather than the library it called
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOOP_LAG = metrics.histogram(
+    "bot_loop_lag_seconds",
+    "How late the event loop ran the watchdog heartbeat",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+LOOP_STALLS = metrics.counter("bot_loop_stalls_total", "Times the event loop was blocked, by blocking code", ["site"])
+
+
+# Find the code responsible for a stack
+def get_blocking_site(frame: FrameType) -> str:
+    """Return `file:function` of the innermost frame of the bot in a stack"""
+    innermost = frame
+    while frame:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename.startswith(PROJECT_ROOT) and "site-packages" not in filename:
+            return f"{os.path.relpath(filename, PROJECT_ROOT)}:{frame.f_code.co_name}"
+        frame = frame.f_back
+    return f"{os.path.basename(innermost.f_code.co_filename)}:{innermost.f_code.co_name}"
+
+
+class LoopWatchdog:
+    """Measure event loop lag and catch whatever blocks the loop
+    
+    A heartbeat task sleeps for `interval` and records how late it woke
+    up. A separate thread checks the last heartbeat; if the loop stops
+    beating for longer than `threshold` it captures the stack of the loop
+    thread while it is still blocked, so the log shows the blocking call
+    (e.g. a database save) instead of just the lag after the fact.
+    """
+    
+    def __init__(self, interval: float = 0.1, threshold: float = LOOP_LAG_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.max_lag = 0.0
+        self._beat = 0.0
+        self._reported_beat = 0.0
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+    
+    async def start(self) -> None:
+        """Start the heartbeat and the watching thread"""
+        if self._task:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.get_event_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+    
+    async def stop(self) -> None:
+        """Stop watching the loop"""
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+    
+    async def _heartbeat(self) -> None:
+        """Record how late the loop wakes the heartbeat up"""
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._beat = time.monotonic()
+            lag = max(self._beat - start - self.interval, 0)
+            LOOP_LAG.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold:
+                logger.warning(f"Event loop was blocked for {lag:.2f}s")
+    
+    def _watch(self) -> None:
+        """Thread that captures the loop's stack when the heartbeat stops"""
+        while not self._stopped.wait(self.interval):
+            beat = self._beat
+            stalled = time.monotonic() - beat - self.interval
+            # Report every stall once, while it is still going on
+            if stalled < self.threshold or beat == self._reported_beat:
+                continue
+            self._reported_beat = beat
+            
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            site = get_blocking_site(frame)
+            LOOP_STALLS.labels(site).inc()
+            logger.warning(
+                f"Event loop blocked for {stalled:.2f}s so far in {site}:\n"
+                + "".join(traceback.format_stack(frame))
+            )
+
+
+# Shared watchdog instance
+loop_watchdog = LoopWatchdog()
@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+"""
+Replay recorded or synthetic updates through the bot's handlers offline
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import itertools
+from datetime import datetime
+from collections import Counter, OrderedDict
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List
+import pyrogram
+from pyrogram import enums, types
+from pyrogram.errors import FloodWait
+from pyrogram.handlers import CallbackQueryHandler, InlineQueryHandler, MessageHandler
+
+# The fake bot and the admin of every replayed chat
+BOT_ID = 1000
+ADMIN_ID = 1
+
+# Outbound methods that are only recorded, they return True like most of them do
+RECORDED_METHODS = {
+    "ban_chat_member", "unban_chat_member", "restrict_chat_member", "promote_chat_member",
+    "delete_messages", "pin_chat_message", "unpin_chat_message", "unpin_all_chat_messages",
+    "answer_callback_query", "answer_inline_query", "set_administrator_title"
+}
+
+# Handler types receiving each type of update
+HANDLER_TYPES = {
+    types.Message: MessageHandler,
+    types.CallbackQuery: CallbackQueryHandler,
+    types.InlineQuery: InlineQueryHandler
+}
+
+# Texts of the synthetic stream, "hello" and "spam" trigger the filters set up in every chat
+TEXTS = [
+    "hello everyone", "lol", "anyone here?", "good morning", "check this out",
+    "#rules", "#faq", "that's spam", "thanks!", "what did I miss?"
+]
+COMMANDS = ["/notes", "/get rules", "/filters", "/search fa", "/flood", "/help", "/start", "/ping"]
+ADMIN_COMMANDS = ["/warn {user} spam", "/mute {user}", "/unmute {user}", "/save note{n} Note number {n}"]
+
+# Commands the admin sends in every chat before the replay
+SETUP_COMMANDS = [
+    "/setflood 5",
+    "/save rules Be nice to each other, no spam please.",
+    "/save faq Read the pinned message before asking anything.",
+    "/filter hello Hi there! Welcome to the chat.",
+    "/filter spam Please don't spam.",
+    "/captcha on",
+    "/connect"
+]
+
+
+# Build a user
+def make_user(client: "FakeClient", user_id: int) -> types.User:
+    """Return a user with a name derived from its ID"""
+    return types.User(
+        client=client,
+        id=user_id,
+        is_bot=user_id == BOT_ID,
+        first_name=f"User{user_id}",
+        username=f"user{user_id}"
+    )
+
+
+# Build a chat
+def make_chat(client: "FakeClient", chat_id: int) -> types.Chat:
+    """Return a supergroup, or a private chat for positive IDs"""
+    if chat_id > 0:
+        return types.Chat(client=client, id=chat_id, type=enums.ChatType.PRIVATE, first_name=f"User{chat_id}")
+    return types.Chat(client=client, id=chat_id, type=enums.ChatType.SUPERGROUP, title=f"Chat {-chat_id}")
+
+
+class FakeClient:
+    """Stands in for a Client: outbound calls are recorded instead of sent
+    
+    Every call takes a random latency around `latency` seconds. With
+    probability `flood_rate` it first gets a FloodWait of `flood_wait`
+    seconds, which is slept through when it is below `sleep_threshold` and
+    raised otherwise, like Pyrogram does.
+    """
+    
+    def __init__(self, latency: float = 0.05, flood_rate: float = 0.0, flood_wait: int = 2, sleep_threshold: int = 10):
+        self.name = "replay"
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.flood_wait = flood_wait
+        self.sleep_threshold = sleep_threshold
+        self.parse_mode = enums.ParseMode.DEFAULT
+        self.admins = {ADMIN_ID, BOT_ID}
+        self.me = make_user(self, BOT_ID)
+        self.me.is_self = True
+        self.me.username = "replay_bot"
+        self.dispatcher = SimpleNamespace(groups=OrderedDict())
+        self.loop = None
+        self.executor = None
+        self.calls: Counter = Counter()
+        self.flood_waits: Counter = Counter()
+        self._message_ids = itertools.count(1_000_000)
+    
+    def add_handler(self, handler: Any, group: int = 0) -> None:
+        """Add a handler to a group, keeping the groups sorted like the dispatcher does"""
+        groups = self.dispatcher.groups
+        if group not in groups:
+            groups[group] = []
+            self.dispatcher.groups = OrderedDict(sorted(groups.items()))
+        self.dispatcher.groups[group].append(handler)
+    
+    def reset(self) -> None:
+        """Forget the recorded calls"""
+        self.calls.clear()
+        self.flood_waits.clear()
+    
+    async def _call(self, method: str) -> None:
+        """Record an outbound call and simulate its latency and FloodWaits"""
+        self.calls[method] += 1
+        if self.flood_rate and random.random() < self.flood_rate:
+            self.flood_waits[method] += 1
+            if self.flood_wait > self.sleep_threshold:
+                raise FloodWait(value=self.flood_wait)
+            await asyncio.sleep(self.flood_wait)
+        if self.latency:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+    
+    def _message(self, chat_id: int, text: str = None) -> types.Message:
+        """Return a message sent by the bot"""
+        return types.Message(
+            client=self,
+            id=next(self._message_ids),
+            chat=make_chat(self, chat_id),
+            from_user=self.me,
+            date=datetime.now(),
+            text=text
+        )
+    
+    def __getattr__(self, name: str):
+        if name not in RECORDED_METHODS:
+            raise AttributeError(f"FakeClient has no method {name}")
+        
+        async def call(*args, **kwargs):
+            await self._call(name)
+            return True
+        return call
+    
+    async def get_me(self) -> types.User:
+        await self._call("get_me")
+        return self.me
+    
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> types.Message:
+        await self._call("send_message")
+        return self._message(chat_id, text)
+    
+    async def send_document(self, chat_id: int, document: Any, **kwargs) -> types.Message:
+        await self._call("send_document")
+        return self._message(chat_id)
+    
+    async def edit_message_text(self, chat_id: int, message_id: int, text: str, **kwargs) -> types.Message:
+        await self._call("edit_message_text")
+        return self._message(chat_id, text)
+    
+    async def get_chat_member(self, chat_id: int, user_id: int) -> types.ChatMember:
+        await self._call("get_chat_member")
+        status = enums.ChatMemberStatus.ADMINISTRATOR if user_id in self.admins else enums.ChatMemberStatus.MEMBER
+        return types.ChatMember(client=self, status=status, user=make_user(self, user_id))
+    
+    async def get_chat_members(self, chat_id: int, *args, **kwargs):
+        await self._call("get_chat_members")
+        for user_id in sorted(self.admins):
+            yield types.ChatMember(client=self, status=enums.ChatMemberStatus.ADMINISTRATOR, user=make_user(self, user_id))
+    
+    async def get_users(self, user_ids: Any) -> Any:
+        await self._call("get_users")
+        
+        def resolve(user_id):
+            if isinstance(user_id, str) and not user_id.lstrip("-").isdigit():
+                return make_user(self, 10 ** 9 + zlib.crc32(user_id.lstrip("@").encode()))
+            return make_user(self, int(user_id))
+        
+        if isinstance(user_ids, (list, tuple, set)):
+            return [resolve(user_id) for user_id in user_ids]
+        return resolve(user_ids)
+
+
+# Turn a record into an update
+def build_update(client: FakeClient, record: Dict[str, Any], message_ids: Counter) -> Any:
+    """Build the Pyrogram update a record describes
+    
+    Records are dicts with a "type" of "message" (chat_id, user_id, text),
+    "join" (chat_id, user_ids), "callback" (chat_id, user_id, data) or
+    "inline" (user_id, query).
+    """
+    kind = record["type"]
+    user = make_user(client, record.get("user_id") or record.get("user_ids", [ADMIN_ID])[0])
+    
+    if kind == "inline":
+        return types.InlineQuery(
+            client=client,
+            id=str(next(client._message_ids)),
+            from_user=user,
+            query=record["query"],
+            offset="",
+            chat_type=enums.ChatType.PRIVATE
+        )
+    
+    chat = make_chat(client, record["chat_id"])
+    message_ids[chat.id] += 1
+    message = types.Message(client=client, id=message_ids[chat.id], chat=chat, from_user=user, date=datetime.now())
+    
+    if kind == "message":
+        message.text = record["text"]
+    elif kind == "join":
+        message.new_chat_members = [make_user(client, user_id) for user_id in record["user_ids"]]
+        message.service = enums.MessageServiceType.NEW_CHAT_MEMBERS
+    elif kind == "callback":
+        message.from_user = client.me
+        return types.CallbackQuery(
+            client=client,
+            id=str(message.id),
+            from_user=user,
+            chat_instance=str(chat.id),
+            message=message,
+            data=record["data"]
+        )
+    else:
+        raise ValueError(f"Unknown update type: {kind}")
+    return message
+
+
+# Generate a synthetic update stream
+def generate_records(count: int, chats: int, users: int, seed: int) -> Iterator[Dict[str, Any]]:
+    """Yield a mix of text, commands, joins, flood bursts, callbacks and inline queries"""
+    rng = random.Random(seed)
+    chat_ids = [-1001000000000 - i for i in range(chats)]
+    user_ids = [10000 + i for i in range(users)]
+    next_user = itertools.count(10000 + users)
+    produced = 0
+    
+    while produced < count:
+        chat_id = rng.choice(chat_ids)
+        user_id = rng.choice(user_ids)
+        roll = rng.random()
+        
+        if roll < 0.55:
+            records = [{"type": "message", "chat_id": chat_id, "user_id": user_id, "text": rng.choice(TEXTS)}]
+        elif roll < 0.62:
+            # Flood burst
+            records = [
+                {"type": "message", "chat_id": chat_id, "user_id": user_id, "text": rng.choice(TEXTS)}
+                for _ in range(rng.randint(6, 10))
+            ]
+        elif roll < 0.75:
+            records = [{"type": "message", "chat_id": chat_id, "user_id": user_id, "text": rng.choice(COMMANDS)}]
+        elif roll < 0.80:
+            text = rng.choice(ADMIN_COMMANDS).format(user=user_id, n=rng.randint(1, 50))
+            records = [{"type": "message", "chat_id": chat_id, "user_id": ADMIN_ID, "text": text}]
+        elif roll < 0.88:
+            # Join, followed by the captcha button of one of the new members
+            new_users = [next(next_user) for _ in range(rng.randint(1, 3))]
+            records = [{"type": "join", "chat_id": chat_id, "user_ids": new_users}]
+            if rng.random() < 0.7:
+                records.append({"type": "callback", "chat_id": chat_id, "user_id": new_users[0], "data": f"captcha_{chat_id}"})
+        elif roll < 0.96:
+            data = rng.choice(["help_main", "notespage_0", "filterspage_0", f"rules_{chat_id}"])
+            records = [{"type": "callback", "chat_id": chat_id, "user_id": user_id, "data": data}]
+        else:
+            records = [{"type": "inline", "user_id": ADMIN_ID, "query": rng.choice(["", "r", "fa", "note"])}]
+        
+        for record in records[:count - produced]:
+            produced += 1
+            yield record
+
+
+# Read a recorded update stream
+def read_records(path: str) -> List[Dict[str, Any]]:
+    """Read records from a JSON lines file"""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# Run an update through the handlers
+async def dispatch(client: FakeClient, update: Any) -> None:
+    """Run an update through the handler groups like Pyrogram's dispatcher
+    
+    In every group the first handler whose filters match runs, and
+    StopPropagation ends the update.
+    """
+    handler_type = HANDLER_TYPES[type(update)]
+    try:
+        for group in client.dispatcher.groups.values():
+            for handler in group:
+                if not isinstance(handler, handler_type):
+                    continue
+                try:
+                    if not await handler.check(client, update):
+                        continue
+                except Exception as e:
+                    print(f"Filter error in {handler.callback}: {e}", file=sys.stderr)
+                    continue
+                
+                try:
+                    await handler.callback(client, update)
+                except pyrogram.StopPropagation:
+                    raise
+                except pyrogram.ContinuePropagation:
+                    continue
+                except Exception as e:
+                    print(f"Handler error in {handler.callback}: {e}", file=sys.stderr)
+                break
+    except pyrogram.StopPropagation:
+        pass
+
+
+# Format the replay report
+def format_report(report: Dict[str, Any]) -> str:
+    """Return the report as readable tables"""
+    lines = [
+        f"Updates: {report['updates']} in {report['seconds']:.2f}s ({report['updates_per_second']:.0f}/s)",
+        f"Shed jobs: {report['shed_jobs']}, FloodWaits: {sum(report['flood_waits'].values())}",
+        "",
+        f"{'calls':>7} {'errors':>6} {'mean ms':>8} {'p95 ms':>8}  handler"
+    ]
+    for name, handler in report["handlers"].items():
+        lines.append(
+            f"{handler['calls']:>7} {handler['errors']:>6} {handler['mean'] * 1000:8.2f} "
+            f"{handler['p95'] * 1000:8.1f}  {name}"
+        )
+    
+    lines += ["", f"{'calls':>7} {'floods':>6}  outbound method"]
+    for method, calls in report["outbound"].items():
+        lines.append(f"{calls:>7} {report['flood_waits'].get(method, 0):>6}  {method}")
+    return "\n".join(lines)
+
+
+# Replay updates through the bot
+async def replay(args: argparse.Namespace, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Set up the handlers with a fake client, replay the records and return the report"""
+    from bot.plugins.loader import load_modules, get_core_handlers, get_module_handlers
+    load_modules()
+    
+    from bot.utils import action_scheduler, auto_delete, message_pipeline, command_router, update_scheduler
+    from bot.metrics import HANDLER_SECONDS, HANDLER_ERRORS, instrument_databases, instrument_handlers
+    
+    client = FakeClient(args.latency, args.flood_rate, args.flood_wait, args.sleep_threshold)
+    client.loop = asyncio.get_event_loop()
+    
+    # The same wiring as main.py
+    instrument_databases()
+    handlers = get_core_handlers() + get_module_handlers()
+    instrument_handlers(client, handlers, exclude=[command_router.dispatch, message_pipeline.dispatch])
+    update_scheduler.install(handlers, exclude=[message_pipeline.dispatch])
+    for handler, group in handlers:
+        client.add_handler(handler, group)
+    
+    await update_scheduler.start()
+    await action_scheduler.start(client)
+    await auto_delete.start(client)
+    
+    message_ids: Counter = Counter()
+    try:
+        # Configure every chat through the real commands
+        chat_ids = sorted({record["chat_id"] for record in records if "chat_id" in record and record["chat_id"] < 0})
+        for chat_id in chat_ids:
+            for text in SETUP_COMMANDS:
+                await dispatch(client, build_update(client, {"type": "message", "chat_id": chat_id, "user_id": ADMIN_ID, "text": text}, message_ids))
+        await update_scheduler.join()
+        
+        HANDLER_SECONDS.clear()
+        HANDLER_ERRORS.clear()
+        client.reset()
+        shed_count = update_scheduler.shed_count
+        
+        updates = [build_update(client, record, message_ids) for record in records]
+        start = time.perf_counter()
+        for i, update in enumerate(updates):
+            # Pace the stream when a rate is given, otherwise replay as fast as possible
+            if args.rate:
+                delay = start + i / args.rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await dispatch(client, update)
+        await update_scheduler.join()
+        seconds = time.perf_counter() - start
+        
+        # Let delayed work such as batched welcomes happen, it isn't part of the throughput
+        if args.settle:
+            await asyncio.sleep(args.settle)
+    finally:
+        await auto_delete.stop()
+        await action_scheduler.stop()
+        await update_scheduler.stop()
+    
+    errors = {labels[0]: int(child.value) for labels, child in HANDLER_ERRORS.children().items()}
+    handlers = {}
+    for (name,), child in sorted(HANDLER_SECONDS.children().items(), key=lambda item: -item[1].sum):
+        calls = sum(child.counts)
+        handlers[name] = {
+            "calls": calls,
+            "errors": errors.get(name, 0),
+            "mean": child.sum / calls if calls else 0.0,
+            "p95": child.quantile(0.95)
+        }
+    
+    return {
+        "updates": len(updates),
+        "seconds": seconds,
+        "updates_per_second": len(updates) / seconds if seconds else 0.0,
+        "shed_jobs": update_scheduler.shed_count - shed_count,
+        "handlers": handlers,
+        "outbound": dict(client.calls.most_common()),
+        "flood_waits": dict(client.flood_waits)
+    }
+
+
+# Parse the command line
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replay updates through the bot's handlers with a fake client")
+    parser.add_argument("--input", help="JSON lines file of recorded updates, instead of a synthetic stream")
+    parser.add_argument("--save", help="Write the replayed updates to a JSON lines file")
+    parser.add_argument("--updates", type=int, default=5000, help="Number of synthetic updates")
+    parser.add_argument("--chats", type=int, default=20, help="Number of chats in the synthetic stream")
+    parser.add_argument("--users", type=int, default=500, help="Number of users in the synthetic stream")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the synthetic stream and the simulated latency")
+    parser.add_argument("--rate", type=float, default=0, help="Updates per second to replay at (default: as fast as possible)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean latency of outbound calls in seconds")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="Share of outbound calls that get a FloodWait")
+    parser.add_argument("--flood-wait", type=int, default=2, help="Seconds of the simulated FloodWaits")
+    parser.add_argument("--sleep-threshold", type=int, default=10, help="FloodWaits up to this are slept through")
+    parser.add_argument("--settle", type=float, default=0, help="Seconds to keep running after the replay for delayed work")
+    parser.add_argument("--data", help="Database directory to start from, it is copied and left unchanged")
+    parser.add_argument("--keep-data", action="store_true", help="Keep the temporary database directory")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    
+    # Replay against a scratch copy of the databases, set before the bot packages read their settings
+    data_dir = tempfile.mkdtemp(prefix="replay-")
+    if args.data:
+        shutil.copytree(args.data, data_dir, dirs_exist_ok=True)
+    os.environ["DATABASE_DIR"] = data_dir
+    os.environ["SHARED_DATABASE_DIR"] = data_dir
+    os.environ.pop("SHARD_INDEX", None)
+    os.environ.setdefault("LOG_FORMAT", "text")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    
+    from bot.logs import setup_logging
+    setup_logging()
+    
+    random.seed(args.seed)
+    if args.input:
+        records = read_records(args.input)
+    else:
+        records = list(generate_records(args.updates, args.chats, args.users, args.seed))
+    if args.save:
+        with open(args.save, "w") as f:
+            f.writelines(json.dumps(record) + "\n" for record in records)
+    
+    try:
+        report = asyncio.run(replay(args, records))
+    finally:
+        if args.keep_data:
+            print(f"Databases kept in {data_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(data_dir, ignore_errors=True)
+    
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,21 +8,18 @@ import sys
 import logging
 from dotenv import load_dotenv
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
-
 # Check Python version
 if sys.version_info[0] < 3 or (sys.version_info[0] == 3 and sys.version_info[1] < 7):
-    logger.error("You need Python 3.7 or higher to run this bot!")
-    sys.exit(1)
+    sys.exit("You need Python 3.7 or higher to run this bot!")
 
 # Load environment variables
 load_dotenv()
 
+# Configure logging, records are written by a background thread
+from bot.logs import setup_logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
 # Check if required environment variables are set
 required_vars = ["API_ID", "API_HASH", "BOT_TOKEN"]
 missing_vars = [var for var in required_vars if not os.getenv(var)]
@@ -34,10 +31,19 @@ if missing_vars:
 
 # Import and run the bot
 try:
-    from main import app
-    
-    logger.info("Starting the bot...")
-    app.run()
+    shards = int(os.getenv("SHARDS", 1))
+    if shards > 1:
+        # Receive updates here and handle them in one process per shard
+        import asyncio
+        from bot.sharding import run_front
+        
+        logger.info(f"Starting the bot with {shards} shards...")
+        asyncio.run(run_front(shards, os.getenv("API_ID"), os.getenv("API_HASH"), os.getenv("BOT_TOKEN")))
+    else:
+        from main import app, start_bot
+        
+        logger.info("Starting the bot...")
+        app.run(start_bot())
 except ImportError as e:
     logger.error(f"Failed to import the bot: {str(e)}")
     sys.exit(1)
@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# Keep the databases the bot packages create on import out of the repository
+os.environ.setdefault("DATABASE_DIR", tempfile.mkdtemp(prefix="management-bot-tests-"))
@@ -0,0 +1,51 @@
+from bot.database import ChatKeyIndex
+from bot.storage import JSONDatabase
+
+# Index over a database with a few keys
+def make_index(tmp_path):
+    db = JSONDatabase("notes", str(tmp_path))
+    for key in ("-1_rules", "-1_faq", "-1_links", "-2_rules", "-1_rules2", "nochat"):
+        db.data[key] = key
+    return ChatKeyIndex(db), db
+
+def test_names_are_sorted_per_chat(tmp_path):
+    index, _ = make_index(tmp_path)
+    assert index.names("-1") == ["faq", "links", "rules", "rules2"]
+    assert index.names("-2") == ["rules"]
+    assert index.names("-3") == []
+    assert index.count("-1") == 4
+
+def test_pages_and_prefixes(tmp_path):
+    index, _ = make_index(tmp_path)
+    assert index.page("-1", 0, 3) == ["faq", "links", "rules"]
+    assert index.page("-1", 1, 3) == ["rules2"]
+    assert index.page("-1", 2, 3) == []
+    assert index.prefix("-1", "rul", 5) == ["rules", "rules2"]
+    assert index.prefix("-1", "rul", 1) == ["rules"]
+    assert index.prefix("-1", "x", 5) == []
+
+def test_writes_keep_index_and_database_in_sync(tmp_path):
+    index, db = make_index(tmp_path)
+    index.set("-1", "about", "text")
+    index.set("-1", "rules", "new rules")
+    assert index.names("-1") == ["about", "faq", "links", "rules", "rules2"]
+    assert db.get("-1_rules") == "new rules"
+    index.delete("-1", "links")
+    index.delete("-1", "missing")
+    assert index.names("-1") == ["about", "faq", "rules", "rules2"]
+    assert not db.contains("-1_links")
+    assert index.clear("-1") == 4
+    assert index.names("-1") == []
+    assert db.list_keys() == ["-2_rules", "nochat"]
+
+def test_versions_change_on_every_write(tmp_path):
+    index, _ = make_index(tmp_path)
+    versions = [index.version("-1")]
+    index.set("-1", "rules", "new")
+    versions.append(index.version("-1"))
+    index.delete("-1", "rules")
+    versions.append(index.version("-1"))
+    index.clear("-1")
+    versions.append(index.version("-1"))
+    assert len(set(versions)) == 4
+    assert index.version("-2") == 0
@@ -0,0 +1,57 @@
+import json
+
+from bot.database import BlobStore, DedupJSONDatabase
+from bot.storage import JSONDatabase
+
+TEXT = "the chat rules, copied into many notes " * 4
+
+# Deduplicated database with its own blob store, counting blob writes
+def make_database(tmp_path):
+    blobs = JSONDatabase("blobs", str(tmp_path))
+    saves = []
+    save = blobs._save_db
+    blobs._save_db = lambda: saves.append(1) or save()
+    database = DedupJSONDatabase(f"notes-{tmp_path.name}", BlobStore(blobs))
+    return database, blobs, saves
+
+def test_duplicates_are_stored_once(tmp_path):
+    database, blobs, saves = make_database(tmp_path)
+    for chat_id in range(5):
+        database.set(f"-{chat_id}_rules", TEXT)
+    assert len(blobs.data) == 1
+    assert len(saves) == 1
+    assert all(database.get(f"-{chat_id}_rules") == TEXT for chat_id in range(5))
+
+def test_short_values_stay_inline(tmp_path):
+    database, blobs, _ = make_database(tmp_path)
+    database.set("-1_hi", "hello")
+    assert database.data["-1_hi"] == "hello"
+    assert not blobs.data
+
+def test_large_values_are_compressed(tmp_path):
+    database, blobs, _ = make_database(tmp_path)
+    database.set("-1_rules", TEXT * 10)
+    blob = next(iter(blobs.data.values()))
+    assert blob["z"] and len(blob["data"]) < len(TEXT * 10)
+    assert database.get("-1_rules") == TEXT * 10
+
+def test_last_reference_deletes_the_blob(tmp_path):
+    database, blobs, _ = make_database(tmp_path)
+    database.set("-1_rules", TEXT)
+    database.set("-2_rules", TEXT)
+    database.delete("-1_rules")
+    assert len(blobs.data) == 1
+    database.set("-2_rules", "short")
+    database.delete("-2_rules")
+    assert not blobs.data
+
+def test_collect_recounts_stale_references(tmp_path):
+    database, blobs, _ = make_database(tmp_path)
+    database.set("-1_rules", TEXT)
+    database.set("-2_rules", TEXT)
+    # Only the first reference was written to the blob file
+    assert next(iter(json.load(open(blobs.db_path)).values()))["refs"] == 1
+    blobs = JSONDatabase("blobs", str(tmp_path))
+    store = BlobStore(blobs)
+    store.collect([database])
+    assert next(iter(blobs.data.values()))["refs"] == 2
@@ -0,0 +1,101 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from pyrogram.errors import FloodWait
+
+from bot.utils.helpers import extract_users, gather_bounded, split_text
+
+# Fake client resolving every identifier
+class FakeClient:
+    async def get_users(self, identifiers):
+        if isinstance(identifiers, list):
+            return [SimpleNamespace(id=identifier) for identifier in identifiers]
+        return SimpleNamespace(id=identifiers)
+
+# Build a command message
+def make_message(text, reply_user=None):
+    reply = SimpleNamespace(from_user=reply_user) if reply_user else None
+    return SimpleNamespace(command=text.split(), reply_to_message=reply, _client=FakeClient())
+
+# Extract the users and arguments of a command
+def extract(text, reply_user=None):
+    users, missing, args = asyncio.run(extract_users(make_message(text, reply_user)))
+    return [user.id for user in users], missing, args
+
+def test_username_and_duration():
+    assert extract("tban @user 30") == (["user"], [], ["30"])
+
+def test_short_numbers_are_arguments():
+    assert extract("warn 123 5 spam") == ([], [], ["123", "5", "spam"])
+
+def test_user_id_and_count():
+    assert extract("warn 123456789 5 spam") == ([123456789], [], ["5", "spam"])
+
+def test_several_users_and_reason():
+    assert extract("ban @a 123456789 @b flooding") == (["a", 123456789, "b"], [], ["flooding"])
+
+def test_reply_with_duration():
+    user = SimpleNamespace(id=42)
+    assert extract("tmute 2h", reply_user=user) == ([42], [], ["2h"])
+
+def test_reply_with_number():
+    user = SimpleNamespace(id=42)
+    assert extract("tban 30", reply_user=user) == ([42], [], ["30"])
+
+def test_split_text_at_spaces():
+    assert split_text("aaa bbb ccc", 7) == ["aaa bbb", "ccc"]
+
+def test_split_text_prefers_line_breaks():
+    assert split_text("aa bb\ncc dd", 9) == ["aa bb", "cc dd"]
+
+def test_split_text_cuts_long_words():
+    assert split_text("abcdefgh", 3) == ["abc", "def", "gh"]
+
+def test_split_short_text():
+    assert split_text("short", 4096) == ["short"]
+
+def test_flood_wait_is_retried_without_holding_a_slot():
+    calls = []
+    
+    async def call(item):
+        calls.append((item, time.monotonic()))
+        if item == "flooded" and len(calls) == 1:
+            raise FloodWait(value=1)
+        return item
+    
+    async def main():
+        start = time.monotonic()
+        results = await gather_bounded(call, ["flooded", "next"], limit=1)
+        return start, results
+    
+    start, results = asyncio.run(main())
+    assert results == ["flooded", "next"]
+    # Both calls waited for the same pause, after the flooded call left its slot
+    assert sorted(item for item, _ in calls[1:]) == ["flooded", "next"]
+    assert all(at - start >= 1 for item, at in calls[1:])
+
+def test_flood_wait_is_shared_between_calls():
+    async def flooded(item):
+        raise FloodWait(value=1)
+    
+    async def ok(item):
+        return time.monotonic()
+    
+    async def main():
+        start = time.monotonic()
+        first = asyncio.ensure_future(gather_bounded(flooded, [1]))
+        await asyncio.sleep(0)
+        second = await gather_bounded(ok, [1])
+        return start, await first, second
+    
+    start, first, second = asyncio.run(main())
+    assert isinstance(first[0], FloodWait)
+    assert second[0] - start >= 1
+
+def test_long_flood_wait_is_returned():
+    async def flooded(item):
+        raise FloodWait(value=120)
+    
+    results = asyncio.run(gather_bounded(flooded, [1], max_flood_wait=60))
+    assert isinstance(results[0], FloodWait)
@@ -0,0 +1,83 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from bot.storage import JSONDatabase
+from bot.utils.scheduler import ActionScheduler, KICK_UNBAN_DELAY, action_scheduler, kick_member
+
+# Scheduler on its own database
+def make_scheduler(tmp_path):
+    return ActionScheduler(JSONDatabase("scheduler", str(tmp_path)))
+
+def test_due_actions_pop_in_time_order(tmp_path):
+    scheduler = make_scheduler(tmp_path)
+    scheduler.schedule("unban", -1, 3, 30)
+    scheduler.schedule("unban", -1, 1, 10)
+    scheduler.schedule("unmute", -1, 2, 20)
+    scheduler.schedule("unban", -1, 4, 1000)
+    assert scheduler._pop_due(time.time() + 60) == [("unban", -1, 1), ("unmute", -1, 2), ("unban", -1, 3)]
+    assert len(scheduler) == 1
+
+def test_rescheduling_replaces_the_due_time(tmp_path):
+    scheduler = make_scheduler(tmp_path)
+    scheduler.schedule("unban", -1, 1, 10)
+    scheduler.schedule("unban", -1, 1, 1000)
+    assert scheduler._pop_due(time.time() + 60) == []
+    assert scheduler.is_scheduled("unban", -1, 1)
+
+def test_cancel(tmp_path):
+    scheduler = make_scheduler(tmp_path)
+    scheduler.schedule("unban", -1, 1, 10)
+    assert scheduler.cancel("unban", -1, 1)
+    assert not scheduler.cancel("unban", -1, 1)
+    assert scheduler._pop_due(time.time() + 60) == []
+
+def test_journal_is_replayed_after_a_restart(tmp_path):
+    scheduler = make_scheduler(tmp_path)
+    scheduler.schedule("unban", -1, 1, 100)
+    scheduler.schedule("unmute", -1, 2, 200)
+    scheduler.schedule("unban", -1, 3, 300)
+    scheduler.cancel("unmute", -1, 2)
+    
+    # No snapshot was written, everything comes from the journal
+    restarted = make_scheduler(tmp_path)
+    assert set(restarted._pending) == {("unban", -1, 1), ("unban", -1, 3)}
+    assert restarted.get_run_at("unban", -1, 1) == scheduler.get_run_at("unban", -1, 1)
+
+def test_ran_actions_stay_done_after_a_restart(tmp_path):
+    scheduler = make_scheduler(tmp_path)
+    ran = []
+    
+    @scheduler.register("unban")
+    async def unban(client, chat_id, user_id):
+        ran.append(user_id)
+    
+    async def run():
+        scheduler.schedule("unban", -1, 1, 0)
+        scheduler.schedule("unban", -1, 2, 1000)
+        await scheduler.start(None)
+        # Wait until the run was journaled
+        for _ in range(100):
+            if ran and not scheduler._running:
+                break
+            await asyncio.sleep(0.01)
+        await scheduler.stop()
+    
+    asyncio.run(run())
+    assert ran == [1]
+    assert set(make_scheduler(tmp_path)._pending) == {("unban", -1, 2)}
+
+def test_kick_keeps_a_later_unban():
+    chat = SimpleNamespace(id=-42)
+    async def ban_member(user_id):
+        pass
+    chat.ban_member = ban_member
+    
+    action_scheduler.schedule("unban", chat.id, 1, 3600)
+    asyncio.run(kick_member(chat, 1))
+    assert action_scheduler.get_run_at("unban", chat.id, 1) > time.time() + 3000
+    
+    asyncio.run(kick_member(chat, 2))
+    assert action_scheduler.get_run_at("unban", chat.id, 2) <= time.time() + KICK_UNBAN_DELAY
+    action_scheduler.cancel("unban", chat.id, 1)
+    action_scheduler.cancel("unban", chat.id, 2)
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import os
+
+from pyrogram import Client, raw
+
+from bot import sharding
+from bot.sharding import (
+    HashRing,
+    decode_packet,
+    dispatch_packet,
+    encode_packet,
+    get_raw_chat_id,
+    prepare_shard_databases
+)
+
+# Build a routed packet of a group message
+def make_packet():
+    message = raw.types.Message(
+        id=1,
+        peer_id=raw.types.PeerChannel(channel_id=123),
+        from_id=raw.types.PeerUser(user_id=5),
+        date=0,
+        message="hello"
+    )
+    update = raw.types.UpdateNewChannelMessage(message=message, pts=1, pts_count=1)
+    users = {5: raw.types.User(id=5, access_hash=99, first_name="User")}
+    chats = {123: raw.types.Channel(id=123, title="Chat", photo=raw.types.ChatPhotoEmpty(), date=0, access_hash=77)}
+    return update, users, chats
+
+def test_packet_round_trip():
+    update, users, chats = decode_packet(encode_packet(*make_packet()))
+    assert update.message.message == "hello"
+    assert users[5].access_hash == 99
+    assert chats[123].access_hash == 77
+    assert get_raw_chat_id(update) == -1000000000123
+
+def test_dispatch_packet_stores_peers():
+    async def dispatch():
+        client = Client("test_shard", api_id=1, api_hash="hash", in_memory=True, no_updates=True)
+        await client.storage.open()
+        try:
+            packet = make_packet()
+            await dispatch_packet(client, packet)
+            assert client.dispatcher.updates_queue.get_nowait() is packet
+            user = await client.storage.get_peer_by_id(5)
+            chat = await client.storage.get_peer_by_id(-1000000000123)
+            return user, chat
+        finally:
+            await client.storage.close()
+    
+    user, chat = asyncio.run(dispatch())
+    assert isinstance(user, raw.types.InputPeerUser) and user.access_hash == 99
+    assert isinstance(chat, raw.types.InputPeerChannel) and chat.access_hash == 77
+
+def test_hash_ring_spreads_chats_over_all_shards():
+    ring = HashRing(4)
+    shards = [ring.get_shard(-1000000000000 - chat) for chat in range(4000)]
+    assert shards == [HashRing(4).get_shard(-1000000000000 - chat) for chat in range(4000)]
+    assert all(600 < shards.count(shard) < 1400 for shard in range(4))
+
+def test_hash_ring_only_moves_chats_to_an_added_shard():
+    before, after = HashRing(3), HashRing(4)
+    chats = [-1000000000000 - chat for chat in range(4000)]
+    moved = [chat for chat in chats if before.get_shard(chat) != after.get_shard(chat)]
+    assert all(after.get_shard(chat) == 3 for chat in moved)
+    assert 0 < len(moved) < len(chats) / 2
+
+# Point the sharding module at a temporary database directory
+def use_database_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(sharding, "DATABASE_DIR", str(tmp_path))
+    monkeypatch.setattr(sharding, "SHARED_DATABASE_DIR", str(tmp_path))
+    monkeypatch.setattr(sharding, "SHARD_MARKER", f"{tmp_path}/shards.json")
+
+# Read every database of a layout back into one
+def read_merged(shards):
+    merged = {}
+    for data_dir in sharding.get_shard_dirs(shards):
+        for name in ("settings", "scheduler"):
+            with open(f"{data_dir}/{name}.json") as f:
+                for key, value in json.load(f).items():
+                    if key == "pending":
+                        merged.setdefault((name, key), []).extend(value)
+                    else:
+                        merged[(name, key)] = value
+    merged[("scheduler", "pending")].sort()
+    return merged
+
+# Read the journal lines of every shard
+def read_journal_lines(shards):
+    lines = []
+    for data_dir in sharding.get_shard_dirs(shards):
+        path = f"{data_dir}/scheduler.json.journal"
+        if os.path.exists(path):
+            with open(path) as f:
+                lines.extend(line.strip() for line in f)
+    return sorted(lines)
+
+def test_split_and_merge_round_trip(monkeypatch, tmp_path):
+    use_database_dir(monkeypatch, tmp_path)
+    chats = [-1000000000000 - chat for chat in range(30)]
+    settings = {f"{chat}_flood_limit": i for i, chat in enumerate(chats)}
+    settings["global_key"] = "everywhere"
+    pending = [["unban", chat, 5, 100.0] for chat in chats]
+    journal = [json.dumps(["schedule", "unmute", chat, 6, 200.0]) for chat in chats]
+    with open(f"{tmp_path}/settings.json", "w") as f:
+        json.dump(settings, f)
+    with open(f"{tmp_path}/scheduler.json", "w") as f:
+        json.dump({"pending": pending}, f)
+    with open(f"{tmp_path}/scheduler.json.journal", "w") as f:
+        f.write("\n".join(journal) + "\n")
+    with open(f"{tmp_path}/connections.json", "w") as f:
+        json.dump({"42_connection": chats[0]}, f)
+    original = read_merged(1)
+    
+    prepare_shard_databases(3)
+    ring = HashRing(3)
+    for shard, data_dir in enumerate(sharding.get_shard_dirs(3)):
+        with open(f"{data_dir}/settings.json") as f:
+            shard_settings = json.load(f)
+        # Chat keys live on the shard owning the chat, others on every shard
+        assert shard_settings["global_key"] == "everywhere"
+        assert all(
+            ring.get_shard(sharding.get_key_chat_id(key)) == shard
+            for key in shard_settings if key != "global_key"
+        )
+        with open(f"{data_dir}/scheduler.json") as f:
+            assert all(ring.get_shard(entry[1]) == shard for entry in json.load(f)["pending"])
+    # The main directory keeps only the shared databases and the marker
+    assert sorted(os.listdir(tmp_path)) == ["connections.json", "shard-0", "shard-1", "shard-2", "shards.json"]
+    assert read_merged(3) == original
+    assert read_journal_lines(3) == sorted(journal)
+    
+    prepare_shard_databases(2)
+    assert read_merged(2) == original
+    assert read_journal_lines(2) == sorted(journal)
+    
+    prepare_shard_databases(1)
+    assert not os.path.exists(f"{tmp_path}/shards.json")
+    assert not os.path.exists(f"{tmp_path}/shard-0")
+    assert read_merged(1) == original
+    assert read_journal_lines(1) == sorted(journal)
+    with open(f"{tmp_path}/connections.json") as f:
+        assert json.load(f) == {"42_connection": chats[0]}
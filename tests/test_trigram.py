@@ -0,0 +1,63 @@
+from bot.utils.trigram import TrigramIndex, trigrams
+
+NOTES = {"-1": [("rules", "rules"), ("welcome", "welcome"), ("links", "useful links")]}
+
+# Index over a fixed set of notes, counting loads per chat
+def make_index(**kwargs):
+    loads = []
+    
+    def loader(chat_id):
+        loads.append(chat_id)
+        return NOTES.get(chat_id, [])
+    
+    return TrigramIndex(loader, **kwargs), loads
+
+def test_trigrams_are_padded_per_word():
+    assert trigrams("Hi") == {"  h", " hi", "hi "}
+    assert trigrams("a_b") == {"  a", " a ", "  b", " b "}
+    assert trigrams("!!") == frozenset()
+
+def test_typo_finds_the_closest_name():
+    index, _ = make_index()
+    assert index.search("-1", "rulez")[0][0] == "rules"
+    assert index.search("-1", "welcom")[0][0] == "welcome"
+    assert index.search("-1", "zzz") == []
+
+def test_exact_match_scores_one():
+    index, _ = make_index()
+    assert index.search("-1", "rules")[0] == ("rules", 1.0)
+
+def test_containment_matches_part_of_the_text():
+    index, _ = make_index()
+    assert index.search("-1", "links", containment=True)[0] == ("links", 1.0)
+    assert index.search("-1", "links")[0][1] < 1.0
+
+def test_chats_are_loaded_once_on_first_search():
+    index, loads = make_index()
+    index.add("-1", "ignored", "ignored before loading")
+    assert loads == []
+    index.search("-1", "rules")
+    index.search("-1", "links")
+    index.search("-2", "rules")
+    assert loads == ["-1", "-2"]
+    assert index.search("-1", "ignored") == []
+
+def test_add_remove_and_clear_keep_postings_in_sync():
+    index, loads = make_index()
+    index.search("-1", "rules")
+    index.add("-1", "faq", "frequently asked questions")
+    assert index.search("-1", "questions", containment=True)[0][0] == "faq"
+    index.add("-1", "faq", "answers")
+    assert index.search("-1", "questions", containment=True) == []
+    index.remove("-1", "faq")
+    assert index.search("-1", "answers") == []
+    assert all(postings for postings in index._postings["-1"].values())
+    index.clear("-1")
+    index.search("-1", "rules")
+    assert loads == ["-1", "-1"]
+
+def test_long_texts_are_truncated():
+    index, _ = make_index(max_text_length=5)
+    index.search("-1", "rules")
+    index.add("-1", "long", "short" + " tail" * 100)
+    assert index.search("-1", "tail", containment=True) == []
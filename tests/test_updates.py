@@ -0,0 +1,107 @@
+import asyncio
+
+from bot.utils.updates import PRIORITY_LOW, UpdateScheduler
+
+# Run a coroutine with a started scheduler
+def run_with(scheduler, test):
+    async def main():
+        await scheduler.start()
+        try:
+            return await test()
+        finally:
+            await scheduler.stop()
+    return asyncio.run(main())
+
+# Job recording its key once the gate opens
+def make_job(log, gate, key):
+    async def job():
+        await gate.wait()
+        log.append(key)
+    return job
+
+def test_jobs_of_a_chat_run_in_order():
+    scheduler = UpdateScheduler(workers=4)
+    log = []
+    
+    async def test():
+        gate = asyncio.Event()
+        for i in range(10):
+            await scheduler.submit(1, make_job(log, gate, i))
+        gate.set()
+        await scheduler.join()
+    
+    run_with(scheduler, test)
+    assert log == list(range(10))
+
+def test_chats_take_turns():
+    scheduler = UpdateScheduler(workers=1)
+    log = []
+    
+    async def test():
+        gate = asyncio.Event()
+        for i in range(3):
+            await scheduler.submit(1, make_job(log, gate, ("a", i)))
+        for i in range(3):
+            await scheduler.submit(2, make_job(log, gate, ("b", i)))
+        gate.set()
+        await scheduler.join()
+    
+    run_with(scheduler, test)
+    assert [chat for chat, _ in log] == ["a", "b", "a", "b", "a", "b"]
+
+def test_low_priority_jobs_are_shed_when_full():
+    scheduler = UpdateScheduler(workers=1, max_chat_queue=2)
+    log = []
+    
+    async def test():
+        gate = asyncio.Event()
+        await scheduler.submit(1, make_job(log, gate, "running"))
+        await asyncio.sleep(0)
+        await scheduler.submit(1, make_job(log, gate, "old"), PRIORITY_LOW)
+        await scheduler.submit(1, make_job(log, gate, "high"))
+        # The oldest low priority job makes room for the new one
+        assert await scheduler.submit(1, make_job(log, gate, "new"), PRIORITY_LOW)
+        gate.set()
+        await scheduler.join()
+    
+    run_with(scheduler, test)
+    assert log == ["running", "high", "new"]
+    assert scheduler.shed_count == 1
+
+def test_full_chat_does_not_hold_up_others():
+    scheduler = UpdateScheduler(workers=1, max_chat_queue=2, hard_chat_queue=4)
+    log = []
+    
+    async def test():
+        gate = asyncio.Event()
+        # High priority jobs go past the chat limit without waiting, up to the hard limit
+        results = [await asyncio.wait_for(scheduler.submit(1, make_job(log, gate, "a")), 1) for _ in range(6)]
+        assert await asyncio.wait_for(scheduler.submit(2, make_job(log, gate, "b")), 1)
+        gate.set()
+        await scheduler.join()
+        return results
+    
+    results = run_with(scheduler, test)
+    assert results.count(True) == 5 and results[-1] is False
+    assert log.count("a") == 5 and "b" in log
+
+def test_total_limit_makes_high_priority_jobs_wait():
+    scheduler = UpdateScheduler(workers=1, max_total=2)
+    log = []
+    
+    async def test():
+        gate = asyncio.Event()
+        # One running job and two queued ones
+        await scheduler.submit(0, make_job(log, gate, 0))
+        await asyncio.sleep(0)
+        for i in range(1, 3):
+            await scheduler.submit(i, make_job(log, gate, i))
+        waiting = asyncio.ensure_future(scheduler.submit(3, make_job(log, gate, 3)))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        gate.set()
+        assert await waiting
+        await scheduler.join()
+    
+    run_with(scheduler, test)
+    assert sorted(log) == [0, 1, 2, 3]
@@ -0,0 +1,52 @@
+import heapq
+import random
+import time
+
+from bot.database import warnings_db
+from bot.modules.warnings import WARNSTATS_TOP_K, get_warn_stats, get_warns, set_warns
+
+# A warning issued now
+def warning():
+    return {"time": time.time(), "reason": "", "by": None}
+
+def test_aggregates_match_a_recount():
+    random.seed(7)
+    chat_id = -1001
+    issued = 0
+    for _ in range(300):
+        user_id = random.randint(1, 25)
+        warns = get_warns(chat_id, user_id)
+        if random.random() < 0.7:
+            set_warns(chat_id, user_id, warns + [warning()], issued=True)
+            issued += 1
+        elif random.random() < 0.5:
+            set_warns(chat_id, user_id, warns[1:])
+        else:
+            set_warns(chat_id, user_id, [])
+    
+    counts = {
+        key.split("_")[1]: len(warnings_db.get(key))
+        for key in warnings_db.list_keys()
+        if key.startswith(f"{chat_id}_") and key.endswith("_warns")
+    }
+    stats = get_warn_stats(chat_id)
+    assert stats["users"] == counts
+    assert stats["total"] == sum(counts.values())
+    expected = heapq.nlargest(WARNSTATS_TOP_K, counts.values())
+    assert [count for _, count in stats["top"]] == expected
+    assert all(counts[user] == count for user, count in stats["top"])
+    assert sum(stats["days"].values()) == issued
+
+def test_old_warnings_never_go_negative():
+    chat_id = -1002
+    # Stored before stats were kept
+    warnings_db.set(f"{chat_id}_5_warns", [warning(), warning()])
+    set_warns(chat_id, 5, [])
+    stats = get_warn_stats(chat_id)
+    assert stats["total"] == 0 and stats["users"] == {} and stats["top"] == []
+
+def test_old_days_are_dropped():
+    chat_id = -1003
+    warnings_db.set(f"{chat_id}_warnstats", {"total": 0, "users": {}, "top": [], "days": {"2000-01-01": 4}})
+    set_warns(chat_id, 6, [warning()], issued=True)
+    assert list(get_warn_stats(chat_id)["days"].values()) == [1]
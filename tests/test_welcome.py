@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+from bot.modules.welcome import MAX_MESSAGE_LENGTH, compile_welcome, render_welcomes
+
+# Member with a name of the given length
+def make_member(user_id, name_length=10, last_name=None):
+    name = str(user_id).rjust(name_length, "x")
+    return SimpleNamespace(
+        id=user_id,
+        first_name=name,
+        last_name=last_name,
+        mention=f"[{name}](tg://user?id={user_id})",
+        username=None
+    )
+
+def test_small_group_is_one_message():
+    template = compile_welcome("Hi {first} ({last}), welcome to {chat}!")
+    members = [make_member(1, last_name="Smith"), make_member(2), make_member(3, last_name="Doe")]
+    assert render_welcomes(template, members, "Chat") == [
+        "Hi xxxxxxxxx1, xxxxxxxxx2, xxxxxxxxx3 (Smith, Doe), welcome to Chat!"
+    ]
+
+def test_chunks_stay_within_the_limit():
+    template = compile_welcome("Welcome {mention}! IDs: {id}, names: {first} {first}")
+    members = [make_member(100000 + i, name_length=40) for i in range(500)]
+    texts = render_welcomes(template, members, "Chat")
+    assert len(texts) > 1
+    assert all(len(text) <= MAX_MESSAGE_LENGTH for text in texts)
+    # Every member is welcomed once, in order
+    mentioned = [member.mention for member in members]
+    assert [m for text in texts for m in mentioned if m in text] == mentioned
+
+def test_chunks_are_filled_up():
+    template = compile_welcome("{first}")
+    members = [make_member(i, name_length=98) for i in range(100)]
+    texts = render_welcomes(template, members, "Chat")
+    # 40 names of 98 characters with separators take 3998, a 41st would need 4098
+    assert [len(text) for text in texts] == [3998, 3998, 1998]
+
+def test_single_long_welcome_is_split():
+    template = compile_welcome("{first}")
+    texts = render_welcomes(template, [make_member(1, name_length=MAX_MESSAGE_LENGTH + 10)], "Chat")
+    assert [len(text) for text in texts] == [MAX_MESSAGE_LENGTH, 10]